@@ -0,0 +1,166 @@
+"""
+Bundles of the JS and CSS files listed in the leaflet_storage/js.html and
+leaflet_storage/css.html templates: one CSS bundle, and one JS bundle per
+locale, each concatenated, minified (when rjsmin and rcssmin are
+installed) and fingerprinted, in STATIC_ROOT/storage/bundles/.
+
+Build them with the storageassets command (after storagei18n), then set
+LEAFLET_STORAGE_ASSETS_BUNDLES so leaflet_storage_js and
+leaflet_storage_css emit one tag each. Bundles names change with their
+content, so they can be served with a far future expiry.
+"""
+import hashlib
+import io
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template.loader import render_to_string
+from django.utils.encoding import force_bytes
+
+from . import serialization
+from .utils import atomic_write, gzip_content
+
+BUNDLES_DIR = "storage/bundles"
+MANIFEST = "manifest.json"
+SRC_RE = re.compile(r'<script src="([^"]+)"')
+HREF_RE = re.compile(r'<link rel="stylesheet" href="([^"]+)"')
+URL_RE = re.compile(r'url\(\s*(["\']?)([^)"\']+)\1\s*\)')
+
+
+def list_js(locale=None):
+    html = render_to_string('leaflet_storage/js.html', {'STATIC_URL': '', 'locale': locale})
+    return SRC_RE.findall(html)
+
+
+def list_css():
+    html = render_to_string('leaflet_storage/css.html', {'STATIC_URL': ''})
+    return HREF_RE.findall(html)
+
+
+def find(path):
+    """
+    Return the absolute path of the static file `path`, looking also in
+    STATIC_ROOT, where storagei18n writes the locales.
+    """
+    found = finders.find(path)
+    if not found and settings.STATIC_ROOT:
+        found = os.path.join(settings.STATIC_ROOT, path)
+        if not os.path.exists(found):
+            found = None
+    if not found:
+        raise ValueError("Static file %s not found" % path)
+    return found
+
+
+def read(path):
+    with io.open(find(path), encoding='utf-8') as f:
+        return f.read()
+
+
+def minify_js(content):
+    try:
+        import rjsmin
+    except ImportError:
+        return content
+    return rjsmin.jsmin(content)
+
+
+def minify_css(content):
+    try:
+        import rcssmin
+    except ImportError:
+        return content
+    return rcssmin.cssmin(content)
+
+
+def rewrite_urls(content, path):
+    """
+    Make the relative url() of the CSS file `path` relative to the bundles
+    directory.
+    """
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(base, url))
+        return 'url("%s")' % posixpath.relpath(target, BUNDLES_DIR)
+
+    return URL_RE.sub(replace, content)
+
+
+def build_js(locale=None):
+    # Files may not end with a semicolon.
+    return u";\n".join(minify_js(read(path)) for path in list_js(locale))
+
+
+def build_css():
+    return u"\n".join(minify_css(rewrite_urls(read(path), path)) for path in list_css())
+
+
+def write_bundle(name, ext, content):
+    """
+    Write `content` and its gzipped version in a fingerprinted file, and
+    return its path relative to STATIC_ROOT.
+    """
+    content = force_bytes(content)
+    path = posixpath.join(BUNDLES_DIR, "%s.%s.%s" % (
+        name, hashlib.md5(content).hexdigest()[:12], ext))
+    absolute = os.path.join(settings.STATIC_ROOT, path)
+    atomic_write(absolute, content)
+    atomic_write(absolute + '.gz', gzip_content(content))
+    return path
+
+
+def build_all(locales):
+    """
+    Build the CSS bundle and the JS bundles, without locale and for each
+    of `locales`, then write the manifest.
+    """
+    directory = os.path.join(settings.STATIC_ROOT, BUNDLES_DIR)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    manifest = {
+        'css': write_bundle('leaflet_storage', 'css', build_css()),
+        'js': {'': write_bundle('leaflet_storage', 'js', build_js())},
+    }
+    for locale in locales:
+        manifest['js'][locale] = write_bundle(
+            'leaflet_storage.%s' % locale, 'js', build_js(locale))
+    atomic_write(os.path.join(directory, MANIFEST),
+                 force_bytes(serialization.dumps(manifest, indent=2)))
+    _manifests.clear()
+    return manifest
+
+
+_manifests = {}
+
+
+def get_manifest():
+    path = os.path.join(settings.STATIC_ROOT, BUNDLES_DIR, MANIFEST)
+    if path not in _manifests:
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                _manifests[path] = serialization.loads(f.read())
+        except IOError:
+            _manifests[path] = None
+    return _manifests[path]
+
+
+def get_bundle(kind, locale=None):
+    """
+    Return the path of the `kind` ("js" or "css") bundle, or None when
+    bundles are not enabled or not built.
+    """
+    if not getattr(settings, 'LEAFLET_STORAGE_ASSETS_BUNDLES', False):
+        return None
+    manifest = get_manifest()
+    if not manifest:
+        return None
+    if kind == 'css':
+        return manifest['css']
+    return manifest['js'].get(locale or '')
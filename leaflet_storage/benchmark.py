@@ -0,0 +1,260 @@
+"""
+Benchmarks of the map and datalayer hot paths.
+
+Data are seeded with the factories of leaflet_storage.tests (factory_boy
+is needed), inside a transaction rolled back at the end, and the written
+files are removed.
+
+Run them with the storagebench management command, or from pytest-benchmark:
+
+    def test_map_view(benchmark):
+        bench(benchmark, 'map_view', datalayers=20)
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.db import transaction, connection
+from django.db.models.signals import post_save
+from django.template import Template, Context
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from .instrumentation import get_max_rss_kb
+from .models import Map, DataLayer
+from . import serialization
+
+DEFAULTS = {
+    'datalayers': 5,
+    'features': 100,
+    'editors': 5,
+    'tilelayers': 5,
+    'pictograms': 100,
+    'seed': 42,
+}
+PASSWORD = "benchmark"
+
+
+def feature_collection(count, rand):
+    features = []
+    for i in range(count):
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [rand.uniform(-180, 180), rand.uniform(-85, 85)]
+            },
+            "properties": {
+                "name": "Feature %s" % i,
+                "description": "Description of feature %s" % i,
+            }
+        })
+    return {"type": "FeatureCollection", "features": features, "_storage": {}}
+
+
+class Scenario(object):
+    """
+    One map with its datalayers, editors, plus tilelayers and pictograms.
+    """
+
+    def __init__(self, **params):
+        from .tests.base import (UserFactory, MapFactory, DataLayerFactory,
+                                 TileLayerFactory, PictogramFactory)
+        self.params = dict(DEFAULTS, **params)
+        rand = random.Random(self.params['seed'])
+        self.owner = UserFactory(username="bench-owner", password=PASSWORD)
+        for i in range(self.params['tilelayers']):
+            TileLayerFactory(name="Bench tilelayer %s" % i, rank=i)
+        for i in range(self.params['pictograms']):
+            PictogramFactory(name="Bench pictogram %s" % i)
+        self.map = MapFactory(owner=self.owner, edit_status=Map.EDITORS)
+        for i in range(self.params['editors']):
+            self.map.editors.add(UserFactory(username="bench-editor-%s" % i))
+        self.geojson = serialization.dumps(
+            feature_collection(self.params['features'], rand)
+        )
+        for i in range(self.params['datalayers']):
+            self.datalayer = DataLayerFactory(
+                map=self.map,
+                name="Bench datalayer %s" % i,
+                geojson__data=self.geojson
+            )
+        self.client = Client()
+        self.client.login(username=self.owner.username, password=PASSWORD)
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def seeded(**params):
+    """
+    Yield a Scenario, then remove all its data.
+    """
+    paths = set()
+    thread = threading.current_thread()
+
+    def record(sender, instance, **kwargs):
+        # Only ours: the database may be in use meanwhile.
+        if instance.geojson and threading.current_thread() is thread:
+            paths.add(instance.geojson.path)
+
+    # Layers, clones and updates all write their own file.
+    post_save.connect(record, sender=DataLayer, weak=False)
+    try:
+        with transaction.atomic():
+            try:
+                yield Scenario(**params)
+            finally:
+                post_save.disconnect(record, sender=DataLayer)
+                _remove_files(paths)
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def _remove_files(paths):
+    """
+    Remove the datalayer files at `paths`, the files derived from them
+    (gzipped copy, indexes), and their directories once empty.
+    """
+    for path in paths:
+        directory, base = os.path.split(path)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name == base or name.startswith(base + '.'):
+                os.remove(os.path.join(directory, name))
+    for directory in set(os.path.dirname(path) for path in paths):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # Not empty: some files are not ours.
+            pass
+
+
+def _consume(response):
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    return response
+
+
+def map_view(scenario):
+    url = reverse('map', args=(scenario.map.slug, scenario.map.pk))
+    return lambda: scenario.client.get(url)
+
+
+def map_view_geojson(scenario):
+    url = reverse('map_geojson', args=(scenario.map.pk, ))
+    return lambda: scenario.client.get(url)
+
+
+def datalayer_view_identity(scenario):
+    url = reverse('datalayer_view', args=(scenario.datalayer.pk, ))
+    return lambda: _consume(scenario.client.get(url))
+
+
+def datalayer_view_gzip(scenario):
+    url = reverse('datalayer_view', args=(scenario.datalayer.pk, ))
+    return lambda: _consume(scenario.client.get(url, HTTP_ACCEPT_ENCODING='gzip'))
+
+
+def datalayer_update(scenario):
+    url = reverse('datalayer_update', args=(scenario.map.pk, scenario.datalayer.pk))
+
+    def update():
+        # A new upload each time, so the content is written and its stats
+        # computed.
+        return scenario.client.post(url, {
+            'name': scenario.datalayer.name,
+            'display_on_load': True,
+            'geojson': SimpleUploadedFile("layer.geojson", scenario.geojson.encode('utf-8'))
+        })
+    return update
+
+
+def map_clone(scenario):
+    return lambda: scenario.map.clone()
+
+
+def map_fragment(scenario):
+    template = Template(
+        "{% load leaflet_storage_tags %}"
+        "{% for map in maps %}{% map_fragment map %}{% endfor %}"
+    )
+    maps = Map.objects.for_fragments().filter(owner=scenario.owner)
+    return lambda: template.render(Context({'maps': maps.all()}))
+
+
+def pictogram_list(scenario):
+    url = reverse('pictogram_list_json')
+    return lambda: scenario.client.get(url)
+
+
+BENCHMARKS = (
+    ('map_view', map_view),
+    ('map_view_geojson', map_view_geojson),
+    ('datalayer_view_identity', datalayer_view_identity),
+    ('datalayer_view_gzip', datalayer_view_gzip),
+    ('map_fragment', map_fragment),
+    ('pictogram_list', pictogram_list),
+    # Those two create data, keep them last.
+    ('datalayer_update', datalayer_update),
+    ('map_clone', map_clone),
+)
+
+
+def measure(func, repeat):
+    """
+    Run func `repeat` times, return latency (ms), queries count of one run
+    and peak RSS increase (KB).
+    """
+    func()  # Warm up caches.
+    rss = get_max_rss_kb()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return {
+        'latency_ms': {
+            'min': timings[0],
+            'median': timings[len(timings) // 2],
+            'max': timings[-1],
+            'mean': sum(timings) / len(timings),
+        },
+        'queries': len(queries),
+        'peak_rss_increase_kb': get_max_rss_kb() - rss,
+    }
+
+
+def run(names=None, repeat=10, **params):
+    """
+    Run the benchmarks called `names` (all by default) and return the
+    results as a dict.
+    """
+    results = {}
+    with seeded(**params) as scenario:
+        for name, factory in BENCHMARKS:
+            if names and name not in names:
+                continue
+            results[name] = measure(factory(scenario), repeat)
+        params = scenario.params
+    return {'params': params, 'repeat': repeat, 'results': results}
+
+
+def bench(benchmark, name, **params):
+    """
+    Entrypoint for pytest-benchmark, `benchmark` being its fixture.
+    """
+    with seeded(**params) as scenario:
+        return benchmark(dict(BENCHMARKS)[name](scenario))
@@ -0,0 +1,309 @@
+"""
+Server side clustering of the points of a datalayer, so clients of dense
+layers only get the clusters of the tiles they display.
+
+Clusters are the cells of a grid of LEAFLET_STORAGE_CLUSTER_RADIUS
+pixels, in the Web Mercator pixel space of each zoom. Cells of a zoom
+are made of 2 x 2 cells of the next one, so the pyramid is computed from
+LEAFLET_STORAGE_CLUSTER_MAX_ZOOM up, each zoom by aggregating the
+previous one, all vectorised with NumPy. Above the max zoom, the points
+are served as they are.
+
+The pyramid is stored next to the layer file ("<layer>.clusters.npz"),
+with the byte span of each point feature in the layer file, so the
+features left alone in their cell are read back without parsing the
+whole layer. It is built when the layer content is saved with
+LEAFLET_STORAGE_CLUSTERS, or on first request otherwise. An outdated
+pyramid is still served (layers are only appended to in place, so its
+spans still point to the same features) while a pool of
+LEAFLET_STORAGE_CLUSTER_WORKERS threads rebuilds it.
+
+Needs NumPy.
+"""
+import logging
+import math
+import os
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .utils import iter_geojson_features, iter_content, read_features, on_commit
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+
+_pool = None
+_pending = set()
+# (pk, version): [lock, users], so a missing pyramid is built only once.
+_building = {}
+_lock = threading.Lock()
+
+
+def get_radius():
+    return getattr(settings, 'LEAFLET_STORAGE_CLUSTER_RADIUS', 60)
+
+
+def get_max_zoom():
+    return getattr(settings, 'LEAFLET_STORAGE_CLUSTER_MAX_ZOOM', 16)
+
+
+def get_path(datalayer):
+    return "%s.clusters.npz" % datalayer.geojson.path
+
+
+def get_pool():
+    global _pool
+    workers = getattr(settings, 'LEAFLET_STORAGE_CLUSTER_WORKERS', 1)
+    if not workers:
+        return None
+    if _pool is None:
+        _pool = ThreadPool(workers)
+    return _pool
+
+
+def check():
+    if numpy is None:
+        raise ImproperlyConfigured("NumPy is needed for the clusters.")
+
+
+def project(lng, lat, zoom):
+    """
+    Web Mercator pixel coordinates, at `zoom`, of the `lng` and `lat`
+    arrays.
+    """
+    size = TILE_SIZE * 2 ** zoom
+    lat = numpy.radians(numpy.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (numpy.clip(lng, -180, 180) + 180.0) / 360.0 * size
+    y = (1 - numpy.log(numpy.tan(lat) + 1 / numpy.cos(lat)) / math.pi) / 2 * size
+    return x, y
+
+
+def tile_bounds(zoom, x, y):
+    """
+    (west, south, east, north) of the tile `x`, `y` at `zoom`.
+    """
+    n = 2.0 ** zoom
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def read_points(datalayer):
+    """
+    Coordinates and byte spans of the Point features of `datalayer`.
+    """
+    lng = []
+    lat = []
+    spans = []
+    for feature, start, end in iter_geojson_features(iter_content(datalayer), offsets=True):
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') != 'Point':
+            continue
+        coordinates = geometry.get('coordinates') or []
+        if len(coordinates) < 2:
+            continue
+        lng.append(coordinates[0])
+        lat.append(coordinates[1])
+        spans.append((start, end - start))
+    return (numpy.array(lng, dtype=numpy.float64),
+            numpy.array(lat, dtype=numpy.float64),
+            numpy.array(spans, dtype=numpy.int64).reshape(-1, 2))
+
+
+def aggregate(ix, iy, count, sum_lng, sum_lat, point):
+    """
+    Merge the cells sharing the same (ix, iy). Return the merged cells,
+    and for each input cell the index of the merged cell it went in.
+    """
+    keys = (ix << 32) | iy
+    keys, first, parent = numpy.unique(keys, return_index=True, return_inverse=True)
+    # `point` is only used for the cells of one point, any one is fine.
+    cells = (ix[first], iy[first],
+             numpy.bincount(parent, weights=count).astype(numpy.int64),
+             numpy.bincount(parent, weights=sum_lng),
+             numpy.bincount(parent, weights=sum_lat),
+             point[first])
+    return cells, parent
+
+
+def save(path, arrays):
+    """
+    Store `arrays` at `path`, replacing it at once, even with concurrent
+    builds of the same layer.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp", suffix=".npz")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            numpy.savez(f, **arrays)
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def build(datalayer):
+    """
+    Compute the clusters pyramid of `datalayer` and store it.
+    """
+    check()
+    lng, lat, spans = read_points(datalayer)
+    max_zoom = get_max_zoom()
+    radius = get_radius()
+    arrays = {
+        'version': numpy.array(datalayer.version or ''),
+        'max_zoom': numpy.array(max_zoom),
+        'lng': lng,
+        'lat': lat,
+        'spans': spans,
+    }
+    x, y = project(lng, lat, max_zoom)
+    ix = numpy.floor(x / radius).astype(numpy.int64)
+    iy = numpy.floor(y / radius).astype(numpy.int64)
+    cells = (ix, iy, numpy.ones(len(lng)), lng, lat, numpy.arange(len(lng)))
+    # Zoom at which the points of each cell stop being all together.
+    expansion = None
+    for zoom in range(max_zoom, -1, -1):
+        cells, parent = aggregate(*cells)
+        ix, iy, count, sum_lng, sum_lat, point = cells
+        if expansion is None:
+            expansion = numpy.full(len(count), max_zoom + 1, dtype=numpy.int64)
+        else:
+            children = numpy.bincount(parent, minlength=len(count))
+            merged = numpy.full(len(count), zoom + 1, dtype=numpy.int64)
+            alone = children[parent] == 1
+            merged[parent[alone]] = expansion[alone]
+            expansion = merged
+        prefix = "z%s_" % zoom
+        arrays[prefix + 'lng'] = sum_lng / numpy.maximum(count, 1)
+        arrays[prefix + 'lat'] = sum_lat / numpy.maximum(count, 1)
+        arrays[prefix + 'count'] = count
+        arrays[prefix + 'point'] = point
+        arrays[prefix + 'expansion'] = expansion
+        cells = (ix >> 1, iy >> 1, count, sum_lng, sum_lat, point)
+    save(get_path(datalayer), arrays)
+
+
+def _rebuild(pk, version):
+    from .models import DataLayer
+    with _lock:
+        _pending.discard((pk, version))
+    try:
+        datalayer = DataLayer.objects.get(pk=pk)
+        # Else a later version of the layer has its own rebuild scheduled.
+        if datalayer.geojson and datalayer.version == version:
+            build(datalayer)
+    except Exception:
+        logger.exception("Unable to build the clusters of datalayer %s", pk)
+    finally:
+        # Threads do not share the connection of the request.
+        connection.close()
+
+
+def schedule(datalayer):
+    """
+    Rebuild the pyramid of `datalayer` in the background, once its current
+    version is committed, unless it is already waiting to be.
+    """
+    pool = get_pool()
+    if pool is None:
+        build(datalayer)
+        return
+    key = (datalayer.pk, datalayer.version)
+    with _lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    on_commit(pool.apply_async, _rebuild, key)
+
+
+def _open(path):
+    """
+    The pyramid at `path`, if any and built with the current max zoom.
+    """
+    if not os.path.exists(path):
+        return None
+    pyramid = numpy.load(path)
+    if int(pyramid['max_zoom']) != get_max_zoom():
+        pyramid.close()
+        return None
+    return pyramid
+
+
+def load(datalayer):
+    """
+    Open the pyramid of `datalayer`, building it when missing or built
+    with another max zoom, once whatever the concurrent requests. When it
+    is outdated, it is still returned, but rebuilt in the background.
+    """
+    check()
+    path = get_path(datalayer)
+    pyramid = _open(path)
+    if pyramid is None:
+        key = (datalayer.pk, datalayer.version)
+        with _lock:
+            entry = _building.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                # Maybe built by another request meanwhile.
+                pyramid = _open(path)
+                if pyramid is None:
+                    build(datalayer)
+                    return numpy.load(path)
+        finally:
+            with _lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del _building[key]
+    if not datalayer.version or str(pyramid['version']) != datalayer.version:
+        schedule(datalayer)
+    return pyramid
+
+
+def get_tile(datalayer, zoom, x, y):
+    """
+    GeoJSON features of the tile `x`, `y` at `zoom`: the clusters, as
+    points with a "cluster" property, their "count" and the zoom where
+    they split ("expansion_zoom"), and the features alone in their cell.
+    """
+    west, south, east, north = tile_bounds(zoom, x, y)
+    pyramid = load(datalayer)
+    try:
+        prefix = "z%s_" % zoom if zoom <= int(pyramid['max_zoom']) else ""
+        lng = pyramid[prefix + 'lng']
+        lat = pyramid[prefix + 'lat']
+        # Right and top edges belong to the next tiles.
+        inside = numpy.flatnonzero((lng >= west) & (lng < east) &
+                                   (lat > south) & (lat <= north))
+        clusters = []
+        if prefix:
+            count = pyramid[prefix + 'count'][inside]
+            expansion = pyramid[prefix + 'expansion'][inside]
+            grouped = count > 1
+            clusters = zip(inside[grouped], count[grouped], expansion[grouped])
+            alone = pyramid[prefix + 'point'][inside[~grouped]]
+        else:
+            alone = inside
+        features = [{
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lng[i]), float(lat[i])]},
+            "properties": {"cluster": True, "count": int(n), "expansion_zoom": int(z)}
+        } for i, n, z in clusters]
+        spans = pyramid['spans'][numpy.sort(alone)].tolist()
+    finally:
+        pyramid.close()
+    features.extend(read_features(datalayer.geojson.path, spans))
+    return features
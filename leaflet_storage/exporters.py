@@ -0,0 +1,348 @@
+"""
+Export of datalayers, or of all the datalayers of a map, as GeoJSON,
+newline delimited GeoJSON, CSV, KML or GPX.
+
+Exports are generators of bytes, to be sent in streaming responses: the
+layers files are read one feature at a time, and each feature is
+written as soon as it is read, so no document is ever built in memory.
+CSV (for its columns) and GPX (waypoints must come before tracks) read
+the layers twice. A map can also be exported as a zip archive of one
+file per layer, compressed and sent on the fly.
+
+A layer is read to the end before being exported, so one with invalid
+content is left out rather than cut in the middle of a well formed
+export.
+"""
+import csv
+import logging
+import struct
+import time
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from django.template.defaultfilters import slugify
+
+from . import serialization
+from .utils import iter_geojson_features, iter_content, _iter_geometries, _iter_positions
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _iter_layer(datalayer):
+    return iter_geojson_features(iter_content(datalayer, BLOCK_SIZE))
+
+
+def is_readable(datalayer):
+    """
+    Whether the whole content of `datalayer` can be exported. Checked
+    once per instance.
+    """
+    if not hasattr(datalayer, '_readable'):
+        datalayer._readable = True
+        if datalayer.geojson:
+            try:
+                for feature in _iter_layer(datalayer):
+                    pass
+            except (IOError, ValueError):
+                logger.warning("Unable to export datalayer %s", datalayer.pk)
+                datalayer._readable = False
+    return datalayer._readable
+
+
+def readable(datalayers):
+    """
+    The `datalayers` which can be exported, the others being skipped.
+    """
+    return (datalayer for datalayer in datalayers if is_readable(datalayer))
+
+
+def iter_features(datalayers):
+    """
+    Features of the readable `datalayers`, read as a stream.
+    """
+    for datalayer in readable(datalayers):
+        if datalayer.geojson:
+            for feature in _iter_layer(datalayer):
+                yield feature
+
+
+def get_properties(feature):
+    properties = feature.get('properties') or {}
+    return dict((key, value) for key, value in properties.items()
+                if not key.startswith('_storage'))
+
+
+# GeoJSON
+
+def to_geojson(datalayers):
+    yield b'{"type": "FeatureCollection", "features": [\n'
+    first = True
+    for feature in iter_features(datalayers):
+        if not first:
+            yield b',\n'
+        first = False
+        yield serialization.dumps(feature).encode('utf-8')
+    yield b'\n]}\n'
+
+
+def to_ndgeojson(datalayers):
+    # One feature per line, without the RS of GeoJSON text sequences.
+    for feature in iter_features(datalayers):
+        yield serialization.dumps(feature).encode('utf-8') + b'\n'
+
+
+# CSV
+
+class _Echo(object):
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    if value is None:
+        return b''
+    if isinstance(value, (dict, list)):
+        value = serialization.dumps(value)
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+def get_position(geometry):
+    """
+    The point of a Point, the center of the bbox of other geometries.
+    """
+    positions = [position for item in _iter_geometries(geometry)
+                 for position in _iter_positions(item.get('coordinates') or [])]
+    if not positions:
+        return None, None
+    if len(positions) == 1:
+        return positions[0][0], positions[0][1]
+    xs = [position[0] for position in positions]
+    ys = [position[1] for position in positions]
+    return (min(xs) + max(xs)) / 2.0, (min(ys) + max(ys)) / 2.0
+
+
+def to_csv(datalayers):
+    datalayers = list(readable(datalayers))
+    columns = set()
+    for feature in iter_features(datalayers):
+        columns.update(get_properties(feature))
+    columns = sorted(columns)
+    writer = csv.writer(_Echo())
+    yield writer.writerow([_cell(column) for column in columns] + [b'lon', b'lat'])
+    for feature in iter_features(datalayers):
+        properties = get_properties(feature)
+        lon, lat = get_position(feature.get('geometry'))
+        yield writer.writerow([_cell(properties.get(column)) for column in columns] +
+                              [_cell(lon), _cell(lat)])
+
+
+# KML
+
+def _kml_coordinates(positions):
+    return u"<coordinates>%s</coordinates>" % u" ".join(
+        u"%s,%s" % (position[0], position[1]) for position in positions)
+
+
+def kml_geometry(geometry):
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates')
+    if kind == 'Point':
+        return u"<Point>%s</Point>" % _kml_coordinates([coordinates])
+    if kind == 'LineString':
+        return u"<LineString>%s</LineString>" % _kml_coordinates(coordinates)
+    if kind == 'Polygon':
+        rings = [u"<outerBoundaryIs><LinearRing>%s</LinearRing></outerBoundaryIs>"
+                 % _kml_coordinates(coordinates[0])]
+        rings.extend(u"<innerBoundaryIs><LinearRing>%s</LinearRing></innerBoundaryIs>"
+                     % _kml_coordinates(ring) for ring in coordinates[1:])
+        return u"<Polygon>%s</Polygon>" % u"".join(rings)
+    if kind in ('MultiPoint', 'MultiLineString', 'MultiPolygon'):
+        parts = [{"type": kind[len('Multi'):], "coordinates": part} for part in coordinates]
+    elif kind == 'GeometryCollection':
+        parts = geometry.get('geometries') or []
+    else:
+        return u""
+    return u"<MultiGeometry>%s</MultiGeometry>" % u"".join(kml_geometry(part) for part in parts)
+
+
+def to_kml(datalayers):
+    yield (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+           b'<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n')
+    for feature in iter_features(datalayers):
+        properties = get_properties(feature)
+        parts = [u"<Placemark>"]
+        for key in ('name', 'description'):
+            if properties.get(key) is not None:
+                parts.append(u"<%s>%s</%s>" % (key, escape(_cell(properties[key]).decode('utf-8')), key))
+        data = [u"<Data name=%s><value>%s</value></Data>"
+                % (quoteattr(key), escape(_cell(value).decode('utf-8')))
+                for key, value in sorted(properties.items()) if key not in ('name', 'description')]
+        if data:
+            parts.append(u"<ExtendedData>%s</ExtendedData>" % u"".join(data))
+        if feature.get('geometry'):
+            parts.append(kml_geometry(feature['geometry']))
+        parts.append(u"</Placemark>\n")
+        yield u"".join(parts).encode('utf-8')
+    yield b'</Document></kml>\n'
+
+
+# GPX
+
+def _gpx_text(properties):
+    parts = []
+    for key, tag in (('name', 'name'), ('description', 'desc')):
+        if properties.get(key) is not None:
+            parts.append(u"<%s>%s</%s>" % (tag, escape(_cell(properties[key]).decode('utf-8')), tag))
+    return u"".join(parts)
+
+
+def _gpx_points(tag, positions):
+    return u"".join(u'<%s lat="%s" lon="%s"/>' % (tag, position[1], position[0])
+                    for position in positions)
+
+
+def gpx_lines(geometry):
+    """
+    Lines of a geometry, polygons being exported as their rings.
+    """
+    for item in _iter_geometries(geometry):
+        kind = item.get('type')
+        coordinates = item.get('coordinates') or []
+        if kind == 'LineString':
+            yield coordinates
+        elif kind in ('MultiLineString', 'Polygon'):
+            for line in coordinates:
+                yield line
+        elif kind == 'MultiPolygon':
+            for polygon in coordinates:
+                for ring in polygon:
+                    yield ring
+
+
+def to_gpx(datalayers):
+    datalayers = list(readable(datalayers))
+    yield (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+           b'<gpx version="1.1" creator="Leaflet Storage" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    # Waypoints must come first.
+    for feature in iter_features(datalayers):
+        text = _gpx_text(get_properties(feature))
+        for item in _iter_geometries(feature.get('geometry')):
+            if item.get('type') == 'Point':
+                points = [item['coordinates']]
+            elif item.get('type') == 'MultiPoint':
+                points = item['coordinates']
+            else:
+                continue
+            yield u"".join(u'<wpt lat="%s" lon="%s">%s</wpt>\n' % (point[1], point[0], text)
+                           for point in points).encode('utf-8')
+    for feature in iter_features(datalayers):
+        segments = [u"<trkseg>%s</trkseg>" % _gpx_points('trkpt', line)
+                    for line in gpx_lines(feature.get('geometry'))]
+        if segments:
+            yield (u"<trk>%s%s</trk>\n" % (_gpx_text(get_properties(feature)), u"".join(segments))
+                   ).encode('utf-8')
+    yield b'</gpx>\n'
+
+
+FORMATS = {
+    'geojson': (to_geojson, 'application/json', 'geojson'),
+    'ndgeojson': (to_ndgeojson, 'application/x-ndjson', 'geojsonl'),
+    'csv': (to_csv, 'text/csv', 'csv'),
+    'kml': (to_kml, 'application/vnd.google-earth.kml+xml', 'kml'),
+    'gpx': (to_gpx, 'application/gpx+xml', 'gpx'),
+}
+
+
+def export(datalayers, fmt):
+    return FORMATS[fmt][0](datalayers)
+
+
+def get_filename(name, fmt):
+    return "%s.%s" % (slugify(name) or "export", FORMATS[fmt][2])
+
+
+# Zip
+
+class StreamingZip(object):
+    """
+    Write a zip archive as a stream: each entry data is deflated as it
+    comes, and its sizes and checksum are written after it, in a data
+    descriptor, so nothing has to be sent back. No ZIP64: entries and
+    archive must stay under 4GB.
+    """
+    LOCAL = struct.Struct('<IHHHHHIIIHH')
+    DESCRIPTOR = struct.Struct('<IIII')
+    CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+    END = struct.Struct('<IHHHHIIH')
+    # Data descriptor, utf-8 names.
+    FLAGS = 0x08 | 0x800
+
+    def __init__(self):
+        self.entries = []
+        self.offset = 0
+        now = time.localtime()
+        self.time = (now.tm_hour << 11) | (now.tm_min << 5) | (now.tm_sec // 2)
+        self.date = ((now.tm_year - 1980) << 9) | (now.tm_mon << 5) | now.tm_mday
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def entry(self, name, chunks):
+        """
+        Yield the bytes of the entry `name`, made of the `chunks`.
+        """
+        name = name.encode('utf-8')
+        offset = self.offset
+        yield self._emit(self.LOCAL.pack(0x04034b50, 20, self.FLAGS, 8, self.time, self.date,
+                                         0, 0, 0, len(name), 0) + name)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        crc = size = compressed = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed += len(data)
+                yield self._emit(data)
+        data = compressor.flush()
+        compressed += len(data)
+        crc &= 0xffffffff
+        yield self._emit(data + self.DESCRIPTOR.pack(0x08074b50, crc, compressed, size))
+        self.entries.append((name, offset, crc, compressed, size))
+
+    def close(self):
+        """
+        Return the bytes of the central directory, ending the archive.
+        """
+        start = self.offset
+        directory = []
+        for name, offset, crc, compressed, size in self.entries:
+            directory.append(self.CENTRAL.pack(
+                0x02014b50, 20, 20, self.FLAGS, 8, self.time, self.date, crc, compressed, size,
+                len(name), 0, 0, 0, 0, 0, offset) + name)
+        directory = b"".join(directory)
+        end = self.END.pack(0x06054b50, 0, 0, len(self.entries), len(self.entries),
+                            len(directory), start, 0)
+        return self._emit(directory + end)
+
+
+def to_zip(datalayers, fmt):
+    """
+    Zip archive of one `fmt` file per readable datalayer.
+    """
+    archive = StreamingZip()
+    names = set()
+    for datalayer in readable(datalayers):
+        name = get_filename(datalayer.name, fmt)
+        if name in names:
+            name = "%s-%s" % (datalayer.pk, name)
+        names.add(name)
+        for data in archive.entry(name, export([datalayer], fmt)):
+            yield data
+    yield archive.close()
@@ -1,24 +1,66 @@
-import simplejson
-
 from django.db import models
 from django.conf import settings
 
+from . import serialization
+
+
+class DictFieldDescriptor(object):
+    """
+    Keep the raw JSON as loaded from db, and only decode it on first access.
+    The raw JSON is kept along the decoded value, so a value only read is
+    not serialized again on save (see DictField.pre_save).
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__.get(self.field.attname)
+        if value is None or isinstance(value, basestring):
+            if value is not None:
+                instance.__dict__[self.field.raw_attname] = value
+            value = self.field.to_python(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
 
 class DictField(models.TextField):
     """
     A very simple field to store JSON in db.
     """
 
-    __metaclass__ = models.SubfieldBase
+    def contribute_to_class(self, cls, name):
+        super(DictField, self).contribute_to_class(cls, name)
+        self.raw_attname = "_%s_raw" % self.attname
+        setattr(cls, self.name, DictFieldDescriptor(self))
+
+    def pre_save(self, model_instance, add):
+        # Do not go through the descriptor, to not decode untouched values.
+        value = model_instance.__dict__.get(self.attname)
+        raw = model_instance.__dict__.get(self.raw_attname)
+        if raw is not None and not isinstance(value, basestring):
+            # Decoded: nested dicts may have been changed, compare the value
+            # with what was loaded, which is cheaper than serializing it.
+            if self.to_python(raw) == value:
+                return raw
+        return value
 
     def get_prep_value(self, value):
-        return simplejson.dumps(value)
+        if isinstance(value, basestring):
+            # Never decoded, so unchanged: no need to serialize again.
+            return value
+        return serialization.dumps(self.to_python(value))
 
     def to_python(self, value):
         if not value:
             value = {}
         if isinstance(value, basestring):
-            return simplejson.loads(value)
+            return serialization.loads(value)
         else:
             return value
 
@@ -0,0 +1,227 @@
+"""
+Storage of the datalayers content as RFC 8142 GeoJSON text sequences.
+
+With LEAFLET_STORAGE_GEOJSONSEQ, a saved datalayer content is converted to
+a sequence ("<layer>.geojsons"): each GeoJSON text is prefixed by a record
+separator and ended by a line feed, the first one being a
+FeatureCollection without features, which holds the layer members (as
+"_storage"), then one Feature per line. So:
+
+- features can be appended to a layer without rewriting it, see `append`;
+- the byte offset of each feature line is kept in "<layer>.lines", only
+  extended when the layer grows, so any range of features is read
+  without reading the ones before;
+- the content is served without decoding it, line by line, either as is
+  or re-wrapped on the fly in a FeatureCollection for older clients.
+
+As the file only grows, the content of a version of the layer is the
+first `size` bytes of the file: nothing appended after is ever served
+for it. The streaming reader of leaflet_storage.utils reads both formats,
+so the stats and the other indexes do not need to know about it.
+"""
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+
+from django.contrib.gis.geos import Polygon
+from django.core.files.base import File
+from django.db import transaction
+
+from . import serialization
+from .utils import iter_geojson_features, get_geojson_stats, atomic_write
+
+RS = b'\x1e'
+EXTENSION = '.geojsons'
+CONTENT_TYPE = 'application/geo+json-seq'
+BLOCK_SIZE = 64 * 1024
+
+
+def is_sequence(datalayer):
+    return bool(datalayer.geojson) and datalayer.geojson.name.endswith(EXTENSION)
+
+
+def get_lines_path(datalayer):
+    return "%s.lines" % datalayer.geojson.path
+
+
+def record(value):
+    return RS + serialization.dumps(value).encode('utf-8') + b'\n'
+
+
+def write_sequence(chunks, out):
+    """
+    Write the GeoJSON FeatureCollection (or sequence) given as byte
+    `chunks` to `out` as a sequence, streaming it once.
+    """
+    members = {}
+    with tempfile.TemporaryFile() as features:
+        for feature in iter_geojson_features(chunks, members=members):
+            features.write(record(feature))
+        members.update(type="FeatureCollection", features=[])
+        out.write(record(members))
+        features.seek(0)
+        shutil.copyfileobj(features, out)
+
+
+def convert(datalayer):
+    """
+    Replace the new content of `datalayer` by its GeoJSON sequence. Left
+    untouched if it is not valid GeoJSON.
+    """
+    out = tempfile.NamedTemporaryFile(suffix=EXTENSION)
+    try:
+        write_sequence(datalayer.geojson.chunks(), out)
+    except (ValueError, TypeError, AttributeError, IndexError):
+        out.close()
+        return
+    out.flush()
+    datalayer.geojson = File(out, name="layer%s" % EXTENSION)
+
+
+def read_lines_index(path):
+    if not os.path.exists(path):
+        return [], 0
+    with open(path, 'rb') as f:
+        content = f.read()
+    # Little endian uint64, the first one being the offset up to where the
+    # content is indexed.
+    offsets = list(struct.unpack("<%sQ" % (len(content) // 8), content))
+    return offsets[1:], offsets[0]
+
+
+def get_lines(datalayer):
+    """
+    Byte offsets of the feature lines of `datalayer`, in its current
+    version, extending the lines index first if the layer grew.
+    """
+    path = get_lines_path(datalayer)
+    size = datalayer.size
+    offsets, end = read_lines_index(path)
+    if end < size:
+        line = end
+        position = end
+        with open(datalayer.geojson.path, 'rb') as f:
+            f.seek(position)
+            while position < size:
+                block = f.read(min(BLOCK_SIZE, size - position))
+                if not block:
+                    break
+                index = block.find(b'\n')
+                while index != -1:
+                    # The first line is the collection.
+                    if line and position + index > line:
+                        offsets.append(line)
+                    line = position + index + 1
+                    index = block.find(b'\n', index + 1)
+                position += len(block)
+        atomic_write(path, struct.pack("<%sQ" % (len(offsets) + 1), line, *offsets))
+        end = line
+    if end > size:
+        # Index of a later version.
+        offsets = [offset for offset in offsets if offset < size]
+    return offsets
+
+
+def read_range(path, start, stop):
+    """
+    Yield the bytes of `path` from `start` to `stop`, by blocks.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while start < stop:
+            block = f.read(min(BLOCK_SIZE, stop - start))
+            if not block:
+                break
+            start += len(block)
+            yield block
+
+
+def get_range(datalayer, start=0, limit=None):
+    """
+    Byte range of the features of `datalayer` from the `start`-th one,
+    `limit` at most.
+    """
+    offsets = get_lines(datalayer)
+    stop = len(offsets) if limit is None else min(start + limit, len(offsets))
+    if start >= stop:
+        return 0, 0
+    end = offsets[stop] if stop < len(offsets) else datalayer.size
+    return offsets[start], end
+
+
+def read_header(datalayer):
+    with open(datalayer.geojson.path, 'rb') as f:
+        return f.readline()
+
+
+def iter_sequence(datalayer, start=0, limit=None):
+    """
+    Yield the sequence of `datalayer`, its first line, then the features
+    from the `start`-th one, `limit` at most, as they are stored.
+    """
+    yield read_header(datalayer)
+    begin, end = get_range(datalayer, start, limit)
+    for block in read_range(datalayer.geojson.path, begin, end):
+        yield block
+
+
+def iter_collection(datalayer, start=0, limit=None):
+    """
+    Yield the same content as `iter_sequence`, as a FeatureCollection.
+    """
+    members = serialization.loads(read_header(datalayer).lstrip(RS).decode('utf-8'))
+    members.pop('features', None)
+    yield serialization.dumps(members).encode('utf-8').rstrip()[:-1] + b', "features": [\n'
+    begin, end = get_range(datalayer, start, limit)
+    # Leave the last line feed out, so no comma is added after the last
+    # feature. Neither RS nor LF can be part of a compact JSON text.
+    for block in read_range(datalayer.geojson.path, begin, end - 1):
+        yield block.replace(RS, b'').replace(b'\n', b',\n')
+    yield b'\n]}\n'
+
+
+def append(datalayer, features):
+    """
+    Append `features` to the sequence of `datalayer`, then update its
+    version, its stats and its indexes. Return the updated datalayer.
+    """
+    from .models import DataLayer
+    content = b"".join(record(feature) for feature in features)
+    if not content:
+        return datalayer
+    bbox, count = get_geojson_stats([content])
+    with transaction.atomic():
+        datalayer = DataLayer.objects.select_for_update().get(pk=datalayer.pk)
+        if not is_sequence(datalayer):
+            raise ValueError("Not a GeoJSON sequence")
+        size = datalayer.size
+        with open(datalayer.geojson.path, 'r+b') as f:
+            # Drop what a failed append may have left.
+            f.seek(size)
+            f.truncate()
+            f.write(content)
+        # The content of the previous version, and what is appended.
+        datalayer.version = hashlib.md5(datalayer.version.encode('ascii') + content).hexdigest()
+        datalayer.size += len(content)
+        datalayer.features_count += count
+        if bbox:
+            if datalayer.extent:
+                xmin, ymin, xmax, ymax = datalayer.extent.extent
+                bbox = (min(xmin, bbox[0]), min(ymin, bbox[1]),
+                        max(xmax, bbox[2]), max(ymax, bbox[3]))
+            datalayer.extent = Polygon.from_bbox(bbox)
+        try:
+            DataLayer.objects.filter(pk=datalayer.pk).update(
+                version=datalayer.version, size=datalayer.size,
+                features_count=datalayer.features_count, extent=datalayer.extent)
+        except Exception:
+            # While the row is still locked. Readers stop at `size` anyway,
+            # for when the commit itself fails.
+            with open(datalayer.geojson.path, 'r+b') as f:
+                f.truncate(size)
+            raise
+    datalayer.touch_map(stats=True)
+    datalayer.schedule_indexes()
+    return datalayer
@@ -0,0 +1,192 @@
+"""
+Precomputed density grids of the points of a datalayer, so heat layers
+get small tiles instead of all the points.
+
+Each tile is a grid of LEAFLET_STORAGE_HEATMAP_RESOLUTION x
+LEAFLET_STORAGE_HEATMAP_RESOLUTION cells, holding the number of points
+in each. As for the clusters, cells of a zoom are made of 2 x 2 cells of
+the next one, so the grids are computed at LEAFLET_STORAGE_HEATMAP_MAX_ZOOM
+with a NumPy histogram of the points, then summed up to zoom 0. Only the
+non empty cells are stored, next to the layer file
+("<layer>.heatmap.npz"). Tiles are served as PNG (intensity, log scaled
+with the max of the zoom) or as raw little endian uint32 counts.
+
+With LEAFLET_STORAGE_HEATMAPS, the grids of a layer are rebuilt in a
+background thread once its new content is committed; meanwhile, the
+previous ones are served. They are always rebuilt from the whole layer:
+most changes of a layer replace its content, so there is no previous
+state to update. Needs NumPy.
+"""
+import logging
+import os
+import threading
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+
+from PIL import Image
+
+from .clusters import numpy, check, project, read_points, save
+from .utils import on_commit
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def get_resolution():
+    return getattr(settings, 'LEAFLET_STORAGE_HEATMAP_RESOLUTION', 64)
+
+
+def get_max_zoom():
+    return getattr(settings, 'LEAFLET_STORAGE_HEATMAP_MAX_ZOOM', 14)
+
+
+def get_path(datalayer):
+    return "%s.heatmap.npz" % datalayer.geojson.path
+
+
+def get_pool():
+    global _pool
+    workers = getattr(settings, 'LEAFLET_STORAGE_HEATMAP_WORKERS', 1)
+    if not workers:
+        return None
+    if _pool is None:
+        _pool = ThreadPool(workers)
+    return _pool
+
+
+def build(datalayer):
+    """
+    Compute the density grids of `datalayer` and store them.
+    """
+    check()
+    lng, lat, spans = read_points(datalayer)
+    max_zoom = get_max_zoom()
+    resolution = get_resolution()
+    arrays = {
+        'version': numpy.array(datalayer.version or ''),
+        'max_zoom': numpy.array(max_zoom),
+        'resolution': numpy.array(resolution),
+    }
+    x, y = project(lng, lat, max_zoom)
+    cells = resolution * 2 ** max_zoom
+    scale = float(resolution) / 256
+    ix = numpy.clip(numpy.floor(x * scale), 0, cells - 1).astype(numpy.int64)
+    iy = numpy.clip(numpy.floor(y * scale), 0, cells - 1).astype(numpy.int64)
+    count = numpy.ones(len(ix), dtype=numpy.int64)
+    for zoom in range(max_zoom, -1, -1):
+        keys, inverse = numpy.unique((ix << 32) | iy, return_inverse=True)
+        count = numpy.bincount(inverse, weights=count).astype(numpy.int64)
+        ix, iy = keys >> 32, keys & 0xFFFFFFFF
+        prefix = "z%s_" % zoom
+        arrays[prefix + 'ix'] = ix.astype(numpy.uint32)
+        arrays[prefix + 'iy'] = iy.astype(numpy.uint32)
+        arrays[prefix + 'count'] = count.astype(numpy.uint32)
+        ix, iy = ix >> 1, iy >> 1
+    save(get_path(datalayer), arrays)
+
+
+def _rebuild(pk, version):
+    from .models import DataLayer
+    with _lock:
+        _pending.discard((pk, version))
+    try:
+        datalayer = DataLayer.objects.get(pk=pk)
+        # Else a later version of the layer has its own rebuild scheduled.
+        if datalayer.geojson and datalayer.version == version:
+            build(datalayer)
+    except Exception:
+        logger.exception("Unable to build the heatmap of datalayer %s", pk)
+    finally:
+        # Threads do not share the connection of the request.
+        connection.close()
+
+
+def schedule(datalayer):
+    """
+    Rebuild the grids of `datalayer` in the background, once its current
+    version is committed, unless it is already waiting to be.
+    """
+    pool = get_pool()
+    if pool is None:
+        build(datalayer)
+        return
+    key = (datalayer.pk, datalayer.version)
+    with _lock:
+        if key in _pending:
+            return
+        _pending.add(key)
+    on_commit(pool.apply_async, _rebuild, key)
+
+
+def load(datalayer):
+    """
+    Open the grids of `datalayer`, building them when missing. When they
+    are outdated, they are still returned, but rebuilt in the background.
+    """
+    check()
+    path = get_path(datalayer)
+    if not os.path.exists(path):
+        build(datalayer)
+        return numpy.load(path)
+    grids = numpy.load(path)
+    if (int(grids['max_zoom']) != get_max_zoom()
+            or int(grids['resolution']) != get_resolution()):
+        # Not usable with the current settings.
+        grids.close()
+        build(datalayer)
+        return numpy.load(path)
+    if not datalayer.version or str(grids['version']) != datalayer.version:
+        schedule(datalayer)
+    return grids
+
+
+def get_grid(datalayer, zoom, x, y):
+    """
+    Return the counts grid of the tile `x`, `y` at `zoom`, as an uint32
+    array of shape (resolution, resolution), rows from north to south, and
+    the max count of a cell at this zoom. None when `zoom` is beyond the
+    max zoom.
+    """
+    grids = load(datalayer)
+    try:
+        if zoom > int(grids['max_zoom']):
+            return None, 0
+        resolution = int(grids['resolution'])
+        prefix = "z%s_" % zoom
+        ix = grids[prefix + 'ix']
+        count = grids[prefix + 'count']
+        max_count = int(count.max()) if len(count) else 0
+        # Cells are sorted by ix, then iy.
+        start, end = numpy.searchsorted(ix, [x * resolution, (x + 1) * resolution])
+        ix, iy, count = ix[start:end], grids[prefix + 'iy'][start:end], count[start:end]
+        inside = (iy >= y * resolution) & (iy < (y + 1) * resolution)
+        grid = numpy.zeros((resolution, resolution), dtype=numpy.uint32)
+        grid[iy[inside] - y * resolution, ix[inside] - x * resolution] = count[inside]
+        return grid, max_count
+    finally:
+        grids.close()
+
+
+def to_png(grid, max_count):
+    """
+    Encode `grid` as a grayscale PNG, log scaled so that `max_count` is
+    white.
+    """
+    if max_count:
+        values = numpy.log1p(grid) / numpy.log1p(max_count) * 255
+    else:
+        values = grid
+    image = Image.fromarray(values.astype(numpy.uint8), 'L')
+    content = BytesIO()
+    image.save(content, 'PNG', optimize=True)
+    return content.getvalue()
+
+
+def to_bin(grid):
+    return grid.astype('<u4').tobytes()
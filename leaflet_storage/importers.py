@@ -0,0 +1,403 @@
+"""
+Server side import of CSV, KML, GPX and OSM XML files into a new
+datalayer, instead of converting them in the browser.
+
+Files are read as a stream, one row or one element at a time (with
+iterparse, removing each handled element from the tree), and the
+features are written one by one in the GeoJSON file of the datalayer,
+so memory does not grow with the file size. The only exception are the
+OSM nodes coordinates, which must be kept to build the ways.
+
+XML files declaring a DTD are rejected: their entities could expand to
+any size. With defusedxml installed, it is used to parse them; else, the
+prolog of the files is checked before parsing.
+
+Conversions run in a pool of LEAFLET_STORAGE_IMPORT_WORKERS threads (0 to
+run them in the request), and report their progress in the cache, where
+the import status view reads it: the cache must be shared by all the
+processes serving the site (memcached, redis, database...), not the
+default per process LocMemCache, or the status of a job is only found
+by the process which started it. The job state is only kept there: a
+failed import leaves nothing else behind than its logged error.
+"""
+import csv
+import logging
+import os
+import re
+import tempfile
+import uuid
+from multiprocessing.pool import ThreadPool
+from xml.etree import cElementTree as ElementTree
+
+try:
+    from defusedxml.ElementTree import iterparse as safe_iterparse
+except ImportError:
+    safe_iterparse = None
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import File
+from django.db import connection, transaction
+
+from . import serialization
+from .models import DataLayer, Map
+from .utils import smart_decode
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY = "leaflet_storage:import:%s"
+PROGRESS_EVERY = 1000
+PROLOG_SIZE = 64 * 1024
+LATITUDES = ('lat', 'latitude', 'y')
+LONGITUDES = ('lon', 'lng', 'long', 'longitude', 'x')
+OSM_AREA_KEYS = ('area', 'building', 'landuse', 'natural', 'leisure', 'amenity')
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    workers = getattr(settings, 'LEAFLET_STORAGE_IMPORT_WORKERS', 2)
+    if not workers:
+        return None
+    if _pool is None:
+        _pool = ThreadPool(workers)
+    return _pool
+
+
+def feature(geometry, properties):
+    return {"type": "Feature", "geometry": geometry, "properties": properties}
+
+
+# CSV
+
+def csv_features(f):
+    """
+    Points of a CSV file, with a latitude and a longitude column, the
+    other columns being their properties.
+    """
+    header = f.readline()
+    delimiter = max((',', ';', '\t', '|'), key=header.count)
+    header = [smart_decode(name).strip() for name in next(csv.reader([header], delimiter=delimiter))]
+    names = [name.lower() for name in header]
+    try:
+        lat = next(i for i, name in enumerate(names) if name in LATITUDES)
+        lng = next(i for i, name in enumerate(names) if name in LONGITUDES)
+    except StopIteration:
+        raise ValueError("No latitude and longitude columns found")
+    for row in csv.reader(f, delimiter=delimiter):
+        try:
+            coordinates = [float(row[lng].replace(',', '.')), float(row[lat].replace(',', '.'))]
+        except (IndexError, ValueError):
+            continue
+        properties = dict(
+            (name, smart_decode(value)) for i, (name, value) in enumerate(zip(header, row))
+            if i not in (lat, lng)
+        )
+        yield feature({"type": "Point", "coordinates": coordinates}, properties)
+
+
+# XML
+
+def local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def check_prolog(f):
+    """
+    Raise ValueError if the XML file `f` declares a DTD, which must come
+    before its root element.
+    """
+    content = f.read(PROLOG_SIZE)
+    f.seek(0)
+    if content.startswith((b'\xff\xfe', b'\xfe\xff')):
+        head = content.decode('utf-16', 'ignore')
+    else:
+        # Markup is ASCII in the other encodings expat reads.
+        head = content.decode('latin-1')
+    root = re.search(r'<[^?!]', head)
+    if root is None and len(content) == PROLOG_SIZE:
+        raise ValueError("XML prolog too long")
+    if '<!DOCTYPE' in head[:root.start() if root else None]:
+        raise ValueError("XML files with a DTD are not supported")
+
+
+def iterparse(f, tags):
+    """
+    Yield the elements of `tags` (without namespace) once fully parsed,
+    and remove them from the tree once handled, so it never grows.
+    """
+    if safe_iterparse is not None:
+        events = safe_iterparse(f, events=('start', 'end'), forbid_dtd=True)
+    else:
+        check_prolog(f)
+        events = ElementTree.iterparse(f, events=('start', 'end'))
+    parents = []
+    for event, elem in events:
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if local(elem.tag) in tags:
+            yield elem
+        elif len(parents) != 1:
+            # Kept until its ancestor is handled, or removed with it.
+            continue
+        # Handled, or of no interest at top level.
+        if parents:
+            parents[-1].remove(elem)
+        elem.clear()
+
+
+def child_text(elem, name):
+    for child in elem:
+        if local(child.tag) == name:
+            return (child.text or u"").strip()
+    return None
+
+
+def text_properties(elem, names):
+    properties = {}
+    for name in names:
+        value = child_text(elem, name)
+        if value:
+            properties[name] = value
+    return properties
+
+
+# KML
+
+def kml_coordinates(elem):
+    coordinates = []
+    for child in elem.iter():
+        if local(child.tag) == 'coordinates':
+            for item in (child.text or "").split():
+                values = item.split(',')
+                if len(values) >= 2:
+                    coordinates.append([float(values[0]), float(values[1])])
+            break
+    return coordinates
+
+
+def kml_geometry(elem):
+    name = local(elem.tag)
+    if name == 'Point':
+        coordinates = kml_coordinates(elem)
+        return {"type": "Point", "coordinates": coordinates[0]} if coordinates else None
+    if name in ('LineString', 'LinearRing'):
+        return {"type": "LineString", "coordinates": kml_coordinates(elem)}
+    if name == 'Polygon':
+        rings = []
+        for boundary in elem:
+            if local(boundary.tag) in ('outerBoundaryIs', 'innerBoundaryIs'):
+                ring = kml_coordinates(boundary)
+                if local(boundary.tag) == 'outerBoundaryIs':
+                    rings.insert(0, ring)
+                else:
+                    rings.append(ring)
+        return {"type": "Polygon", "coordinates": rings}
+    if name == 'MultiGeometry':
+        geometries = [kml_geometry(child) for child in elem]
+        geometries = [geometry for geometry in geometries if geometry]
+        if len(geometries) == 1:
+            return geometries[0]
+        return {"type": "GeometryCollection", "geometries": geometries}
+    return None
+
+
+def kml_features(f):
+    for placemark in iterparse(f, ('Placemark', )):
+        properties = text_properties(placemark, ('name', 'description'))
+        geometry = None
+        for child in placemark:
+            name = local(child.tag)
+            if name == 'ExtendedData':
+                for data in child.iter():
+                    if local(data.tag) == 'Data' and data.get('name'):
+                        properties[data.get('name')] = child_text(data, 'value') or u""
+                    elif local(data.tag) == 'SimpleData' and data.get('name'):
+                        properties[data.get('name')] = (data.text or u"").strip()
+            elif geometry is None:
+                geometry = kml_geometry(child)
+        if geometry is not None:
+            yield feature(geometry, properties)
+
+
+# GPX
+
+def gpx_points(elem, name):
+    return [[float(point.get('lon')), float(point.get('lat'))]
+            for point in elem if local(point.tag) == name]
+
+
+def gpx_features(f):
+    for elem in iterparse(f, ('wpt', 'rte', 'trk')):
+        name = local(elem.tag)
+        properties = text_properties(elem, ('name', 'desc', 'ele', 'time', 'type'))
+        if name == 'wpt':
+            geometry = {"type": "Point",
+                        "coordinates": [float(elem.get('lon')), float(elem.get('lat'))]}
+        elif name == 'rte':
+            geometry = {"type": "LineString", "coordinates": gpx_points(elem, 'rtept')}
+        else:
+            segments = [gpx_points(segment, 'trkpt') for segment in elem
+                        if local(segment.tag) == 'trkseg']
+            if len(segments) == 1:
+                geometry = {"type": "LineString", "coordinates": segments[0]}
+            else:
+                geometry = {"type": "MultiLineString", "coordinates": segments}
+        yield feature(geometry, properties)
+
+
+# OSM
+
+def osm_tags(elem):
+    return dict((tag.get('k'), tag.get('v')) for tag in elem if local(tag.tag) == 'tag')
+
+
+def osm_features(f):
+    """
+    Tagged nodes and ways of an OSM XML file. Relations are ignored.
+    """
+    nodes = {}
+    for elem in iterparse(f, ('node', 'way')):
+        tags = osm_tags(elem)
+        if local(elem.tag) == 'node':
+            coordinates = [float(elem.get('lon')), float(elem.get('lat'))]
+            nodes[elem.get('id')] = coordinates
+            if tags:
+                tags['@id'] = u"node/%s" % elem.get('id')
+                yield feature({"type": "Point", "coordinates": coordinates}, tags)
+            continue
+        if not tags:
+            continue
+        refs = [nd.get('ref') for nd in elem if local(nd.tag) == 'nd']
+        coordinates = [nodes[ref] for ref in refs if ref in nodes]
+        if len(coordinates) < 2:
+            continue
+        tags['@id'] = u"way/%s" % elem.get('id')
+        closed = len(refs) > 3 and refs[0] == refs[-1]
+        if closed and tags.get('area') != 'no' and any(key in tags for key in OSM_AREA_KEYS):
+            geometry = {"type": "Polygon", "coordinates": [coordinates]}
+        else:
+            geometry = {"type": "LineString", "coordinates": coordinates}
+        yield feature(geometry, tags)
+
+
+FORMATS = {
+    'csv': csv_features,
+    'kml': kml_features,
+    'gpx': gpx_features,
+    'osm': osm_features,
+}
+
+
+def guess_format(filename):
+    ext = os.path.splitext(filename or "")[1].lower().lstrip('.')
+    return ext if ext in FORMATS else None
+
+
+def write_geojson(features, out, name):
+    """
+    Write the `features` to the `out` file as a FeatureCollection, one at
+    a time. Yield the number of written features regularly.
+    """
+    out.write(b'{"type": "FeatureCollection", "_storage": ')
+    out.write(serialization.dumps({"name": name, "displayOnLoad": True}).encode('utf-8'))
+    out.write(b', "features": [\n')
+    count = 0
+    for item in features:
+        if count:
+            out.write(b',\n')
+        out.write(serialization.dumps(item).encode('utf-8'))
+        count += 1
+        if not count % PROGRESS_EVERY:
+            yield count
+    out.write(b'\n]}\n')
+    yield count
+
+
+# Jobs
+
+def get_job(job_id):
+    return cache.get(JOB_KEY % job_id)
+
+
+def set_job(job_id, **state):
+    timeout = getattr(settings, 'LEAFLET_STORAGE_IMPORT_JOB_TIMEOUT', 60 * 60 * 24)
+    cache.set(JOB_KEY % job_id, state, timeout)
+
+
+def run(job_id, path, fmt, map_id, name):
+    """
+    Convert the file at `path` to a new datalayer of map `map_id`, and
+    report the progress in the job `job_id`.
+    """
+    total = os.path.getsize(path)
+    output = tempfile.NamedTemporaryFile(suffix='.geojson', delete=False)
+    try:
+        with open(path, 'rb') as f:
+            set_job(job_id, status='running', read=0, total=total, features=0)
+            with output:
+                for count in write_geojson(FORMATS[fmt](f), output, name):
+                    set_job(job_id, status='running', read=f.tell(), total=total,
+                            features=count)
+        datalayer = save_datalayer(output.name, map_id, name)
+        set_job(job_id, status='done', read=total, total=total, features=count,
+                datalayer=datalayer.metadata)
+    except Exception as e:
+        logger.exception("Import %s failed", job_id)
+        set_job(job_id, status='error', error=unicode(e) if isinstance(e, ValueError)
+                else u"Unable to import this file")
+    finally:
+        os.remove(output.name)
+        os.remove(path)
+
+
+def save_datalayer(path, map_id, name):
+    """
+    Create the datalayer of map `map_id` with the GeoJSON file at `path`,
+    the map row being locked meanwhile, so the map cannot be deleted or
+    have its stats updated by another save in between. Its stored file is
+    removed if it fails.
+    """
+    datalayer = DataLayer(map_id=map_id, name=name, display_on_load=True)
+    try:
+        with transaction.atomic():
+            # Raises DoesNotExist if the map was deleted meanwhile.
+            Map.objects.select_for_update().only('pk').get(pk=map_id)
+            with open(path, 'rb') as content:
+                datalayer.geojson = File(content, name="%s.geojson" % name)
+                datalayer.save()
+    except Exception:
+        if datalayer.geojson and datalayer.geojson._committed:
+            datalayer.geojson.delete(save=False)
+        raise
+    return datalayer
+
+
+def _run(args):
+    try:
+        run(*args)
+    finally:
+        # Threads do not share the connection of the request.
+        connection.close()
+
+
+def start(upload, fmt, map_inst, name):
+    """
+    Copy the `upload` file and convert it in the background. Return the
+    job id.
+    """
+    job_id = uuid.uuid4().hex
+    with tempfile.NamedTemporaryFile(suffix='.%s' % fmt, delete=False) as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    set_job(job_id, status='pending')
+    args = (job_id, f.name, fmt, map_inst.pk, name)
+    pool = get_pool()
+    if pool is None:
+        run(*args)
+    else:
+        pool.apply_async(_run, (args, ))
+    return job_id
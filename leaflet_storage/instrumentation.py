@@ -0,0 +1,304 @@
+"""
+Optional performance instrumentation of leaflet_storage views.
+
+Add "leaflet_storage.instrumentation.InstrumentationMiddleware" to your
+MIDDLEWARE_CLASSES (or decorate some views with `instrument`) to get, for
+each request: wall time, DB queries count and time, JSON serialization
+time, gzip cache hits and misses and the response size. They are exposed in
+a Server-Timing header and sent to the sink set by
+LEAFLET_STORAGE_METRICS_SINK (dotted path to a class, instantiated with the
+LEAFLET_STORAGE_METRICS_SINK_OPTIONS kwargs).
+
+Set LEAFLET_STORAGE_MEMORY_PROFILING to also record the peak memory of each
+request, response streaming included. It uses tracemalloc when available,
+else the growth of the process peak RSS, which only grows when a request
+goes over the previous peak: a rough hint, not the request peak.
+"""
+import logging
+import resource
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_by_path
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# ############## #
+#     Sinks      #
+# ############## #
+
+class LoggingSink(object):
+    """
+    Log each record with the "leaflet_storage.instrumentation" logger.
+    """
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def emit(self, record):
+        logger.log(self.level, "%(view)s %(status)s %(time).1fms "
+                   "db=%(db_queries)s/%(db_time).1fms bytes=%(bytes)s "
+                   "memory=%(memory_peak_kb)sKB "
+                   "timings=%(timings)s counters=%(counters)s", record)
+
+
+class StatsdSink(object):
+    """
+    Send each record to a statsd server, over UDP.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='leaflet_storage'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def lines(self, record):
+        prefix = "%s.%s" % (self.prefix, record['view'])
+        yield "%s.time:%d|ms" % (prefix, record['time'])
+        yield "%s.db_time:%d|ms" % (prefix, record['db_time'])
+        yield "%s.db_queries:%d|c" % (prefix, record['db_queries'])
+        yield "%s.bytes:%d|c" % (prefix, record['bytes'])
+        if record['memory_peak_kb'] is not None:
+            yield "%s.memory_peak_kb:%d|g" % (prefix, record['memory_peak_kb'])
+        for name, value in record['timings'].items():
+            yield "%s.%s:%d|ms" % (prefix, name, value)
+        for name, value in record['counters'].items():
+            yield "%s.%s:%d|c" % (prefix, name, value)
+
+    def emit(self, record):
+        try:
+            self.socket.sendto("\n".join(self.lines(record)), self.address)
+        except socket.error:
+            logger.exception("Unable to send metrics to statsd")
+
+
+class MemorySink(object):
+    """
+    Keep records in memory, mainly for tests.
+    """
+    records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+_sinks = {}
+
+
+def get_sink():
+    path = getattr(settings, 'LEAFLET_STORAGE_METRICS_SINK',
+                   'leaflet_storage.instrumentation.LoggingSink')
+    if path not in _sinks:
+        options = getattr(settings, 'LEAFLET_STORAGE_METRICS_SINK_OPTIONS', {})
+        _sinks[path] = import_by_path(path)(**options)
+    return _sinks[path]
+
+
+# ############## #
+#    Recording   #
+# ############## #
+
+def get_max_rss_kb():
+    """
+    Peak RSS of the process, in KB (ru_maxrss is in bytes on macOS).
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class MemoryProfile(object):
+    """
+    Measure the peak memory allocated from its creation to stop. Only
+    `exact` with tracemalloc.
+    """
+    exact = tracemalloc is not None
+
+    def __init__(self):
+        if tracemalloc:
+            self.started = not tracemalloc.is_tracing()
+            if self.started:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self.baseline = tracemalloc.get_traced_memory()[0]
+        else:
+            self.baseline = get_max_rss_kb()
+
+    def stop(self):
+        """
+        Return the peak, in KB.
+        """
+        if tracemalloc:
+            peak = tracemalloc.get_traced_memory()[1]
+            if self.started:
+                tracemalloc.stop()
+            return max(peak - self.baseline, 0) / 1024
+        return get_max_rss_kb() - self.baseline
+
+
+class Recorder(object):
+    """
+    Collect the metrics of one request.
+    """
+
+    def __init__(self, view_name):
+        self.view_name = view_name
+        self.start = time.time()
+        self.timings = {}
+        self.counters = {}
+        self.debug_cursors = {}
+        self.queries_offsets = {}
+        self.memory = None
+        if getattr(settings, 'LEAFLET_STORAGE_MEMORY_PROFILING', False):
+            self.memory = MemoryProfile()
+        for connection in connections.all():
+            self.debug_cursors[connection.alias] = connection.use_debug_cursor
+            self.queries_offsets[connection.alias] = len(connection.queries)
+            connection.use_debug_cursor = True
+
+    def add_time(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def incr(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stop(self):
+        self.time = time.time() - self.start
+        self.db_queries = 0
+        self.db_time = 0
+        for connection in connections.all():
+            queries = connection.queries[self.queries_offsets.get(connection.alias, 0):]
+            self.db_queries += len(queries)
+            self.db_time += sum(float(q['time']) for q in queries)
+            connection.use_debug_cursor = self.debug_cursors.get(connection.alias)
+
+    def server_timing(self):
+        metrics = [
+            'total;dur=%.1f' % (self.time * 1000),
+            'db;dur=%.1f;desc="%s queries"' % (self.db_time * 1000, self.db_queries),
+        ]
+        for name, value in sorted(self.timings.items()):
+            metrics.append('%s;dur=%.1f' % (name, value * 1000))
+        return ', '.join(metrics)
+
+    def record(self, status, size):
+        # Called once the response has been sent, so streaming is included.
+        memory_peak = self.memory.stop() if self.memory else None
+        return {
+            'view': self.view_name,
+            'status': status,
+            'time': self.time * 1000,
+            'db_queries': self.db_queries,
+            'db_time': self.db_time * 1000,
+            'bytes': size,
+            'timings': dict((k, v * 1000) for k, v in self.timings.items()),
+            'counters': dict(self.counters),
+            'memory_peak_kb': memory_peak,
+        }
+
+
+def get_recorder():
+    return getattr(_local, 'recorder', None)
+
+
+def incr(name, value=1):
+    """
+    Increment a counter of the current request, if it's instrumented.
+    """
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.incr(name, value)
+
+
+@contextmanager
+def timer(name):
+    """
+    Add the time spent in the block to the current request, if it's
+    instrumented.
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        yield
+    else:
+        start = time.time()
+        try:
+            yield
+        finally:
+            recorder.add_time(name, time.time() - start)
+
+
+def _count_bytes(content, recorder, status):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        get_sink().emit(recorder.record(status, size))
+
+
+class InstrumentationMiddleware(object):
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func.__module__.startswith('leaflet_storage'):
+            self.start(request, view_func)
+
+    def start(self, request, view_func):
+        if not hasattr(request, '_leaflet_storage_recorder'):
+            request._leaflet_storage_recorder = Recorder(view_func.__name__)
+            _local.recorder = request._leaflet_storage_recorder
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_leaflet_storage_recorder', None)
+        if recorder is None:
+            return response
+        _local.recorder = None
+        del request._leaflet_storage_recorder
+        recorder.stop()
+        response['Server-Timing'] = recorder.server_timing()
+        if response.streaming:
+            # Size will be known, and the record emitted, once the content
+            # has been consumed.
+            response.streaming_content = _count_bytes(
+                response.streaming_content,
+                recorder,
+                response.status_code
+            )
+        else:
+            get_sink().emit(recorder.record(response.status_code, len(response.content)))
+        return response
+
+
+def instrument(view_func):
+    """
+    Instrument only one view, when not using the middleware.
+    """
+    middleware = InstrumentationMiddleware()
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        middleware.start(request, view_func)
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            recorder = getattr(request, '_leaflet_storage_recorder', None)
+            if recorder is not None:
+                recorder.stop()
+            _local.recorder = None
+            raise
+        return middleware.process_response(request, response)
+    return wrapper
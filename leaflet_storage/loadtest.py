@@ -0,0 +1,325 @@
+"""
+Tools to reproduce production load locally: deterministic generation of
+large datasets (storageseed command) and replay of a request mix against
+them (storagereplay command).
+"""
+import math
+import random
+import tempfile
+import time
+import urllib2
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.core.files.base import File
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test.client import Client
+from django.utils.encoding import force_bytes
+
+from .models import Map, DataLayer, Licence
+from . import serialization
+
+
+# ############## #
+#      Data      #
+# ############## #
+
+GEOMETRY_TYPES = ('Point', 'LineString', 'Polygon')
+WORDS = ('river', 'bakery', 'school', 'path', 'castle', 'bridge', 'forest',
+         'station', 'market', 'harbour', 'church', 'garden', 'museum')
+
+
+def random_geometry(rand):
+    kind = rand.choice(GEOMETRY_TYPES)
+    lng, lat = rand.uniform(-179, 179), rand.uniform(-80, 80)
+    if kind == 'Point':
+        coordinates = [lng, lat]
+    elif kind == 'LineString':
+        coordinates = [[lng, lat]]
+        for i in range(rand.randint(1, 50)):
+            lng += rand.uniform(-0.01, 0.01)
+            lat += rand.uniform(-0.01, 0.01)
+            coordinates.append([lng, lat])
+    else:
+        radius = rand.uniform(0.001, 0.1)
+        sides = rand.randint(3, 50)
+        ring = [[lng + radius * math.cos(2 * math.pi * i / sides),
+                 lat + radius * math.sin(2 * math.pi * i / sides)]
+                for i in range(sides)]
+        coordinates = [ring + [ring[0]]]
+    return {"type": kind, "coordinates": coordinates}
+
+
+def random_feature(rand, index):
+    return {
+        "type": "Feature",
+        "geometry": random_geometry(rand),
+        "properties": {
+            "name": "%s %s" % (rand.choice(WORDS).capitalize(), index),
+            "description": " ".join(rand.choice(WORDS) for i in range(rand.randint(0, 20))),
+        }
+    }
+
+
+def write_feature_collection(f, rand, size, name):
+    """
+    Write in `f`, one feature at a time, a FeatureCollection of about `size`
+    bytes (at least one feature). Return the number of features.
+    """
+    storage = force_bytes(serialization.dumps({"name": name}))
+    f.write('{"type": "FeatureCollection", "_storage": %s, "features": [' % storage)
+    written = 0
+    count = 0
+    while not count or written < size:
+        chunk = force_bytes(serialization.dumps(random_feature(rand, count)))
+        if count:
+            chunk = ',' + chunk
+        f.write(chunk)
+        written += len(chunk)
+        count += 1
+    f.write(']}')
+    return count
+
+
+def random_size(rand, min_size, max_size):
+    """
+    Size between min_size and max_size, skewed toward small ones.
+    """
+    return int(min_size * (float(max_size) / min_size) ** (rand.random() ** 3))
+
+
+def create_map(index, options, users):
+    """
+    Create the map number `index` and its datalayers. Same options give the
+    same map.
+    """
+    rand = random.Random(options['seed'] * 1000003 + index)
+    center = Point(rand.uniform(-179, 179), rand.uniform(-80, 80))
+    name = "Load map %s" % index
+    map_inst = Map.objects.create(
+        name=name,
+        slug="load-map-%s" % index,
+        center=center,
+        zoom=rand.randint(3, 16),
+        owner_id=rand.choice(users) if users else None,
+        share_status=rand.choice((Map.PUBLIC, Map.PUBLIC, Map.PUBLIC, Map.OPEN, Map.PRIVATE)),
+        settings={
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [center.x, center.y]},
+            "properties": {"name": name}
+        }
+    )
+    for i in range(rand.randint(1, options['datalayers'])):
+        datalayer = DataLayer(
+            map=map_inst,
+            name="Layer %s" % i,
+            display_on_load=True
+        )
+        size = random_size(rand, options['min_size'], options['max_size'])
+        with tempfile.NamedTemporaryFile(suffix='.geojson') as tmp:
+            write_feature_collection(tmp, rand, size, datalayer.name)
+            tmp.seek(0)
+            # Go through DataLayer.upload_to, as uploads do.
+            datalayer.geojson = File(tmp)
+            datalayer.save()
+    return map_inst.pk
+
+
+def _create_maps(args):
+    indexes, options, users = args
+    return [create_map(index, options, users) for index in indexes]
+
+
+def seed(options, users):
+    """
+    Create options['maps'] maps, in options['workers'] processes.
+    """
+    indexes = range(options['maps'])
+    workers = options['workers']
+    # Create it now, not concurrently from the workers.
+    Licence.get_default()
+    if workers <= 1:
+        return _create_maps((indexes, options, users))
+    # Each process must open its own connection.
+    for connection in connections.all():
+        connection.close()
+    chunks = [(indexes[i::workers], options, users) for i in range(workers)]
+    pool = Pool(workers)
+    try:
+        return sum(pool.map(_create_maps, chunks), [])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_users(count):
+    pks = []
+    for i in range(count):
+        user, created = User.objects.get_or_create(username="load-user-%s" % i)
+        pks.append(user.pk)
+    return pks
+
+
+# ############## #
+#     Replay     #
+# ############## #
+
+def map_request(rand, targets):
+    pk, slug = rand.choice(targets['maps'])
+    return reverse('map', args=(slug, pk)), {}
+
+
+def map_geojson_request(rand, targets):
+    pk, slug = rand.choice(targets['maps'])
+    return reverse('map_geojson', args=(pk, )), {}
+
+
+def datalayer_request(rand, targets):
+    return reverse('datalayer_view', args=(rand.choice(targets['datalayers']), )), {}
+
+
+def datalayer_gzip_request(rand, targets):
+    path, headers = datalayer_request(rand, targets)
+    return path, {'Accept-Encoding': 'gzip'}
+
+
+def pictogram_list_request(rand, targets):
+    return reverse('pictogram_list_json'), {}
+
+
+REQUESTS = {
+    'map': map_request,
+    'map_geojson': map_geojson_request,
+    'datalayer': datalayer_request,
+    'datalayer_gzip': datalayer_gzip_request,
+    'pictogram_list': pictogram_list_request,
+}
+DEFAULT_MIX = "map:30,map_geojson:5,datalayer:25,datalayer_gzip:35,pictogram_list:5"
+
+
+def parse_mix(mix):
+    """
+    "map:30,datalayer:70" => [('map', 30), ('datalayer', 70)]
+    """
+    parsed = []
+    for item in mix.split(','):
+        name, weight = item.split(':')
+        if name not in REQUESTS:
+            raise ValueError("Unknown request %s" % name)
+        parsed.append((name, int(weight)))
+    return parsed
+
+
+def build_requests(mix, count, seed, targets):
+    rand = random.Random(seed)
+    total = sum(weight for name, weight in mix)
+    requests = []
+    for i in range(count):
+        pick = rand.uniform(0, total)
+        for name, weight in mix:
+            pick -= weight
+            if pick <= 0:
+                break
+        path, headers = REQUESTS[name](rand, targets)
+        requests.append((name, path, headers))
+    return requests
+
+
+def get_targets(limit=10000):
+    return {
+        'maps': list(Map.public.order_by('pk').values_list('pk', 'slug')[:limit]),
+        'datalayers': list(DataLayer.objects.filter(
+            map__share_status=Map.PUBLIC).order_by('pk').values_list('pk', flat=True)[:limit]),
+    }
+
+
+class ClientRunner(object):
+    """
+    Run requests through the Django test client, in process.
+    """
+
+    def __init__(self):
+        self.client = Client()
+
+    def __call__(self, request):
+        name, path, headers = request
+        meta = dict(('HTTP_%s' % k.upper().replace('-', '_'), v) for k, v in headers.items())
+        start = time.time()
+        response = self.client.get(path, **meta)
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        return name, time.time() - start, response.status_code < 400
+
+
+class HTTPRunner(object):
+    """
+    Run requests against a running server.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def __call__(self, request):
+        name, path, headers = request
+        start = time.time()
+        try:
+            response = urllib2.urlopen(urllib2.Request(self.base_url + path, headers=headers))
+            response.read()
+            ok = True
+        except urllib2.URLError:
+            ok = False
+        return name, time.time() - start, ok
+
+
+def percentile(values, point):
+    """
+    Nearest rank percentile of sorted `values`.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(point / 100.0 * len(values))) - 1
+    return values[max(rank, 0)]
+
+
+def replay(requests, runner, concurrency=1):
+    """
+    Run the requests and return stats per request name.
+    """
+    if concurrency > 1:
+        pool = ThreadPool(concurrency)
+        results = pool.imap_unordered(runner, requests)
+    else:
+        results = (runner(request) for request in requests)
+    timings = {}
+    errors = {}
+    start = time.time()
+    for name, duration, ok in results:
+        timings.setdefault(name, []).append(duration * 1000)
+        if not ok:
+            errors[name] = errors.get(name, 0) + 1
+    elapsed = time.time() - start
+    if concurrency > 1:
+        pool.close()
+        pool.join()
+    stats = {}
+    for name, values in timings.items():
+        values.sort()
+        stats[name] = {
+            'count': len(values),
+            'errors': errors.get(name, 0),
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': values[-1],
+        }
+    return {
+        'requests': len(requests),
+        'elapsed': elapsed,
+        'throughput': len(requests) / elapsed if elapsed else None,
+        'stats': stats,
+    }
@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from leaflet_storage import assets
+
+
+class Command(BaseCommand):
+    help = ("Bundle, minify and fingerprint the leaflet_storage JS and CSS "
+            "files, with one JS bundle per locale. Run storagei18n first.")
+    option_list = BaseCommand.option_list + (
+        make_option('--locale', action='append', dest='locales', default=None,
+                    help='Build a bundle for this locale, defaults to all LANGUAGES.'),
+    )
+
+    def handle(self, *args, **options):
+        locales = options['locales'] or [code for code, name in settings.LANGUAGES]
+        try:
+            manifest = assets.build_all(locales)
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write("Built %s" % manifest['css'])
+        for locale, path in sorted(manifest['js'].items()):
+            self.stdout.write("Built %s" % path)
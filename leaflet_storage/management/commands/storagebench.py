@@ -0,0 +1,41 @@
+import io
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from leaflet_storage import benchmark, serialization
+
+
+class Command(BaseCommand):
+    help = ("Benchmark map and datalayer hot paths on synthetic data, "
+            "and output results as JSON.")
+    args = "[benchmark name, ...]"
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', type='int', default=10,
+                    help='Number of runs for each benchmark.'),
+        make_option('--output', default=None,
+                    help='Write JSON results to this file instead of stdout.'),
+    ) + tuple(
+        make_option('--%s' % name, type='int', default=default,
+                    help='Defaults to %s.' % default)
+        for name, default in sorted(benchmark.DEFAULTS.items())
+    )
+
+    def handle(self, *args, **options):
+        try:
+            import factory  # noqa
+        except ImportError:
+            raise CommandError("factory_boy is needed to seed benchmark data.")
+        known = dict(benchmark.BENCHMARKS)
+        for name in args:
+            if name not in known:
+                raise CommandError("Unknown benchmark %s, choices are: %s" % (
+                    name, ", ".join(known)))
+        params = dict((k, options[k]) for k in benchmark.DEFAULTS)
+        results = benchmark.run(names=args, repeat=options['repeat'], **params)
+        content = serialization.dumps(results, indent=2)
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(unicode(content))
+        else:
+            self.stdout.write(content)
@@ -1,35 +1,128 @@
+import hashlib
 import io
 import os
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.contrib.staticfiles import finders
-from django.template.loader import render_to_string
+from django.template import TemplateDoesNotExist
+from django.template.loader import find_template_loader, render_to_string
+
+from leaflet_storage import serialization
+from leaflet_storage.utils import atomic_write, gzip_content
+
+MANIFEST = "manifest.json"
+TEMPLATE = "leaflet_storage/locale.js"
+
+
+def get_output_dir():
+    return os.path.join(settings.STATIC_ROOT, "storage/src/locale/")
+
+
+def get_digest(json, template=u""):
+    return hashlib.md5(template.encode('utf-8') + json.encode('utf-8')).hexdigest()
+
+
+def get_template_source():
+    """
+    Source of the locale template, as rendered: a change of the template
+    must render the locales again, as a change of their source does.
+    """
+    for name in settings.TEMPLATE_LOADERS:
+        loader = find_template_loader(name)
+        if loader is None:
+            continue
+        try:
+            return loader.load_template_source(TEMPLATE)[0]
+        except TemplateDoesNotExist:
+            continue
+    raise TemplateDoesNotExist(TEMPLATE)
+
+
+def render(code, json):
+    """
+    Write the {code}.js and {code}.min.js files, and their gzipped
+    versions.
+    """
+    output_dir = get_output_dir()
+    # Compact, and non-ASCII characters left as is (see serialization).
+    minified = serialization.dumps(serialization.loads(json))
+    for name, locale in (("%s.js" % code, json), ("%s.min.js" % code, minified)):
+        content = render_to_string(TEMPLATE, {
+            "locale": locale,
+            "locale_code": code
+        })
+        if locale is minified:
+            content = u"".join(line.strip() for line in content.splitlines())
+        content = content.encode('utf-8')
+        path = os.path.join(output_dir, name)
+        atomic_write(path, content)
+        atomic_write(path + '.gz', gzip_content(content))
+
+
+def _render(args):
+    code, path, digest = args
+    with io.open(path, "r", encoding="utf-8") as f:
+        render(code, f.read())
+    return code, digest
 
 
 class Command(BaseCommand):
+    help = ("Export the Leaflet.Storage locales as JS files, only those "
+            "whose source changed since the last run.")
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=cpu_count(),
+                    help='Number of processes rendering locales.'),
+        make_option('--force', action='store_true', default=False,
+                    help='Render all locales, even unchanged ones.'),
+    )
 
     def handle(self, *args, **options):
+        output_dir = get_output_dir()
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        manifest = self.read_manifest()
+        template = get_template_source()
+        todo = []
         for code, name in settings.LANGUAGES:
-            print "Processing", name
             path = finders.find('storage/src/locale/{code}.json'.format(code=code))
             if not path:
-                print "No file at", path, "Skipping"
-            else:
-                with io.open(path, "r", encoding="utf-8") as f:
-                    print "Found file", path
-                    self.render(code, f.read())
-
-    def render(self, code, json):
-        path = os.path.join(
-            settings.STATIC_ROOT,
-            "storage/src/locale/",
-            "{code}.js".format(code=code)
+                self.stdout.write("No source file for %s, skipping" % name)
+                continue
+            with io.open(path, "r", encoding="utf-8") as f:
+                digest = get_digest(f.read(), template)
+            if (not options['force'] and manifest.get(code) == digest
+                    and self.is_rendered(code)):
+                self.stdout.write("%s unchanged, skipping" % name)
+                continue
+            self.stdout.write("Processing %s from %s" % (name, path))
+            todo.append((code, path, digest))
+        if options['workers'] > 1 and len(todo) > 1:
+            pool = Pool(min(options['workers'], len(todo)))
+            try:
+                done = pool.map(_render, todo)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            done = map(_render, todo)
+        manifest.update(done)
+        atomic_write(os.path.join(output_dir, MANIFEST),
+                     serialization.dumps(manifest, indent=2).encode('utf-8'))
+        self.stdout.write("Exported %s locales to %s" % (len(done), output_dir))
+
+    def read_manifest(self):
+        path = os.path.join(get_output_dir(), MANIFEST)
+        if not os.path.exists(path):
+            return {}
+        with io.open(path, "r", encoding="utf-8") as f:
+            return serialization.loads(f.read())
+
+    def is_rendered(self, code):
+        output_dir = get_output_dir()
+        return all(
+            os.path.exists(os.path.join(output_dir, name % code))
+            for name in ("%s.js", "%s.js.gz", "%s.min.js", "%s.min.js.gz")
         )
-        with io.open(path, "w", encoding="utf-8") as f:
-            content = render_to_string('leaflet_storage/locale.js', {
-                "locale": json,
-                "locale_code": code
-            })
-            print "Exporting to", path
-            f.write(content)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import timeit
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from leaflet_storage import serialization
+
+
+def map_settings_sample():
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [13.447265624999998, 48.94415123418794]
+        },
+        "properties": {
+            "name": u"Cruising on the Donau",
+            "description": u"Which is just the Danube, at the end",
+            "zoom": 7,
+            "datalayersControl": True,
+            "miniMap": False,
+            "tilelayer": {
+                "attribution": u"\xa9 OSM Contributors",
+                "maxZoom": 18,
+                "minZoom": 0,
+                "url_template": "http://{s}.tile.openstreetmap.fr/{z}/{x}/{y}.png"
+            },
+            "tilelayers": [{
+                "id": i,
+                "name": "Tilelayer %s" % i,
+                "url_template": "http://{s}.tile%s.org/{z}/{x}/{y}.png" % i,
+                "attribution": "Tilelayer %s attribution" % i,
+                "minZoom": 0,
+                "maxZoom": 18,
+                "rank": i
+            } for i in range(10)],
+            "datalayers": [{
+                "id": i,
+                "name": "Datalayer %s" % i,
+                "displayOnLoad": True,
+                "url": "/datalayer/%s/" % i
+            } for i in range(20)],
+            "urls": dict(("url_%s" % i, "/some/{pk}/url/%s/" % i) for i in range(20))
+        }
+    }
+
+
+def pictogram_list_sample(length):
+    return {
+        "pictogram_list": [{
+            "id": i,
+            "attribution": "Pictogram %s attribution" % i,
+            "name": "Pictogram %s" % i,
+            "src": "/media/pictogram/pictogram-%s.png" % i
+        } for i in range(length)]
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare available JSON backends on map settings and pictogram lists."
+    option_list = BaseCommand.option_list + (
+        make_option('--number', type='int', default=1000,
+                    help='Number of runs for each measure.'),
+        make_option('--pictograms', type='int', default=500,
+                    help='Length of the pictogram list sample.'),
+    )
+
+    def handle(self, *args, **options):
+        samples = (
+            ("map settings", map_settings_sample()),
+            ("pictogram list", pictogram_list_sample(options['pictograms'])),
+        )
+        number = options['number']
+        for name in serialization.ADAPTERS:
+            backend = serialization.load_backend(name)
+            if backend is None:
+                self.stdout.write("%s: not installed, skipping" % name)
+                continue
+            dumps, loads = backend
+            for label, data in samples:
+                encoded = dumps(data)
+                dumps_time = timeit.timeit(lambda: dumps(data), number=number)
+                loads_time = timeit.timeit(lambda: loads(encoded), number=number)
+                self.stdout.write("%s %s: dumps %.3fms loads %.3fms" % (
+                    name,
+                    label,
+                    dumps_time * 1000 / number,
+                    loads_time * 1000 / number
+                ))
@@ -0,0 +1,58 @@
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from leaflet_storage.models import Map, DataLayer
+
+
+def repair(pk):
+    """
+    Recompute the stats of the datalayers of map `pk` from their files,
+    then the map totals. Return the number of unreadable datalayers.
+    """
+    errors = 0
+    for datalayer in DataLayer.objects.filter(map=pk).only('pk', 'geojson'):
+        if not datalayer.geojson:
+            continue
+        try:
+            stats = datalayer.compute_stats()
+        except (IOError, OSError):
+            errors += 1
+            continue
+        finally:
+            datalayer.geojson.close()
+        # The version of appended sequences is not the file digest, and
+        # the cached URLs depend on it: leave it alone.
+        del stats['version']
+        DataLayer.objects.filter(pk=datalayer.pk).update(**stats)
+    Map.objects.filter(pk=pk).update(**Map.get_stats(pk))
+    return errors
+
+
+class Command(BaseCommand):
+    help = ("Recompute the extent, features count and size of maps and "
+            "their datalayers, from the datalayers files.")
+    args = "[map id, ...]"
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+                    help='Number of processes reading datalayers.'),
+    )
+
+    def handle(self, *args, **options):
+        pks = [int(pk) for pk in args] or list(Map.objects.values_list('pk', flat=True))
+        workers = options['workers']
+        if workers > 1:
+            # Each process must open its own connection.
+            for connection in connections.all():
+                connection.close()
+            pool = Pool(workers)
+            try:
+                errors = sum(pool.imap_unordered(repair, pks, chunksize=10))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            errors = sum(map(repair, pks))
+        self.stdout.write("Updated %s maps, %s unreadable datalayers" % (len(pks), errors))
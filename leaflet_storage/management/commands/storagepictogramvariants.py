@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from leaflet_storage import thumbnails
+from leaflet_storage.models import Pictogram
+
+
+class Command(BaseCommand):
+    help = "Generate the resized variants of the pictograms images."
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+                    help='Number of processes resizing images.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='Also regenerate up to date variants.'),
+    )
+
+    def handle(self, *args, **options):
+        pks = []
+        for pictogram in Pictogram.objects.only('pk', 'pictogram', 'variants'):
+            if options['all'] or pictogram.variants.get('source') != pictogram.pictogram.name:
+                pks.append(pictogram.pk)
+        count = thumbnails.backfill(pks, options['workers'])
+        self.stdout.write("Generated variants of %s pictograms (%s unreadable)"
+                          % (count, len(pks) - count))
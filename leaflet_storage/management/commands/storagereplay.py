@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from leaflet_storage import loadtest, serialization
+
+
+class Command(BaseCommand):
+    help = ("Replay a mix of requests on public maps and datalayers, and "
+            "report latency percentiles as JSON.")
+    option_list = BaseCommand.option_list + (
+        make_option('--requests', type='int', default=1000,
+                    help='Number of requests to run.'),
+        make_option('--mix', default=loadtest.DEFAULT_MIX,
+                    help='Weighted requests, defaults to "%s".' % loadtest.DEFAULT_MIX),
+        make_option('--url', default=None,
+                    help='Base URL of a running server, else the Django test '
+                         'client is used.'),
+        make_option('--concurrency', type='int', default=1,
+                    help='Concurrent requests, only with --url.'),
+        make_option('--seed', type='int', default=42,
+                    help='Same seed gives the same requests sequence.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(e)
+        targets = loadtest.get_targets()
+        if not targets['maps'] or not targets['datalayers']:
+            raise CommandError("No public map or datalayer, see storageseed command.")
+        if options['url']:
+            runner = loadtest.HTTPRunner(options['url'])
+            concurrency = options['concurrency']
+        else:
+            runner = loadtest.ClientRunner()
+            concurrency = 1
+        requests = loadtest.build_requests(mix, options['requests'], options['seed'], targets)
+        results = loadtest.replay(requests, runner, concurrency)
+        self.stdout.write(serialization.dumps(results, indent=2))
@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from leaflet_storage import search
+from leaflet_storage.models import DataLayer
+
+
+class Command(BaseCommand):
+    help = ("Index the features properties of the datalayers, for the "
+            "search. Only those not indexed yet, unless --all.")
+    args = "[map id, ...]"
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+                    help='Number of processes reading datalayers.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='Also index again the already indexed datalayers.'),
+    )
+
+    def handle(self, *args, **options):
+        qs = DataLayer.objects.exclude(geojson='')
+        if args:
+            qs = qs.filter(map__in=[int(pk) for pk in args])
+        if not options['all']:
+            qs = qs.filter(indexed_features__isnull=True)
+        pks = list(qs.values_list('pk', flat=True).distinct())
+        count = search.backfill(pks, options['workers'])
+        self.stdout.write("Indexed %s features of %s datalayers" % (count, len(pks)))
@@ -0,0 +1,31 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from leaflet_storage import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Generate a deterministic synthetic dataset of maps and "
+            "datalayers, for load testing.")
+    option_list = BaseCommand.option_list + (
+        make_option('--maps', type='int', default=1000,
+                    help='Number of maps to create.'),
+        make_option('--datalayers', type='int', default=5,
+                    help='Maximum number of datalayers per map.'),
+        make_option('--min-size', dest='min_size', type='int', default=1024,
+                    help='Minimum size of a datalayer, in bytes.'),
+        make_option('--max-size', dest='max_size', type='int', default=100 * 1024 * 1024,
+                    help='Maximum size of a datalayer, in bytes.'),
+        make_option('--users', type='int', default=50,
+                    help='Number of map owners.'),
+        make_option('--workers', type='int', default=4,
+                    help='Number of processes writing maps.'),
+        make_option('--seed', type='int', default=42,
+                    help='Same seed gives the same dataset.'),
+    )
+
+    def handle(self, *args, **options):
+        users = loadtest.get_users(options['users'])
+        pks = loadtest.seed(options, users)
+        self.stdout.write("Created %s maps" % len(pks))
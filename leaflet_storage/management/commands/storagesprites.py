@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from leaflet_storage import sprites
+
+
+class Command(BaseCommand):
+    help = ("Pack pictograms into sprite sheets, and store their "
+            "coordinates. Set LEAFLET_STORAGE_SPRITES to keep them up to "
+            "date on each pictogram change.")
+    option_list = BaseCommand.option_list + (
+        make_option('--prune', action='store_true', dest='prune', default=False,
+                    help='Remove the replaced sheets now, even those still in '
+                         'their grace period.'),
+    )
+
+    def handle(self, *args, **options):
+        grace = 0 if options['prune'] else None
+        names = [name for name in sprites.build_all(grace=grace) if name]
+        self.stdout.write("Built %s sprite sheets" % len(names))
@@ -1,7 +1,55 @@
 from django.contrib.gis.db import models
+from django.db.models import Q
 
+# Enough to list maps, without their (heavy) settings.
+LISTING_FIELDS = ('name', 'slug', 'description', 'modified_at', 'center',
+                  'zoom', 'tilelayer', 'extent', 'features_count', 'size',
+                  'owner__username')
 
-class PublicManager(models.GeoManager):
+
+class MapManager(models.GeoManager):
+
+    def for_fragments(self):
+        """
+        Maps ready to be rendered with map_fragment: all their datalayers
+        are fetched at once.
+        """
+        return self.get_query_set().prefetch_related('datalayer_set')
+
+
+class PublicManager(MapManager):
 
     def get_query_set(self):
         return super(PublicManager, self).get_query_set().filter(share_status=self.model.PUBLIC)
+
+    def listing(self, owner=None, tilelayer=None, before=None):
+        """
+        Public maps, most recently modified first, with only LISTING_FIELDS
+        loaded. `before` is a (modified_at, pk) keyset: only the maps coming
+        after it in this order are returned.
+        """
+        qs = self.get_query_set()
+        if owner is not None:
+            qs = qs.filter(owner__username=owner)
+        if tilelayer is not None:
+            qs = qs.filter(tilelayer=tilelayer)
+        if before is not None:
+            modified_at, pk = before
+            qs = qs.filter(Q(modified_at__lt=modified_at) |
+                           Q(modified_at=modified_at, pk__lt=pk))
+        return qs.select_related('owner').only(*LISTING_FIELDS).order_by('-modified_at', '-pk')
+
+    def near(self, point, radius=None, bbox=None):
+        """
+        Public maps whose center is within `radius` (a Distance) of `point`,
+        and/or whose extent (center when unknown) intersects `bbox`, the
+        closest to `point` first, with a `distance` attribute.
+        """
+        qs = self.get_query_set()
+        if radius is not None:
+            qs = qs.filter(center__dwithin=(point, radius))
+        if bbox is not None:
+            qs = qs.filter(Q(extent__intersects=bbox) |
+                           Q(extent__isnull=True, center__intersects=bbox))
+        qs = qs.select_related('owner').only(*LISTING_FIELDS)
+        return qs.distance(point, field_name='center').order_by('distance')
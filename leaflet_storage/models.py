@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import logging
 import os
+import uuid
+from multiprocessing.pool import ThreadPool
 
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import Polygon
+from django.contrib.gis.db.models import Extent
+from django.db.models import Sum
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
@@ -11,9 +18,18 @@ from django.core.signing import Signer
 from django.contrib import messages
 from django.template.defaultfilters import slugify
 from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.core.cache import cache
+from django.utils import timezone
+from django.db import connection
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
 
 from .fields import DictField
-from .managers import PublicManager
+from .managers import MapManager, PublicManager
+from .utils import get_geojson_stats, on_commit
+
+logger = logging.getLogger(__name__)
 
 
 class NamedModel(models.Model):
@@ -134,13 +150,62 @@ class Map(NamedModel):
     edit_status = models.SmallIntegerField(choices=EDIT_STATUS, default=OWNER, verbose_name=_("edit status"))
     share_status = models.SmallIntegerField(choices=SHARE_STATUS, default=PUBLIC, verbose_name=_("share status"))
     settings = DictField(blank=True, null=True, verbose_name=_("settings"))
+    # Totals of the datalayers stats, maintained by DataLayer.touch_map.
+    extent = models.PolygonField(blank=True, null=True, editable=False)
+    features_count = models.IntegerField(default=0, editable=False)
+    size = models.BigIntegerField(default=0, editable=False)
 
-    objects = models.GeoManager()
+    objects = MapManager()
     public = PublicManager()
 
+    class Meta(NamedModel.Meta):
+        # For the public listings, see PublicManager.listing.
+        index_together = (
+            ('share_status', 'modified_at', 'id'),
+            ('owner', 'share_status', 'modified_at'),
+            ('tilelayer', 'share_status', 'modified_at'),
+        )
+
     def get_absolute_url(self):
         return reverse("map", kwargs={'slug': self.slug or "map", 'pk': self.pk})
 
+    @property
+    def summary(self):
+        """
+        What listings need to know about a map, only from LISTING_FIELDS.
+        """
+        return {
+            "id": self.pk,
+            "name": self.name,
+            "description": self.description,
+            "url": self.get_absolute_url(),
+            "modified_at": self.modified_at.isoformat(),
+            "owner": self.owner.username if self.owner_id else None,
+            "tilelayer": self.tilelayer_id,
+            "center": [self.center.x, self.center.y],
+            "zoom": self.zoom,
+            "extent": self.extent.extent if self.extent else None,
+            "features_count": self.features_count,
+            "size": self.size,
+        }
+
+    @classmethod
+    def get_stats(cls, pk):
+        """
+        Aggregate the stats of the datalayers of map `pk`, without reading
+        their files.
+        """
+        stats = DataLayer.objects.filter(map=pk).aggregate(
+            extent=Extent('extent'),
+            features_count=Sum('features_count'),
+            size=Sum('size')
+        )
+        return {
+            'extent': Polygon.from_bbox(stats['extent']) if stats['extent'] else None,
+            'features_count': stats['features_count'] or 0,
+            'size': stats['size'] or 0,
+        }
+
     def get_anonymous_edit_url(self):
         signer = Signer()
         signature = signer.sign(self.pk)
@@ -163,7 +228,7 @@ class Map(NamedModel):
         or the request.
         """
         can = False
-        if request and not self.owner:
+        if request and not self.owner_id:
             if (getattr(settings, "LEAFLET_STORAGE_ALLOW_ANONYMOUS", False)
                     and self.is_anonymous_owner(request)):
                 can = True
@@ -177,23 +242,38 @@ class Map(NamedModel):
             can = True
         elif not user.is_authenticated():
             pass
-        elif user == self.owner:
+        elif user.pk == self.owner_id:
             can = True
-        elif self.edit_status == self.EDITORS and user in self.editors.all():
+        elif self.edit_status == self.EDITORS and self.is_editor(user):
             can = True
         return can
 
     def can_view(self, request):
-        if self.owner is None:
+        if self.owner_id is None:
             can = True
         elif self.share_status in [self.PUBLIC, self.OPEN]:
             can = True
-        elif request.user == self.owner:
+        elif request.user.pk == self.owner_id:
             can = True
         else:
-            can = not (self.share_status == self.PRIVATE and request.user not in self.editors.all())
+            can = not (self.share_status == self.PRIVATE and not self.is_editor(request.user))
         return can
 
+    def is_editor(self, user):
+        """
+        Tell if user is one of the map editors. Result is memoised on the
+        instance, so permissions can be checked many times in a request,
+        until the editors of any map change.
+        """
+        if not user.is_authenticated():
+            return False
+        if getattr(self, '_editors_generation', None) != _editors_generation:
+            self._editors_cache = {}
+            self._editors_generation = _editors_generation
+        if user.pk not in self._editors_cache:
+            self._editors_cache[user.pk] = self.editors.filter(pk=user.pk).exists()
+        return self._editors_cache[user.pk]
+
     @property
     def signed_cookie_elements(self):
         return ('anonymous_owner|%s' % self.pk, self.pk)
@@ -209,28 +289,101 @@ class Map(NamedModel):
             # can be None in case of anonymous cloning
             new.owner = kwargs["owner"]
         new.save()
-        for editor in self.editors.all():
-            new.editors.add(editor)
+        new.editors.add(*self.editors.all())
         for datalayer in self.datalayer_set.all():
             datalayer.clone(map_inst=new)
         return new
 
 
+_editors_generation = 0
+
+
+@receiver(m2m_changed, sender=Map.editors.through)
+def clear_editors_cache(sender, instance, **kwargs):
+    # From either side (map.editors or user.map_set), and whatever
+    # instances of the maps are loaded: forget all the memoised results.
+    global _editors_generation
+    _editors_generation += 1
+
+
 class Pictogram(NamedModel):
     """
     An image added to an icon of the map.
     """
     attribution = models.CharField(max_length=300)
     pictogram = models.ImageField(upload_to="pictogram")
+    # Position in its sprite sheet, see leaflet_storage.sprites.
+    sprite = DictField(blank=True, null=True, editable=False)
+    # Resized images, see leaflet_storage.thumbnails.
+    variants = DictField(blank=True, null=True, editable=False)
 
     @property
     def json(self):
-        return {
+        data = {
             "id": self.pk,
             "attribution": self.attribution,
             "name": self.name,
             "src": self.pictogram.url
         }
+        if self.variants.get('source') == self.pictogram.name:
+            sizes = self.variants['sizes']
+            data['variants'] = dict(
+                (size, dict((ext, default_storage.url(name)) for ext, name in formats.items()))
+                for size, formats in sizes.items()
+            )
+            default = str(getattr(settings, 'LEAFLET_STORAGE_PICTOGRAM_SIZES', (24, 48))[0])
+            if default in data['variants']:
+                data['original'] = data['src']
+                data['src'] = data['variants'][default]['png']
+        if self.sprite:
+            sprite = dict(self.sprite)
+            sheet = sprite.pop('sheet')
+            sprite['src'] = reverse('pictogram_sprite', kwargs={'name': sheet, 'ext': 'png'})
+            sprite['atlas'] = reverse('pictogram_sprite', kwargs={'name': sheet, 'ext': 'json'})
+            data['sprite'] = sprite
+        return data
+
+    LIST_VERSION_KEY = "leaflet_storage:pictogram_list_version"
+
+    @classmethod
+    def get_list_version(cls):
+        """
+        Version of the whole pictogram list, to be used in cache keys.
+        Changed each time a pictogram is saved or deleted.
+        """
+        version = cache.get(cls.LIST_VERSION_KEY)
+        if version is None:
+            version = cls.bump_list_version()
+        return version
+
+    @classmethod
+    def bump_list_version(cls):
+        version = uuid.uuid4().hex
+        cache.set(cls.LIST_VERSION_KEY, version, None)
+        return version
+
+
+@receiver(post_save, sender=Pictogram)
+@receiver(post_delete, sender=Pictogram)
+def bump_pictogram_list_version(sender, **kwargs):
+    Pictogram.bump_list_version()
+
+
+@receiver(post_save, sender=Pictogram)
+@receiver(post_delete, sender=Pictogram)
+def build_pictogram_sprite(sender, instance, **kwargs):
+    if getattr(settings, 'LEAFLET_STORAGE_SPRITES', False):
+        from .sprites import schedule, get_sheet_index
+        schedule(get_sheet_index(instance.pk))
+
+
+@receiver(post_save, sender=Pictogram)
+def build_pictogram_variants(sender, instance, **kwargs):
+    if (getattr(settings, 'LEAFLET_STORAGE_PICTOGRAM_VARIANTS', False)
+            and instance.pictogram
+            and instance.variants.get('source') != instance.pictogram.name):
+        from .thumbnails import schedule
+        schedule(instance)
 
 
 class DataLayer(NamedModel):
@@ -242,7 +395,9 @@ class DataLayer(NamedModel):
         if len(str(instance.map.pk)) > 1:
             path.append(str(instance.map.pk)[-2])
         path.append(str(instance.map.pk))
-        path.append("%s.geojson" % (slugify(instance.name)[:50] or "untitled"))
+        # Keep GeoJSON sequences extension, see leaflet_storage.geojsonseq.
+        ext = "geojsons" if filename.endswith(".geojsons") else "geojson"
+        path.append("%s.%s" % (slugify(instance.name)[:50] or "untitled", ext))
         return os.path.join(*path)
     map = models.ForeignKey(Map)
     description = models.TextField(
@@ -256,15 +411,132 @@ class DataLayer(NamedModel):
         verbose_name=_("display on load"),
         help_text=_("Display this layer on load.")
     )
+    version = models.CharField(max_length=32, blank=True, editable=False)
+    # Stats of the content, computed when it is saved.
+    extent = models.PolygonField(blank=True, null=True, editable=False)
+    features_count = models.IntegerField(default=0, editable=False)
+    size = models.BigIntegerField(default=0, editable=False)
+
+    objects = models.GeoManager()
 
     @property
     def metadata(self):
         return {
             "name": self.name,
             "id": self.pk,
-            "displayOnLoad": self.display_on_load
+            "displayOnLoad": self.display_on_load,
+            "url": self.get_absolute_url()
         }
 
+    def save(self, *args, **kwargs):
+        new_content = bool(self.geojson) and not self.geojson._committed
+        if new_content and getattr(settings, 'LEAFLET_STORAGE_GEOJSONSEQ', False):
+            from . import geojsonseq
+            geojsonseq.convert(self)
+        if new_content:
+            # New content is about to be written, keep its digest (as
+            # version) so we can serve it from an immutable URL.
+            for name, value in self.compute_stats().items():
+                setattr(self, name, value)
+        super(DataLayer, self).save(*args, **kwargs)
+        self.touch_map(stats=new_content)
+        if new_content:
+            self.schedule_indexes()
+
+    @staticmethod
+    def has_indexes():
+        return any(getattr(settings, name, False) for name in (
+            'LEAFLET_STORAGE_FEATURE_INDEX', 'LEAFLET_STORAGE_TERM_INDEX',
+            'LEAFLET_STORAGE_CLUSTERS', 'LEAFLET_STORAGE_HEATMAPS'))
+
+    def schedule_indexes(self):
+        """
+        Update the indexes in the background, once the new content is
+        committed, or right away without LEAFLET_STORAGE_INDEX_WORKERS.
+        """
+        if not self.has_indexes():
+            return
+        pool = get_index_pool()
+        if pool is None:
+            self.update_indexes()
+        else:
+            on_commit(pool.apply_async, _update_indexes, (self.pk, self.version))
+
+    def update_indexes(self):
+        """
+        Update the indexes enabled in the settings, after a content change.
+        """
+        if getattr(settings, 'LEAFLET_STORAGE_FEATURE_INDEX', False):
+            from .search import index_datalayer
+            index_datalayer(self)
+        if getattr(settings, 'LEAFLET_STORAGE_TERM_INDEX', False):
+            from . import termindex
+            try:
+                termindex.build(self)
+            except (ValueError, TypeError, AttributeError, IndexError):
+                # Not valid GeoJSON, nothing to search in.
+                pass
+        if getattr(settings, 'LEAFLET_STORAGE_CLUSTERS', False):
+            from . import clusters
+            try:
+                clusters.build(self)
+            except (ValueError, TypeError, AttributeError, IndexError):
+                # Not valid GeoJSON, nothing to cluster.
+                pass
+        if getattr(settings, 'LEAFLET_STORAGE_HEATMAPS', False):
+            from . import heatmaps
+            heatmaps.schedule(self)
+
+    def delete(self, *args, **kwargs):
+        super(DataLayer, self).delete(*args, **kwargs)
+        self.touch_map(stats=True)
+
+    def compute_stats(self):
+        """
+        Stream the content once to get its digest (as version), extent,
+        features count and size.
+        """
+        md5 = hashlib.md5()
+
+        def chunks():
+            for chunk in self.geojson.chunks():
+                md5.update(chunk)
+                yield chunk
+
+        content = chunks()
+        stats = {'extent': None, 'features_count': 0, 'size': self.geojson.size}
+        try:
+            bbox, stats['features_count'] = get_geojson_stats(content)
+        except (ValueError, TypeError, AttributeError, IndexError):
+            # Not valid GeoJSON, the client will complain, not us.
+            bbox = None
+        # Whatever the reader left, the digest is the one of the file.
+        for chunk in content:
+            pass
+        stats['version'] = md5.hexdigest()
+        if bbox:
+            stats['extent'] = Polygon.from_bbox(bbox)
+        return stats
+
+    def touch_map(self, stats=False):
+        """
+        A datalayer change is a change of its map, update its modified_at
+        (which acts as the map version in caches), and its stats if this
+        datalayer ones changed.
+        """
+        values = {'modified_at': timezone.now()}
+        if stats:
+            values.update(Map.get_stats(self.map_id))
+        Map.objects.filter(pk=self.map_id).update(**values)
+
+    def get_absolute_url(self):
+        if self.version:
+            return reverse(
+                "datalayer_versioned_view",
+                kwargs={'pk': self.pk, 'version': self.version}
+            )
+        return reverse("datalayer_view", kwargs={'pk': self.pk})
+
     def clone(self, map_inst=None):
         new = self.__class__.objects.get(pk=self.pk)
         new.pk = None
@@ -273,3 +545,40 @@ class DataLayer(NamedModel):
         new.geojson = File(new.geojson.file.file)
         new.save()
         return new
+
+
+_index_pool = None
+
+
+def get_index_pool():
+    global _index_pool
+    workers = getattr(settings, 'LEAFLET_STORAGE_INDEX_WORKERS', 1)
+    if not workers:
+        return None
+    if _index_pool is None:
+        _index_pool = ThreadPool(workers)
+    return _index_pool
+
+
+def _update_indexes(pk, version):
+    try:
+        datalayer = DataLayer.objects.get(pk=pk)
+        # Else a later save scheduled its own update.
+        if datalayer.version == version and datalayer.geojson:
+            datalayer.update_indexes()
+    except Exception:
+        logger.exception("Unable to update the indexes of datalayer %s", pk)
+    finally:
+        # Threads do not share the connection of the request.
+        connection.close()
+
+
+class IndexedFeature(models.Model):
+    """
+    Searchable text of a feature of a datalayer, see leaflet_storage.search.
+    """
+    datalayer = models.ForeignKey(DataLayer, related_name="indexed_features")
+    # Index of the feature in the datalayer features.
+    position = models.IntegerField()
+    name = models.CharField(max_length=200, blank=True)
+    content = models.TextField()
@@ -0,0 +1,143 @@
+"""
+Full-text search over the public maps and their features, with the
+PostgreSQL text search.
+
+Maps are matched on their name and description, through a GIN index on
+their tsvector expression, so it is always up to date. Features are
+matched on their properties values, extracted when their datalayer
+content is saved (with LEAFLET_STORAGE_FEATURE_INDEX) in IndexedFeature
+rows, which have the same kind of index.
+
+Both indexes are built with the LEAFLET_STORAGE_SEARCH_CONFIG text search
+configuration ("simple" by default): after changing it, the indexes of
+migration 0027 must be created again.
+"""
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Map, DataLayer, IndexedFeature
+from .utils import iter_geojson_features, iter_content
+
+# Must be the expressions of the indexes, so they can be used.
+MAP_DOCUMENT = "to_tsvector(%s::regconfig, coalesce(name, '') || ' ' || coalesce(description, ''))"
+FEATURE_DOCUMENT = "to_tsvector(%s::regconfig, content)"
+QUERY = "plainto_tsquery(%s::regconfig, %s)"
+BATCH_SIZE = 500
+MAX_CONTENT_LENGTH = 10000
+
+
+def get_config():
+    return getattr(settings, 'LEAFLET_STORAGE_SEARCH_CONFIG', 'simple')
+
+
+def get_content(properties):
+    """
+    Text of the properties values of a feature, to be indexed.
+    """
+    values = []
+    for value in (properties or {}).values():
+        if isinstance(value, basestring):
+            values.append(value)
+        elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            values.append(unicode(value))
+    return u" ".join(values)[:MAX_CONTENT_LENGTH]
+
+
+def index_datalayer(datalayer):
+    """
+    Replace the indexed features of `datalayer` by those of its content,
+    read as a stream and inserted by batches. Return the number of indexed
+    features, or None when the content is not valid GeoJSON.
+    """
+    IndexedFeature.objects.filter(datalayer=datalayer.pk).delete()
+    batch = []
+    count = 0
+    try:
+        for position, feature in enumerate(iter_geojson_features(iter_content(datalayer))):
+            properties = feature.get('properties') or {}
+            content = get_content(properties)
+            if not content:
+                continue
+            name = properties.get('name')
+            batch.append(IndexedFeature(
+                datalayer_id=datalayer.pk,
+                position=position,
+                name=name[:200] if isinstance(name, basestring) else u"",
+                content=content
+            ))
+            if len(batch) >= BATCH_SIZE:
+                IndexedFeature.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+    except (ValueError, TypeError, AttributeError, IndexError):
+        # Keep what has been indexed until the invalid part.
+        return None
+    finally:
+        IndexedFeature.objects.bulk_create(batch)
+    return count + len(batch)
+
+
+def search_maps(q):
+    """
+    Public maps matching `q`, the most relevant first.
+    """
+    config = get_config()
+    return Map.public.listing().extra(
+        select={'rank': "ts_rank(%s, %s)" % (MAP_DOCUMENT, QUERY)},
+        select_params=(config, config, q),
+        where=["%s @@ %s" % (MAP_DOCUMENT, QUERY)],
+        params=(config, config, q)
+    ).order_by('-rank', '-modified_at')
+
+
+def search_features(q, map_inst=None):
+    """
+    Indexed features of public maps, or of `map_inst`, matching `q`, the
+    most relevant first, as dicts with their datalayer and map ids.
+    """
+    config = get_config()
+    qs = IndexedFeature.objects.all()
+    if map_inst is not None:
+        qs = qs.filter(datalayer__map=map_inst)
+    else:
+        qs = qs.filter(datalayer__map__share_status=Map.PUBLIC)
+    qs = qs.extra(
+        select={'rank': "ts_rank(%s, %s)" % (FEATURE_DOCUMENT, QUERY)},
+        select_params=(config, config, q),
+        where=["%s @@ %s" % (FEATURE_DOCUMENT, QUERY)],
+        params=(config, config, q)
+    ).order_by('-rank', 'datalayer', 'position')
+    return qs.values('datalayer', 'datalayer__map', 'position', 'name', 'rank')
+
+
+def _index(pk):
+    try:
+        datalayer = DataLayer.objects.only('pk', 'geojson').get(pk=pk)
+    except DataLayer.DoesNotExist:
+        return 0
+    if not datalayer.geojson:
+        return 0
+    try:
+        return index_datalayer(datalayer) or 0
+    except (IOError, OSError):
+        return 0
+
+
+def backfill(pks, workers=4):
+    """
+    Index the features of the datalayers `pks`, in `workers` processes.
+    Return the number of indexed features.
+    """
+    if workers <= 1:
+        return sum(map(_index, pks))
+    # Each process must open its own connection.
+    for connection in connections.all():
+        connection.close()
+    pool = Pool(workers)
+    try:
+        return sum(pool.imap_unordered(_index, pks, chunksize=10))
+    finally:
+        pool.close()
+        pool.join()
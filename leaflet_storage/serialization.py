@@ -0,0 +1,123 @@
+"""
+JSON serialization, with a pluggable backend.
+
+Set LEAFLET_STORAGE_JSON_BACKEND to one of "json", "simplejson", "ujson" or
+"orjson" to choose it; by default the fastest installed one is used.
+
+All backends produce the same output: compact, with non ASCII characters
+kept as is, and as unicode; so content, digests and ETags do not depend on
+the installed libraries. Except ujson 1.x (the last one for Python 2),
+which rounds floats, both ways: it is never chosen by default, and when
+set, it is asked for all the precision it has, which is still less.
+"""
+from __future__ import absolute_import
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+from .instrumentation import timer, get_recorder
+
+DEFAULT_BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+def _stdlib_like(module):
+
+    def dumps(obj, indent=None):
+        separators = (',', ': ') if indent else (',', ':')
+        value = module.dumps(obj, indent=indent, ensure_ascii=False,
+                             separators=separators)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    return dumps, module.loads
+
+
+def is_exact_ujson(module):
+    return int(getattr(module, '__version__', '1').split('.')[0]) >= 2
+
+
+def _ujson(module):
+    if is_exact_ujson(module):
+        options = {}
+        loads = module.loads
+    else:
+        options = {'double_precision': 15}
+
+        def loads(s):
+            return module.loads(s, precise_float=True)
+
+    def dumps(obj, indent=None):
+        return module.dumps(obj, indent=indent or 0, ensure_ascii=False,
+                            escape_forward_slashes=False, **options)
+
+    return dumps, loads
+
+
+def _orjson(module):
+
+    def dumps(obj, indent=None):
+        option = module.OPT_INDENT_2 if indent else 0
+        return module.dumps(obj, option=option).decode('utf-8')
+
+    return dumps, module.loads
+
+
+ADAPTERS = {
+    'json': _stdlib_like,
+    'simplejson': _stdlib_like,
+    'ujson': _ujson,
+    'orjson': _orjson,
+}
+
+_cache = {}
+
+
+def get_backend_name():
+    name = getattr(settings, 'LEAFLET_STORAGE_JSON_BACKEND', None)
+    if name:
+        return name
+    for name in DEFAULT_BACKENDS:
+        if load_backend(name) and (name != 'ujson' or is_exact_ujson(import_module(name))):
+            return name
+
+
+def load_backend(name):
+    """
+    Return a (dumps, loads) tuple for backend `name`, or None if it is not
+    installed.
+    """
+    if name not in _cache:
+        if name not in ADAPTERS:
+            raise ImproperlyConfigured('Unknown JSON backend "%s"' % name)
+        try:
+            module = import_module(name)
+        except ImportError:
+            _cache[name] = None
+        else:
+            _cache[name] = ADAPTERS[name](module)
+    return _cache[name]
+
+
+def get_backend():
+    name = get_backend_name()
+    backend = load_backend(name)
+    if backend is None:
+        raise ImproperlyConfigured('JSON backend "%s" is not installed' % name)
+    return backend
+
+
+def dumps(obj, indent=None):
+    if get_recorder() is None:
+        # Not instrumented, skip the timer on this hot path.
+        return get_backend()[0](obj, indent=indent)
+    with timer('json'):
+        return get_backend()[0](obj, indent=indent)
+
+
+def loads(s):
+    if get_recorder() is None:
+        return get_backend()[1](s)
+    with timer('json'):
+        return get_backend()[1](s)
@@ -0,0 +1,227 @@
+"""
+Pack pictograms into sprite sheets, so clients can draw many icons from
+one image.
+
+Pictograms are grouped by pk: sheet N holds the pictograms with a pk in
+]N * LEAFLET_STORAGE_SPRITE_PICTOGRAMS, (N + 1) * LEAFLET_STORAGE_SPRITE_PICTOGRAMS],
+so saving or deleting one pictogram only rebuilds its own sheet. Sheets
+are stored in "pictogram/sprites/", with a JSON atlas next to them, and
+their names contain a digest of their content, so they never change.
+
+Pictograms are packed as icons: scaled down to fit in a square of
+LEAFLET_STORAGE_SPRITE_ICON_SIZE pixels (48 by default), whatever the size
+of the uploaded image.
+
+Replaced sheets are still referenced by cached pages and pictogram lists,
+so they are only removed once older than LEAFLET_STORAGE_SPRITE_GRACE
+seconds (a day by default), or by "storagesprites --prune".
+
+With LEAFLET_STORAGE_SPRITES, the sheet of a pictogram is rebuilt once
+its save is committed, by a pool of LEAFLET_STORAGE_SPRITE_WORKERS threads
+(0 to rebuild it before the save returns).
+"""
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from PIL import Image
+
+from .models import Pictogram
+from . import serialization
+from .utils import SPRITES_DIR, on_commit
+
+logger = logging.getLogger(__name__)
+
+PADDING = 1
+
+_pool = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def get_pictograms_per_sheet():
+    return getattr(settings, 'LEAFLET_STORAGE_SPRITE_PICTOGRAMS', 256)
+
+
+def get_grace():
+    return getattr(settings, 'LEAFLET_STORAGE_SPRITE_GRACE', 60 * 60 * 24)
+
+
+def get_icon_size():
+    return getattr(settings, 'LEAFLET_STORAGE_SPRITE_ICON_SIZE', 48)
+
+
+def get_pool():
+    global _pool
+    workers = getattr(settings, 'LEAFLET_STORAGE_SPRITE_WORKERS', 1)
+    if not workers:
+        return None
+    if _pool is None:
+        _pool = ThreadPool(workers)
+    return _pool
+
+
+def get_sheet_index(pk):
+    return (pk - 1) // get_pictograms_per_sheet()
+
+
+def pack(sizes, max_width):
+    """
+    Shelf packing: place the (width, height) `sizes`, tallest first, in
+    rows of at most `max_width`. Return the positions, in the order of
+    `sizes`, and the size of the sheet.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    positions = [None] * len(sizes)
+    x = y = shelf_height = width = 0
+    for i in order:
+        w, h = sizes[i]
+        if x and x + w > max_width:
+            y += shelf_height + PADDING
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += w + PADDING
+        shelf_height = max(shelf_height, h)
+        width = max(width, x - PADDING)
+    return positions, (width, y + shelf_height)
+
+
+def open_image(pictogram):
+    try:
+        pictogram.pictogram.open('rb')
+        try:
+            image = Image.open(pictogram.pictogram)
+            image.load()
+        finally:
+            pictogram.pictogram.close()
+    except (IOError, ValueError):
+        logger.warning("Unable to read pictogram %s image", pictogram.pk)
+        return None
+    return image.convert('RGBA')
+
+
+def remove_old_file(name, grace):
+    """
+    Remove the sheet file `name` if older than `grace` seconds.
+    """
+    path = os.path.join(SPRITES_DIR, name)
+    if grace and default_storage.modified_time(path) > datetime.now() - timedelta(seconds=grace):
+        return
+    default_storage.delete(path)
+
+
+def remove_sheets(index, keep=None, grace=None):
+    """
+    Remove the files of sheet `index`, but `keep`, older than `grace`
+    seconds (LEAFLET_STORAGE_SPRITE_GRACE by default).
+    """
+    if not default_storage.exists(SPRITES_DIR):
+        return
+    if grace is None:
+        grace = get_grace()
+    prefix = "%s-" % index
+    for name in default_storage.listdir(SPRITES_DIR)[1]:
+        if name.startswith(prefix) and os.path.splitext(name)[0] != keep:
+            remove_old_file(name, grace)
+
+
+def build_sheet(index, grace=None):
+    """
+    (Re)build the sheet `index`, and store each pictogram coordinates in
+    its `sprite` field. Return the sheet name, or None if it's empty.
+    Previous sheets are removed once older than `grace` seconds.
+    """
+    per_sheet = get_pictograms_per_sheet()
+    pictograms = Pictogram.objects.filter(
+        pk__gt=index * per_sheet,
+        pk__lte=(index + 1) * per_sheet
+    ).order_by('pk')
+    images = []
+    size = get_icon_size()
+    for pictogram in pictograms:
+        image = open_image(pictogram)
+        if image is None:
+            Pictogram.objects.filter(pk=pictogram.pk).update(sprite=None)
+        else:
+            # Keeps the ratio, and never enlarges.
+            image.thumbnail((size, size), Image.ANTIALIAS)
+            images.append((pictogram.pk, image))
+    if not images:
+        remove_sheets(index, grace=grace)
+        return None
+    max_width = getattr(settings, 'LEAFLET_STORAGE_SPRITE_WIDTH', 1024)
+    positions, size = pack([image.size for pk, image in images], max_width)
+    sheet = Image.new('RGBA', size, (0, 0, 0, 0))
+    atlas = {}
+    for (pk, image), (x, y) in zip(images, positions):
+        sheet.paste(image, (x, y))
+        atlas[str(pk)] = {"x": x, "y": y, "width": image.size[0], "height": image.size[1]}
+    content = BytesIO()
+    sheet.save(content, 'PNG', optimize=True)
+    content = content.getvalue()
+    name = "%s-%s" % (index, hashlib.md5(content).hexdigest()[:12])
+    png = os.path.join(SPRITES_DIR, "%s.png" % name)
+    if not default_storage.exists(png):
+        default_storage.save(png, ContentFile(content))
+        default_storage.save(os.path.join(SPRITES_DIR, "%s.json" % name),
+                             ContentFile(serialization.dumps(atlas)))
+    remove_sheets(index, keep=name, grace=grace)
+    for pk, coordinates in atlas.items():
+        Pictogram.objects.filter(pk=int(pk)).update(sprite=dict(coordinates, sheet=name))
+    # Coordinates are set with update(), which does not send signals.
+    Pictogram.bump_list_version()
+    return name
+
+
+def _rebuild(index):
+    with _lock:
+        _pending.discard(index)
+    try:
+        build_sheet(index)
+    except Exception:
+        logger.exception("Unable to build the sprite sheet %s", index)
+    finally:
+        # Threads do not share the connection of the request.
+        connection.close()
+
+
+def schedule(index):
+    """
+    Rebuild the sheet `index` in the background, once the current
+    transaction is committed, unless it is already waiting to be.
+    """
+    pool = get_pool()
+    if pool is None:
+        build_sheet(index)
+        return
+    with _lock:
+        if index in _pending:
+            return
+        _pending.add(index)
+    on_commit(pool.apply_async, _rebuild, (index, ))
+
+
+def build_all(grace=None):
+    """
+    Build all the sheets, and remove those without pictograms anymore.
+    Previous sheets are removed once older than `grace` seconds, 0 to
+    remove them all. Return the names of the built sheets.
+    """
+    if grace is None:
+        grace = get_grace()
+    indexes = set(get_sheet_index(pk) for pk in Pictogram.objects.values_list('pk', flat=True))
+    if default_storage.exists(SPRITES_DIR):
+        for name in default_storage.listdir(SPRITES_DIR)[1]:
+            index = name.split('-')[0]
+            if index.isdigit() and int(index) not in indexes:
+                remove_old_file(name, grace)
+    return [build_sheet(index, grace) for index in sorted(indexes)]
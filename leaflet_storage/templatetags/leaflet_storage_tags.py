@@ -1,9 +1,13 @@
-from django.utils import simplejson
+import hashlib
+
 from django import template
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import force_bytes
 
-from ..models import DataLayer, TileLayer
+from ..models import TileLayer
 from ..views import _urls_for_js
+from .. import serialization, assets
 
 register = template.Library()
 
@@ -11,7 +15,8 @@ register = template.Library()
 @register.inclusion_tag('leaflet_storage/css.html')
 def leaflet_storage_css():
     return {
-        "STATIC_URL": settings.STATIC_URL
+        "STATIC_URL": settings.STATIC_URL,
+        "bundle": assets.get_bundle('css')
     }
 
 
@@ -19,22 +24,65 @@ def leaflet_storage_css():
 def leaflet_storage_js(locale=None):
     return {
         "STATIC_URL": settings.STATIC_URL,
-        "locale": locale
+        "locale": locale,
+        "bundle": assets.get_bundle('js', locale)
+    }
+
+
+def _fragment_catalogue(context):
+    """
+    Return data shared by all the map fragments of a page, so it's computed
+    only once when rendering a list of maps.
+    """
+    key = 'leaflet_storage_fragment_catalogue'
+    if key not in context.render_context:
+        tilelayers = TileLayer.get_list()  # TODO: no need to all
+        urls = _urls_for_js()
+        digest = hashlib.md5(force_bytes(serialization.dumps([tilelayers, urls]))).hexdigest()
+        context.render_context[key] = tilelayers, urls, digest
+    return context.render_context[key]
+
+
+def _fragment_cache_key(map_instance, catalogue_digest, kwargs):
+    extra = serialization.dumps(sorted(kwargs.items()))
+    digest = hashlib.md5(force_bytes(catalogue_digest + extra)).hexdigest()
+    return "leaflet_storage:map_fragment:{pk}:{version}:{digest}".format(
+        pk=map_instance.pk,
+        version=map_instance.modified_at.isoformat(),
+        digest=digest
+    )
+
+
+@register.inclusion_tag('leaflet_storage/map_fragment.html', takes_context=True)
+def map_fragment(context, map_instance, **kwargs):
+    """
+    Render a small, non editable, version of a map. When rendering many
+    of them, use `Map.objects.for_fragments()` to fetch the maps.
+    """
+    tilelayers, urls, catalogue_digest = _fragment_catalogue(context)
+    cache_key = _fragment_cache_key(map_instance, catalogue_digest, kwargs)
+    map_settings = cache.get(cache_key)
+    if map_settings is None:
+        map_settings = serialization.dumps(
+            _fragment_settings(map_instance, tilelayers, urls, kwargs)
+        )
+        timeout = getattr(settings, 'LEAFLET_STORAGE_FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+        cache.set(cache_key, map_settings, timeout)
+    return {
+        "map_settings": map_settings,
+        "map": map_instance
     }
 
 
-@register.inclusion_tag('leaflet_storage/map_fragment.html')
-def map_fragment(map_instance, **kwargs):
-    layers = DataLayer.objects.filter(map=map_instance)
-    datalayer_data = [c.metadata for c in layers]
-    tilelayers = TileLayer.get_list()  # TODO: no need to all
+def _fragment_settings(map_instance, tilelayers, urls, kwargs):
+    datalayer_data = [c.metadata for c in map_instance.datalayer_set.all()]
     map_settings = map_instance.settings
     if not "properties" in map_settings:
         map_settings['properties'] = {}
     map_settings['properties'].update({
         'tilelayers': tilelayers,
         'datalayers': datalayer_data,
-        'urls': _urls_for_js(),
+        'urls': urls,
         'STATIC_URL': settings.STATIC_URL,
         "allowEdit": False,
         'hash': False,
@@ -52,10 +100,7 @@ def map_fragment(map_instance, **kwargs):
         'default_iconUrl': "%sstorage/src/img/marker.png" % settings.STATIC_URL,
     })
     map_settings['properties'].update(kwargs)
-    return {
-        "map_settings": simplejson.dumps(map_settings),
-        "map": map_instance
-    }
+    return map_settings
 
 
 @register.simple_tag
@@ -71,4 +116,8 @@ def tilelayer_preview(tilelayer):
 
 @register.filter
 def notag(s):
-    return s.replace('<', '&lt;')
+    """
+    Make JSON safe to embed in a <script>: no tag, and no line separators,
+    which are valid in JSON strings but end JavaScript ones.
+    """
+    return s.replace('<', '&lt;').replace(u'\u2028', u'\\u2028').replace(u'\u2029', u'\\u2029')
@@ -0,0 +1,224 @@
+"""
+Per datalayer index of the terms of its features properties, to search
+a layer without parsing its whole GeoJSON.
+
+The index is a binary file next to the layer file ("<layer>.idx"), read
+with mmap, so a search only touches the pages it needs. It holds:
+
+- a header, with the version of the layer it was built from;
+- the features table: for each feature, its byte offset and length in
+  the layer file, and its bbox (NaN when it has no geometry);
+- the terms table, sorted, each with its offset and length in the terms
+  strings, and the offset and count of its postings;
+- the terms strings, utf-8 encoded;
+- the postings: for each term, the sorted indexes of the features having
+  it in their properties.
+
+It is built when the layer content is saved with
+LEAFLET_STORAGE_TERM_INDEX, or on first search otherwise.
+"""
+import mmap
+import os
+import re
+import struct
+import sys
+import unicodedata
+from bisect import bisect_left
+from array import array
+
+from .utils import (iter_geojson_features, iter_content, read_features, atomic_write,
+                    _iter_geometries, _iter_positions)
+
+MAGIC = b"LSI1"
+HEADER = struct.Struct("<4s32sIII")  # magic, version, features, terms, strings size
+FEATURE = struct.Struct("<QI4d")  # offset, length, xmin, ymin, xmax, ymax
+TERM = struct.Struct("<IIII")  # string offset, string length, postings offset, count
+POSTING = struct.Struct("<I")
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+NAN = float('nan')
+
+
+def tokenize(text):
+    """
+    Lower cased, accents free, words of `text`.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = u"".join(c for c in text if not unicodedata.combining(c)).lower()
+    return WORD_RE.findall(text)
+
+
+def get_terms(properties):
+    terms = set()
+    for value in (properties or {}).values():
+        if isinstance(value, basestring):
+            terms.update(tokenize(value))
+        elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            terms.add(unicode(value))
+    return terms
+
+
+def get_bbox(geometry):
+    xs = []
+    ys = []
+    for item in _iter_geometries(geometry):
+        for position in _iter_positions(item.get('coordinates') or []):
+            xs.append(position[0])
+            ys.append(position[1])
+    if not xs:
+        return (NAN, ) * 4
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def get_index_path(datalayer):
+    return "%s.idx" % datalayer.geojson.path
+
+
+def build(datalayer):
+    """
+    Write the index of `datalayer`, streaming its content once.
+    """
+    features = []
+    postings = {}
+    chunks = iter_content(datalayer)
+    for position, (feature, start, end) in enumerate(iter_geojson_features(chunks, offsets=True)):
+        features.append(FEATURE.pack(start, end - start, *get_bbox(feature.get('geometry'))))
+        for term in get_terms(feature.get('properties')):
+            postings.setdefault(term.encode('utf-8'), array('I')).append(position)
+    terms = sorted(postings)
+    table = []
+    strings = []
+    strings_size = postings_size = 0
+    for term in terms:
+        count = len(postings[term])
+        table.append(TERM.pack(strings_size, len(term), postings_size, count))
+        strings.append(term)
+        strings_size += len(term)
+        postings_size += count
+    content = [HEADER.pack(MAGIC, (datalayer.version or '').encode('ascii'), len(features),
+                           len(terms), strings_size)]
+    content.extend(features)
+    content.extend(table)
+    content.extend(strings)
+    for term in terms:
+        items = postings[term]
+        if sys.byteorder != 'little':
+            items.byteswap()
+        content.append(items.tostring())
+    atomic_write(get_index_path(datalayer), b"".join(content))
+
+
+class TermIndex(object):
+    """
+    Read only, memory mapped, index of a datalayer.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.features_count, self.terms_count, strings_size = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not a term index: %s" % path)
+        self.version = version.rstrip(b'\x00').decode('ascii')
+        self.features_offset = HEADER.size
+        self.terms_offset = self.features_offset + self.features_count * FEATURE.size
+        self.strings_offset = self.terms_offset + self.terms_count * TERM.size
+        self.postings_offset = self.strings_offset + strings_size
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.terms_count
+
+    def __getitem__(self, i):
+        """
+        The i-th term, so bisect can search the terms table.
+        """
+        offset, length, _, _ = TERM.unpack_from(self.data, self.terms_offset + i * TERM.size)
+        start = self.strings_offset + offset
+        return self.data[start:start + length]
+
+    def postings(self, i):
+        _, _, offset, count = TERM.unpack_from(self.data, self.terms_offset + i * TERM.size)
+        start = self.postings_offset + offset * POSTING.size
+        return struct.unpack_from("<%sI" % count, self.data, start)
+
+    def lookup(self, prefix):
+        """
+        Indexes of the features having a term starting with `prefix`.
+        """
+        prefix = prefix.encode('utf-8')
+        found = set()
+        i = bisect_left(self, prefix)
+        while i < self.terms_count and self[i].startswith(prefix):
+            found.update(self.postings(i))
+            i += 1
+        return found
+
+    def search(self, q):
+        """
+        Sorted indexes of the features having, for each word of `q`, a
+        term starting with it.
+        """
+        found = None
+        for word in tokenize(q):
+            matching = self.lookup(word)
+            found = matching if found is None else found & matching
+            if not found:
+                break
+        return sorted(found or [])
+
+    def feature(self, i):
+        """
+        The byte offset and length of the i-th feature, and its bbox.
+        """
+        offset, length, xmin, ymin, xmax, ymax = FEATURE.unpack_from(
+            self.data, self.features_offset + i * FEATURE.size)
+        bbox = None if xmin != xmin else [xmin, ymin, xmax, ymax]
+        return offset, length, bbox
+
+
+def open_index(datalayer):
+    """
+    Open the index of `datalayer`, (re)building it when missing or built
+    from another version of the layer.
+    """
+    path = get_index_path(datalayer)
+    if os.path.exists(path):
+        index = TermIndex(path)
+        if index.version == datalayer.version and datalayer.version:
+            return index
+        index.close()
+    build(datalayer)
+    return TermIndex(path)
+
+
+def search(datalayer, q, limit=None):
+    """
+    Features of `datalayer` matching `q`, in the layer order, with their
+    "bbox". Only the matching features are read from the layer file.
+    """
+    with open_index(datalayer) as index:
+        positions = index.search(q)
+        if limit is not None:
+            positions = positions[:limit]
+        spans = []
+        bboxes = []
+        for position in positions:
+            offset, length, bbox = index.feature(position)
+            spans.append((offset, length))
+            bboxes.append(bbox)
+    results = []
+    for feature, bbox in zip(read_features(datalayer.geojson.path, spans), bboxes):
+        if bbox is not None:
+            feature['bbox'] = bbox
+        results.append(feature)
+    return results
@@ -2,10 +2,12 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.utils import simplejson
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 import factory
 
-from leaflet_storage.models import Map, TileLayer, Licence, DataLayer
+from leaflet_storage.models import Map, TileLayer, Licence, DataLayer, Pictogram
 from leaflet_storage.forms import DEFAULT_CENTER
 
 
@@ -84,6 +86,13 @@ class DataLayerFactory(factory.DjangoModelFactory):
     geojson = factory.django.FileField(data="""{"type":"FeatureCollection","features":[{"type":"Feature","geometry":{"type":"Point","coordinates":[13.68896484375,48.55297816440071]},"properties":{"_storage_options":{"color":"DarkCyan","iconClass":"Ball"},"name":"Here","description":"Da place anonymous again 755"}}],"_storage":{"displayOnLoad":true,"name":"Donau","id":926}}""")
 
 
+class PictogramFactory(factory.DjangoModelFactory):
+    FACTORY_FOR = Pictogram
+    name = "test pictogram"
+    attribution = "test pictogram attribution"
+    pictogram = "pictogram/test.png"
+
+
 class BaseFeatureFactory(factory.DjangoModelFactory):
     ABSTRACT_FACTORY = True
     name = "test feature"
@@ -91,6 +100,15 @@ class BaseFeatureFactory(factory.DjangoModelFactory):
     datalayer = factory.SubFactory(DataLayerFactory)
 
 
+def count_queries(func, *args, **kwargs):
+    """
+    Return the number of SQL queries run by func.
+    """
+    with CaptureQueriesContext(connection) as context:
+        func(*args, **kwargs)
+    return len(context)
+
+
 class BaseTest(TestCase):
     """
     Provide miminal data need in tests.
@@ -120,3 +138,15 @@ class BaseTest(TestCase):
         json = simplejson.loads(response.content)
         self.assertIn("html", json)
         self.assertIn("form", json['html'])
+
+    def assertQueriesDoNotGrow(self, build, request, sizes):
+        """
+        For each item of `sizes`, create a fixture with `build(*size)` and
+        check that `request(fixture)` always runs the same number of queries.
+        """
+        request(build(*sizes[0]))  # Warm up caches.
+        counts = {}
+        for size in sizes:
+            fixture = build(*size)
+            counts[size] = count_queries(request, fixture)
+        self.assertEqual(len(set(counts.values())), 1, counts)
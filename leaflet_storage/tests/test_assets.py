@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+
+from django.template import Template, Context
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from leaflet_storage import assets, serialization
+
+
+class AssetsTest(TestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.settings = override_settings(STATIC_ROOT=self.static_root,
+                                          STATIC_URL='/static/')
+        self.settings.enable()
+        assets._manifests.clear()
+
+    def tearDown(self):
+        self.settings.disable()
+        assets._manifests.clear()
+        shutil.rmtree(self.static_root)
+
+    def write_manifest(self):
+        directory = os.path.join(self.static_root, assets.BUNDLES_DIR)
+        os.makedirs(directory)
+        with open(os.path.join(directory, assets.MANIFEST), 'w') as f:
+            f.write(serialization.dumps({
+                'css': 'storage/bundles/leaflet_storage.abc.css',
+                'js': {
+                    '': 'storage/bundles/leaflet_storage.def.js',
+                    'fr': 'storage/bundles/leaflet_storage.fr.ghi.js',
+                }
+            }))
+
+    def render(self, tags):
+        return Template("{% load leaflet_storage_tags %}" + tags).render(Context())
+
+    def test_list_js_should_include_locale(self):
+        paths = assets.list_js('fr')
+        self.assertIn('storage/src/locale/fr.js', paths)
+        self.assertNotIn('storage/src/locale/fr.js', assets.list_js())
+        self.assertTrue(paths.index('storage/src/locale/fr.js') <
+                        paths.index('storage/src/js/leaflet.storage.core.js'))
+
+    def test_list_css(self):
+        self.assertIn('leaflet/dist/leaflet.css', assets.list_css())
+
+    def test_rewrite_urls(self):
+        css = (".a{background:url(images/layers.png)}"
+               ".b{background:url('data:image/png;base64,xx')}"
+               ".c{background:url(\"../img/icon.png\")}")
+        rewritten = assets.rewrite_urls(css, 'leaflet/dist/leaflet.css')
+        self.assertIn('url("../../leaflet/dist/images/layers.png")', rewritten)
+        self.assertIn("url('data:image/png;base64,xx')", rewritten)
+        self.assertIn('url("../../leaflet/img/icon.png")', rewritten)
+
+    def test_write_bundle_should_be_fingerprinted(self):
+        os.makedirs(os.path.join(self.static_root, assets.BUNDLES_DIR))
+        first = assets.write_bundle('test', 'js', u'var a = 1;')
+        second = assets.write_bundle('test', 'js', u'var a = 2;')
+        self.assertNotEqual(first, second)
+        self.assertEqual(first, assets.write_bundle('test', 'js', u'var a = 1;'))
+        self.assertTrue(os.path.exists(os.path.join(self.static_root, first + '.gz')))
+
+    def test_tags_should_emit_files_without_bundles(self):
+        self.write_manifest()
+        html = self.render("{% leaflet_storage_css %}{% leaflet_storage_js locale='fr' %}")
+        self.assertIn('/static/storage/src/locale/fr.js', html)
+        self.assertNotIn('bundles', html)
+
+    @override_settings(LEAFLET_STORAGE_ASSETS_BUNDLES=True)
+    def test_tags_should_emit_bundles(self):
+        self.write_manifest()
+        html = self.render("{% leaflet_storage_css %}{% leaflet_storage_js locale='fr' %}")
+        self.assertIn('href="/static/storage/bundles/leaflet_storage.abc.css"', html)
+        self.assertIn('src="/static/storage/bundles/leaflet_storage.fr.ghi.js"', html)
+        self.assertEqual(html.count('<script'), 1)
+        self.assertEqual(html.count('<link'), 1)
+
+    @override_settings(LEAFLET_STORAGE_ASSETS_BUNDLES=True)
+    def test_tags_should_fallback_without_manifest(self):
+        html = self.render("{% leaflet_storage_js %}")
+        self.assertIn('/static/storage/src/js/leaflet.storage.core.js', html)
@@ -1,8 +1,15 @@
+import hashlib
+
 from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 
 from leaflet_storage.models import Map, DataLayer
 from .base import BaseTest, UserFactory, DataLayerFactory, MapFactory
 
+POLYGON = '''{"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]}}]}'''
+
 
 class MapModel(BaseTest):
 
@@ -43,6 +50,45 @@ class MapModel(BaseTest):
         self.map.save()
         self.assertTrue(self.map.can_edit(editor))
 
+    def test_editors_membership_should_be_memoised(self):
+        editor = UserFactory(username="John", password="123123")
+        self.map.edit_status = self.map.EDITORS
+        self.map.share_status = self.map.PRIVATE
+        self.map.editors.add(editor)
+        self.map.save()
+        map_inst = Map.objects.get(pk=self.map.pk)
+        request = RequestFactory().get('/')
+        request.user = editor
+        with self.assertNumQueries(1):
+            self.assertTrue(map_inst.can_view(request))
+            self.assertTrue(map_inst.can_edit(editor, request))
+            self.assertTrue(map_inst.can_edit(editor, request))
+
+    def test_owner_permissions_should_not_need_queries(self):
+        map_inst = Map.objects.get(pk=self.map.pk)
+        map_inst.share_status = map_inst.PRIVATE
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.assertTrue(map_inst.can_view(request))
+            self.assertTrue(map_inst.can_edit(self.user, request))
+
+    def test_editors_cache_should_be_cleared_when_editors_change(self):
+        editor = UserFactory(username="John", password="123123")
+        self.map.edit_status = self.map.EDITORS
+        self.assertFalse(self.map.can_edit(editor))
+        self.map.editors.add(editor)
+        self.assertTrue(self.map.can_edit(editor))
+
+    def test_editors_cache_should_be_cleared_from_user_side(self):
+        editor = UserFactory(username="John", password="123123")
+        self.map.edit_status = self.map.EDITORS
+        self.assertFalse(self.map.can_edit(editor))
+        editor.map_set.add(self.map)
+        self.assertTrue(self.map.can_edit(editor))
+        editor.map_set.remove(self.map)
+        self.assertFalse(self.map.can_edit(editor))
+
     def test_clone_should_return_new_instance(self):
         clone = self.map.clone()
         self.assertNotEqual(self.map.pk, clone.pk)
@@ -150,4 +196,80 @@ class DataLayerModel(BaseTest):
         self.assertEqual(
             DataLayer.upload_to(self.datalayer, None),
             "datalayer/1/1/namenamenamenamenamenamenamenamenamenamenamenamena.geojson"
-        )
\ No newline at end of file
+        )
+
+    def test_version_should_be_content_digest(self):
+        self.assertEqual(len(self.datalayer.version), 32)
+        other = DataLayerFactory(map=self.map, geojson__data="{}")
+        self.assertNotEqual(self.datalayer.version, other.version)
+        self.assertEqual(other.version, hashlib.md5(b"{}").hexdigest())
+
+    def test_version_of_invalid_content_should_be_file_digest(self):
+        other = DataLayerFactory(map=self.map, geojson__data=POLYGON[:50])
+        self.assertEqual(other.version, hashlib.md5(POLYGON[:50]).hexdigest())
+
+    def test_version_should_be_kept_if_content_does_not_change(self):
+        version = self.datalayer.version
+        self.datalayer.name = "new name"
+        self.datalayer.save()
+        self.assertEqual(version, self.datalayer.version)
+
+    def test_absolute_url_should_contain_version(self):
+        self.assertIn(self.datalayer.version, self.datalayer.get_absolute_url())
+
+    def test_save_should_update_map_modified_at(self):
+        modified_at = Map.objects.get(pk=self.map.pk).modified_at
+        self.datalayer.save()
+        self.assertGreater(Map.objects.get(pk=self.map.pk).modified_at, modified_at)
+
+    def test_extent_should_be_computed_on_save(self):
+        self.assertEqual(
+            self.datalayer.extent.extent,
+            (13.68896484375, 48.55297816440071, 13.68896484375, 48.55297816440071)
+        )
+
+    def test_extent_should_be_none_for_invalid_geojson(self):
+        other = DataLayerFactory(map=self.map, geojson__data="{}")
+        self.assertIsNone(other.extent)
+
+    def test_stats_should_be_computed_on_save(self):
+        other = DataLayerFactory(map=self.map, geojson__data=POLYGON)
+        self.assertEqual(other.features_count, 1)
+        self.assertEqual(other.size, len(POLYGON))
+
+    def test_map_stats_should_be_sum_of_datalayers_stats(self):
+        other = DataLayerFactory(map=self.map, geojson__data=POLYGON)
+        map_inst = Map.objects.get(pk=self.map.pk)
+        self.assertEqual(map_inst.features_count, 2)
+        self.assertEqual(map_inst.size, self.datalayer.size + other.size)
+        other.delete()
+        map_inst = Map.objects.get(pk=self.map.pk)
+        self.assertEqual(map_inst.features_count, 1)
+        self.assertEqual(map_inst.size, self.datalayer.size)
+
+    def test_map_extent_should_be_union_of_datalayers_extents(self):
+        other = DataLayerFactory(map=self.map, geojson__data=POLYGON)
+        extent = (0, 0, 13.68896484375, 48.55297816440071)
+        self.assertEqual(Map.objects.get(pk=self.map.pk).extent.extent, extent)
+        other.delete()
+        self.assertEqual(Map.objects.get(pk=self.map.pk).extent.extent,
+                         self.datalayer.extent.extent)
+        self.datalayer.delete()
+        self.assertIsNone(Map.objects.get(pk=self.map.pk).extent)
+
+    @override_settings(LEAFLET_STORAGE_FEATURE_INDEX=True, LEAFLET_STORAGE_INDEX_WORKERS=1)
+    def test_indexes_should_wait_for_commit(self):
+        # Test cases run in a transaction, never committed.
+        other = DataLayerFactory(map=self.map, geojson__data=POLYGON)
+        self.assertFalse(other.indexed_features.exists())
+
+    def test_storagemapstats_should_repair_stats(self):
+        other = DataLayerFactory(map=self.map, geojson__data=POLYGON)
+        DataLayer.objects.update(features_count=0, size=0, extent=None)
+        Map.objects.update(features_count=0, size=0, extent=None)
+        call_command('storagemapstats', workers=1)
+        self.assertEqual(DataLayer.objects.get(pk=other.pk).features_count, 1)
+        map_inst = Map.objects.get(pk=self.map.pk)
+        self.assertEqual(map_inst.features_count, 2)
+        self.assertEqual(map_inst.size, self.datalayer.size + other.size)
+        self.assertEqual(map_inst.extent.extent, (0, 0, 13.68896484375, 48.55297816440071))
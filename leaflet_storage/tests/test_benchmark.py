@@ -0,0 +1,33 @@
+import os
+
+from django.test import TestCase
+
+from leaflet_storage import benchmark
+from leaflet_storage.models import Map, Pictogram
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run_should_return_results_and_remove_data(self):
+        results = benchmark.run(repeat=1, datalayers=2, features=3, editors=2,
+                                tilelayers=1, pictograms=2)
+        self.assertEqual(results['params']['datalayers'], 2)
+        for name, factory in benchmark.BENCHMARKS:
+            self.assertIn(name, results['results'])
+            self.assertIn('median', results['results'][name]['latency_ms'])
+            self.assertIn('queries', results['results'][name])
+        self.assertEqual(Map.objects.count(), 0)
+        self.assertEqual(Pictogram.objects.count(), 0)
+
+    def test_seeded_should_only_remove_its_files(self):
+        with benchmark.seeded(datalayers=1, features=3, editors=0,
+                              tilelayers=0, pictograms=0) as scenario:
+            path = scenario.datalayer.geojson.path
+            other = os.path.join(os.path.dirname(path), "not-from-the-benchmark.geojson")
+            with open(other, 'w') as f:
+                f.write("{}")
+        try:
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(os.path.exists(other))
+        finally:
+            os.remove(other)
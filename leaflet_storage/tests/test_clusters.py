@@ -0,0 +1,136 @@
+import math
+import os
+from unittest import skipIf
+
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from leaflet_storage import clusters
+from leaflet_storage.models import Map
+from .base import BaseTest, DataLayerFactory
+
+
+def point(lng, lat, name):
+    return {"type": "Feature", "properties": {"name": name},
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}}
+
+
+def geojson():
+    # 100 points around Paris, one in Lima, and a line, ignored.
+    features = [point(2.3 + i * 0.001, 48.8 + i * 0.001, "paris %s" % i) for i in range(100)]
+    features.append(point(-77.04, -12.05, "lima"))
+    features.append({"type": "Feature", "properties": {},
+                     "geometry": {"type": "LineString", "coordinates": [[0, 0], [1, 1]]}})
+    return simplejson.dumps({"type": "FeatureCollection", "features": features})
+
+
+def tile_of(lng, lat, zoom):
+    n = 2 ** zoom
+    lat = math.radians(lat)
+    return (int((lng + 180) / 360 * n),
+            int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n))
+
+
+@skipIf(clusters.numpy is None, "NumPy is not installed")
+@override_settings(LEAFLET_STORAGE_CLUSTER_WORKERS=0)
+class ClustersTest(BaseTest):
+
+    def setUp(self):
+        super(ClustersTest, self).setUp()
+        self.layer = DataLayerFactory(map=self.map, geojson__data=geojson())
+
+    def tearDown(self):
+        path = clusters.get_path(self.layer)
+        if os.path.exists(path):
+            os.remove(path)
+        super(ClustersTest, self).tearDown()
+
+    def test_tile_bounds(self):
+        expected = (0, -clusters.MAX_LATITUDE, 180, 0)
+        for value, bound in zip(clusters.tile_bounds(1, 1, 1), expected):
+            self.assertAlmostEqual(value, bound)
+
+    def test_low_zoom_should_cluster_points(self):
+        features = clusters.get_tile(self.layer, 0, 0, 0)
+        grouped = [f for f in features if f['properties'].get('cluster')]
+        alone = [f for f in features if not f['properties'].get('cluster')]
+        self.assertEqual(len(grouped), 1)
+        self.assertEqual(grouped[0]['properties']['count'], 100)
+        self.assertGreater(grouped[0]['properties']['expansion_zoom'], 0)
+        self.assertEqual([f['properties']['name'] for f in alone], ["lima"])
+
+    def test_counts_should_be_kept_at_every_zoom(self):
+        # Tiles around Paris, which include Lima until zoom 2.
+        for zoom in range(0, 12):
+            n = 2 ** zoom
+            x, y = tile_of(2.35, 48.85, zoom)
+            tiles = set(((x + dx) % n, (y + dy) % n) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+            total = 0
+            for tx, ty in tiles:
+                for feature in clusters.get_tile(self.layer, zoom, tx, ty):
+                    total += feature['properties'].get('count', 1)
+            self.assertEqual(total, 100 if zoom > 2 else 101, zoom)
+
+    @override_settings(LEAFLET_STORAGE_CLUSTER_MAX_ZOOM=10)
+    def test_above_max_zoom_should_serve_features(self):
+        x, y = tile_of(2.35, 48.85, 11)
+        features = clusters.get_tile(self.layer, 11, x, y)
+        self.assertTrue(features)
+        for feature in features:
+            self.assertFalse(feature['properties'].get('cluster'))
+            self.assertTrue(feature['properties']['name'].startswith('paris'))
+
+    def test_outdated_pyramid_should_be_served_and_rebuilt(self):
+        clusters.get_tile(self.layer, 0, 0, 0)
+        self.layer.version = "0" * 32
+        self.assertEqual(len(clusters.get_tile(self.layer, 0, 0, 0)), 2)
+        pyramid = clusters.numpy.load(clusters.get_path(self.layer))
+        self.assertEqual(str(pyramid['version']), "0" * 32)
+        pyramid.close()
+
+    @override_settings(LEAFLET_STORAGE_CLUSTER_WORKERS=1)
+    def test_outdated_pyramid_should_wait_for_commit(self):
+        clusters.get_tile(self.layer, 0, 0, 0)
+        self.layer.version = "0" * 32
+        self.addCleanup(clusters._pending.discard, (self.layer.pk, self.layer.version))
+        # Test cases run in a transaction, never committed.
+        self.assertEqual(len(clusters.get_tile(self.layer, 0, 0, 0)), 2)
+        pyramid = clusters.numpy.load(clusters.get_path(self.layer))
+        self.assertNotEqual(str(pyramid['version']), "0" * 32)
+        pyramid.close()
+
+    @override_settings(LEAFLET_STORAGE_CLUSTERS=True, LEAFLET_STORAGE_INDEX_WORKERS=0)
+    def test_save_should_build_pyramid(self):
+        layer = DataLayerFactory(map=self.map, geojson__data=geojson())
+        path = clusters.get_path(layer)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+    def test_build_should_leave_no_temporary_file(self):
+        clusters.build(self.layer)
+        directory = os.path.dirname(clusters.get_path(self.layer))
+        self.assertEqual([name for name in os.listdir(directory) if name.startswith('.tmp')], [])
+
+    def test_view(self):
+        url = reverse('datalayer_clusters', kwargs={'pk': self.layer.pk, 'z': 0, 'x': 0, 'y': 0})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = simplejson.loads(response.content)
+        self.assertEqual(len(data['features']), 2)
+        url = reverse('datalayer_clusters', kwargs={'pk': self.layer.pk, 'z': 1, 'x': 2, 'y': 0})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_view_should_check_permissions(self):
+        self.map.share_status = Map.PRIVATE
+        self.map.save()
+        url = reverse('datalayer_clusters', kwargs={'pk': self.layer.pk, 'z': 0, 'x': 0, 'y': 0})
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_view_without_content_should_not_be_found(self):
+        empty = DataLayerFactory(map=self.map, geojson=None)
+        url = reverse('datalayer_clusters', kwargs={'pk': empty.pk, 'z': 0, 'x': 0, 'y': 0})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        os.remove(self.layer.geojson.path)
+        url = reverse('datalayer_clusters', kwargs={'pk': self.layer.pk, 'z': 0, 'x': 0, 'y': 0})
+        self.assertEqual(self.client.get(url).status_code, 404)
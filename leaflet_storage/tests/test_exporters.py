@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import csv
+import zipfile
+from io import BytesIO
+from xml.etree import cElementTree as ElementTree
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import simplejson
+
+from leaflet_storage import exporters
+from leaflet_storage.models import Map
+from .base import BaseTest, DataLayerFactory
+
+GEOJSON = simplejson.dumps({"type": "FeatureCollection", "features": [
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [2.35, 48.85]},
+     "properties": {"name": u"Café", "kind": "bar", "_storage_options": {"color": "Red"}}},
+    {"type": "Feature", "geometry": {"type": "LineString", "coordinates": [[0, 0], [2, 4]]},
+     "properties": {"name": "Walk"}},
+]})
+# Cut in the middle of its second feature.
+TRUNCATED = GEOJSON[:GEOJSON.index('"Walk"')]
+
+
+def content(response):
+    return b"".join(response.streaming_content)
+
+
+class ExportersTest(TestCase):
+
+    def test_get_position(self):
+        self.assertEqual(exporters.get_position({"type": "Point", "coordinates": [1, 2]}), (1, 2))
+        self.assertEqual(exporters.get_position(
+            {"type": "LineString", "coordinates": [[0, 0], [2, 4]]}), (1, 2))
+        self.assertEqual(exporters.get_position(None), (None, None))
+
+    def test_kml_geometry(self):
+        kml = exporters.kml_geometry(
+            {"type": "MultiPoint", "coordinates": [[1, 2], [3, 4]]})
+        self.assertEqual(kml, u"<MultiGeometry><Point><coordinates>1,2</coordinates></Point>"
+                              u"<Point><coordinates>3,4</coordinates></Point></MultiGeometry>")
+
+    def test_streaming_zip(self):
+        archive = exporters.StreamingZip()
+        data = [chunk for chunk in archive.entry(u"a.txt", [b"abc" * 1000, b"def"])]
+        data.extend(archive.entry(u"b.txt", []))
+        data.append(archive.close())
+        archive = zipfile.ZipFile(BytesIO(b"".join(data)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read("a.txt"), b"abc" * 1000 + b"def")
+        self.assertEqual(archive.read("b.txt"), b"")
+
+
+class ExportViewsTest(BaseTest):
+
+    def setUp(self):
+        super(ExportViewsTest, self).setUp()
+        self.layer = DataLayerFactory(map=self.map, name="Paris", geojson__data=GEOJSON)
+
+    def export(self, fmt):
+        url = reverse('datalayer_export', kwargs={'pk': self.layer.pk, 'format': fmt})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], exporters.FORMATS[fmt][1])
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="paris.%s"' % exporters.FORMATS[fmt][2])
+        return content(response)
+
+    def test_geojson(self):
+        data = simplejson.loads(self.export('geojson'))
+        self.assertEqual(len(data['features']), 2)
+        self.assertEqual(data['features'][0]['properties']['name'], u"Café")
+
+    def test_ndgeojson(self):
+        data = self.export('ndgeojson')
+        self.assertNotIn(b'\x1e', data)
+        lines = data.splitlines()
+        self.assertEqual([simplejson.loads(line)['properties']['name'] for line in lines],
+                         [u"Café", "Walk"])
+
+    def test_csv(self):
+        rows = list(csv.reader(BytesIO(self.export('csv'))))
+        self.assertEqual(rows[0], ['kind', 'name', 'lon', 'lat'])
+        self.assertEqual(rows[1], ['bar', u"Café".encode('utf-8'), '2.35', '48.85'])
+        self.assertEqual(rows[2], ['', 'Walk', '1.0', '2.0'])
+
+    def test_kml(self):
+        root = ElementTree.fromstring(self.export('kml'))
+        names = [elem.text for elem in root.iter('{http://www.opengis.net/kml/2.2}name')]
+        self.assertEqual(names, [u"Café", "Walk"])
+
+    def test_gpx(self):
+        root = ElementTree.fromstring(self.export('gpx'))
+        tags = [child.tag.split('}')[1] for child in root]
+        self.assertEqual(tags, ['wpt', 'trk'])
+
+    def test_map_export(self):
+        url = reverse('map_export', kwargs={'pk': self.map.pk, 'format': 'geojson'})
+        data = simplejson.loads(content(self.client.get(url)))
+        # The default layer of BaseTest, and this one.
+        self.assertEqual(len(data['features']), 3)
+
+    def test_map_export_as_zip(self):
+        url = reverse('map_export', kwargs={'pk': self.map.pk, 'format': 'kml'})
+        response = self.client.get(url, {'zip': 1})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(content(response)))
+        self.assertEqual(sorted(archive.namelist()), ['paris.kml', 'test-datalayer.kml'])
+
+    def test_invalid_datalayer_should_not_be_exported(self):
+        invalid = DataLayerFactory(map=self.map, name="Invalid", geojson__data=TRUNCATED)
+        url = reverse('datalayer_export', kwargs={'pk': invalid.pk, 'format': 'geojson'})
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_map_export_should_skip_invalid_datalayers(self):
+        DataLayerFactory(map=self.map, name="Invalid", geojson__data=TRUNCATED)
+        url = reverse('map_export', kwargs={'pk': self.map.pk, 'format': 'geojson'})
+        data = simplejson.loads(content(self.client.get(url)))
+        self.assertEqual(len(data['features']), 3)
+        url = reverse('map_export', kwargs={'pk': self.map.pk, 'format': 'csv'})
+        self.assertEqual(len(list(csv.reader(BytesIO(content(self.client.get(url)))))), 4)
+        response = self.client.get(url, {'zip': 1})
+        archive = zipfile.ZipFile(BytesIO(content(response)))
+        self.assertEqual(sorted(archive.namelist()), ['paris.csv', 'test-datalayer.csv'])
+
+    def test_private_map_export(self):
+        self.map.share_status = Map.PRIVATE
+        self.map.save()
+        url = reverse('map_export', kwargs={'pk': self.map.pk, 'format': 'csv'})
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_private_datalayer_export(self):
+        self.map.share_status = Map.PRIVATE
+        self.map.save()
+        url = reverse('datalayer_export', kwargs={'pk': self.layer.pk, 'format': 'csv'})
+        self.assertEqual(self.client.get(url).status_code, 403)
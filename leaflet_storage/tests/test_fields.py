@@ -31,3 +31,37 @@ class DictFieldTest(BaseTest):
             Map.objects.get(pk=self.map.pk).settings,
             {}
         )
+
+    def test_should_not_decode_value_until_accessed(self):
+        map_inst = Map.objects.get(pk=self.map.pk)
+        self.assertTrue(isinstance(map_inst.__dict__['settings'], basestring))
+        self.assertIn('properties', map_inst.settings)
+        self.assertTrue(isinstance(map_inst.__dict__['settings'], dict))
+
+    def test_should_not_serialize_untouched_value(self):
+        map_inst = Map.objects.get(pk=self.map.pk)
+        raw = map_inst.__dict__['settings']
+        map_inst.name = "new name"
+        map_inst.save()
+        self.assertEqual(Map.objects.get(pk=self.map.pk).__dict__['settings'], raw)
+
+    def test_should_not_serialize_value_only_read(self):
+        map_inst = Map.objects.get(pk=self.map.pk)
+        raw = map_inst.__dict__['settings']
+        self.assertIn('properties', map_inst.settings)
+        self.assertEqual(map_inst._meta.get_field('settings').pre_save(map_inst, False), raw)
+
+    def test_should_serialize_mutated_value(self):
+        map_inst = Map.objects.get(pk=self.map.pk)
+        map_inst.settings['color'] = 'DarkGreen'
+        map_inst.save()
+        self.assertEqual(Map.objects.get(pk=self.map.pk).settings['color'], 'DarkGreen')
+
+    def test_can_set_json_string(self):
+        self.map.settings = '{"locateControl": true}'
+        self.assertEqual(self.map.settings, {'locateControl': True})
+        self.map.save()
+        self.assertEqual(
+            Map.objects.get(pk=self.map.pk).settings,
+            {'locateControl': True}
+        )
@@ -0,0 +1,122 @@
+import os
+
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from leaflet_storage import exporters, geojsonseq
+from leaflet_storage.models import DataLayer
+from leaflet_storage.utils import iter_geojson_features, iter_content
+from .base import BaseTest, DataLayerFactory
+
+
+def feature(i):
+    return {"type": "Feature", "properties": {"name": "feature %s" % i},
+            "geometry": {"type": "Point", "coordinates": [i, i]}}
+
+
+GEOJSON = simplejson.dumps({
+    "type": "FeatureCollection",
+    "features": [feature(i) for i in range(10)],
+    "_storage": {"name": "Points"}
+})
+
+
+def content(response):
+    return b"".join(response.streaming_content)
+
+
+@override_settings(LEAFLET_STORAGE_GEOJSONSEQ=True)
+class GeoJSONSeqTest(BaseTest):
+
+    def setUp(self):
+        super(GeoJSONSeqTest, self).setUp()
+        self.layer = DataLayerFactory(map=self.map, geojson__data=GEOJSON)
+
+    def tearDown(self):
+        path = geojsonseq.get_lines_path(self.layer)
+        if os.path.exists(path):
+            os.remove(path)
+        super(GeoJSONSeqTest, self).tearDown()
+
+    def get(self, **params):
+        url = reverse('datalayer_view', kwargs={'pk': self.layer.pk})
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return content(response)
+
+    def test_content_should_be_stored_as_sequence(self):
+        self.assertTrue(geojsonseq.is_sequence(self.layer))
+        self.assertEqual(self.layer.features_count, 10)
+        with open(self.layer.geojson.path, 'rb') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(all(line.startswith(geojsonseq.RS) for line in lines))
+        header = simplejson.loads(lines[0][1:])
+        self.assertEqual(header['_storage'], {"name": "Points"})
+
+    def test_sequence_is_read_by_streaming_reader(self):
+        with open(self.layer.geojson.path, 'rb') as f:
+            data = f.read()
+        members = {}
+        features = list(iter_geojson_features([data], offsets=True, members=members))
+        self.assertEqual([item[0] for item in features], [feature(i) for i in range(10)])
+        start, end = features[3][1:]
+        self.assertEqual(simplejson.loads(data[start:end]), feature(3))
+        self.assertEqual(members['_storage'], {"name": "Points"})
+
+    def test_view_should_wrap_sequence_in_collection(self):
+        data = simplejson.loads(self.get())
+        self.assertEqual(data['type'], "FeatureCollection")
+        self.assertEqual(data['_storage'], {"name": "Points"})
+        self.assertEqual(data['features'], [feature(i) for i in range(10)])
+
+    def test_view_should_serve_a_range(self):
+        data = simplejson.loads(self.get(start=4, limit=3))
+        self.assertEqual(data['features'], [feature(i) for i in range(4, 7)])
+        data = simplejson.loads(self.get(start=20))
+        self.assertEqual(data['features'], [])
+
+    def test_view_should_serve_sequence(self):
+        data = self.get(format='geojsonseq', start=8)
+        self.assertEqual(list(iter_geojson_features([data])), [feature(8), feature(9)])
+
+    def test_view_should_reject_invalid_range(self):
+        url = reverse('datalayer_view', kwargs={'pk': self.layer.pk})
+        self.assertEqual(self.client.get(url, {'start': 'a'}).status_code, 400)
+
+    def test_append(self):
+        self.client.login(username=self.user.username, password="123123")
+        version = self.layer.version
+        old_url = self.layer.get_absolute_url()
+        url = reverse('datalayer_append', kwargs={'map_id': self.map.pk, 'pk': self.layer.pk})
+        body = simplejson.dumps({"type": "FeatureCollection",
+                                 "features": [feature(10), feature(11)]})
+        response = self.client.post(url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        layer = DataLayer.objects.get(pk=self.layer.pk)
+        self.assertEqual(layer.geojson.name, self.layer.geojson.name)
+        self.assertNotEqual(layer.version, version)
+        self.assertEqual(layer.features_count, 12)
+        self.assertEqual(layer.extent.extent, (0, 0, 11, 11))
+        self.assertEqual(len(geojsonseq.get_lines(layer)), 12)
+        data = simplejson.loads(self.get(start=10))
+        self.assertEqual(data['features'], [feature(10), feature(11)])
+        self.assertEqual(self.client.get(old_url).status_code, 302)
+
+    def test_append_to_collection_should_fail(self):
+        self.client.login(username=self.user.username, password="123123")
+        with self.settings(LEAFLET_STORAGE_GEOJSONSEQ=False):
+            layer = DataLayerFactory(map=self.map)
+        self.assertFalse(geojsonseq.is_sequence(layer))
+        url = reverse('datalayer_append', kwargs={'map_id': self.map.pk, 'pk': layer.pk})
+        response = self.client.post(url, GEOJSON, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_readers_should_ignore_failed_append_leftovers(self):
+        with open(self.layer.geojson.path, 'ab') as f:
+            f.write(geojsonseq.record(feature(10)) + b'{"type": "Fea')
+        content = b"".join(iter_content(self.layer))
+        self.assertEqual(len(content), self.layer.size)
+        features = list(exporters.iter_features([self.layer]))
+        self.assertEqual(features, [feature(i) for i in range(10)])
@@ -0,0 +1,89 @@
+import os
+import struct
+from io import BytesIO
+from unittest import skipIf
+
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from PIL import Image
+
+from leaflet_storage import heatmaps
+from leaflet_storage.models import Map
+from .base import BaseTest, DataLayerFactory
+from .test_clusters import geojson, tile_of
+
+
+@skipIf(heatmaps.numpy is None, "NumPy is not installed")
+@override_settings(LEAFLET_STORAGE_HEATMAP_WORKERS=0, LEAFLET_STORAGE_HEATMAP_RESOLUTION=16)
+class HeatmapsTest(BaseTest):
+
+    def setUp(self):
+        super(HeatmapsTest, self).setUp()
+        self.layer = DataLayerFactory(map=self.map, geojson__data=geojson())
+
+    def tearDown(self):
+        path = heatmaps.get_path(self.layer)
+        if os.path.exists(path):
+            os.remove(path)
+        super(HeatmapsTest, self).tearDown()
+
+    def test_grids_should_count_all_points_at_every_zoom(self):
+        for zoom in (0, 4, 8, 12):
+            x, y = tile_of(2.35, 48.85, zoom)
+            grid, max_count = heatmaps.get_grid(self.layer, zoom, x, y)
+            self.assertEqual(grid.shape, (16, 16))
+            # Lima is in the same tile at zoom 0.
+            self.assertEqual(grid.sum(), 101 if zoom == 0 else 100, zoom)
+            self.assertEqual(grid.max(), max_count)
+
+    def test_beyond_max_zoom_should_have_no_grid(self):
+        self.assertEqual(heatmaps.get_grid(self.layer, heatmaps.get_max_zoom() + 1, 0, 0),
+                         (None, 0))
+
+    def test_outdated_grids_should_be_served_and_rebuilt(self):
+        heatmaps.get_grid(self.layer, 0, 0, 0)
+        self.layer.version = "0" * 32
+        self.assertEqual(heatmaps.get_grid(self.layer, 0, 0, 0)[0].sum(), 101)
+        grids = heatmaps.numpy.load(heatmaps.get_path(self.layer))
+        self.assertEqual(str(grids['version']), "0" * 32)
+        grids.close()
+
+    @override_settings(LEAFLET_STORAGE_HEATMAPS=True, LEAFLET_STORAGE_INDEX_WORKERS=0)
+    def test_save_should_build_grids(self):
+        layer = DataLayerFactory(map=self.map, geojson__data=geojson())
+        path = heatmaps.get_path(layer)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+
+    def test_views(self):
+        x, y = tile_of(2.35, 48.85, 4)
+        kwargs = {'pk': self.layer.pk, 'z': 4, 'x': x, 'y': y}
+        response = self.client.get(reverse('datalayer_heatmap', kwargs=dict(kwargs, ext='png')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        image = Image.open(BytesIO(response.content))
+        self.assertEqual(image.size, (16, 16))
+        self.assertEqual(max(image.getdata()), 255)
+        response = self.client.get(reverse('datalayer_heatmap', kwargs=dict(kwargs, ext='bin')))
+        self.assertEqual(response['X-Heatmap-Resolution'], '16')
+        counts = struct.unpack('<256I', response.content)
+        self.assertEqual(sum(counts), 100)
+        self.assertEqual(str(max(counts)), response['X-Heatmap-Max'])
+
+    def test_views_should_check_permissions(self):
+        self.map.share_status = Map.PRIVATE
+        self.map.save()
+        kwargs = {'pk': self.layer.pk, 'z': 0, 'x': 0, 'y': 0, 'ext': 'png'}
+        self.assertEqual(self.client.get(reverse('datalayer_heatmap', kwargs=kwargs)).status_code,
+                         403)
+
+    def test_views_without_content_should_not_be_found(self):
+        empty = DataLayerFactory(map=self.map, geojson=None)
+        kwargs = {'pk': empty.pk, 'z': 0, 'x': 0, 'y': 0, 'ext': 'png'}
+        self.assertEqual(self.client.get(reverse('datalayer_heatmap', kwargs=kwargs)).status_code,
+                         404)
+        os.remove(self.layer.geojson.path)
+        kwargs['pk'] = self.layer.pk
+        self.assertEqual(self.client.get(reverse('datalayer_heatmap', kwargs=kwargs)).status_code,
+                         404)
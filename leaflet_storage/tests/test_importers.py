@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from leaflet_storage import importers
+from leaflet_storage.models import DataLayer
+from .base import BaseTest
+
+CSV = u"name;Lat;Lon;kind\nCafé;48,85;2,35;bar\nno position;;;\nBakery;48.8;2.3;shop\n".encode('utf-8')
+
+KML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder>
+  <Placemark><name>Point</name>
+    <ExtendedData><Data name="kind"><value>bar</value></Data></ExtendedData>
+    <Point><coordinates>2.35,48.85,0</coordinates></Point></Placemark>
+  <Placemark><name>Square</name><Polygon><outerBoundaryIs><LinearRing>
+    <coordinates>0,0 1,0 1,1 0,0</coordinates></LinearRing></outerBoundaryIs></Polygon></Placemark>
+</Folder></Document></kml>"""
+
+GPX = b"""<gpx xmlns="http://www.topografix.com/GPX/1/1">
+  <wpt lat="48.85" lon="2.35"><name>Start</name></wpt>
+  <trk><name>Walk</name><trkseg><trkpt lat="48.85" lon="2.35"/><trkpt lat="48.86" lon="2.36"/></trkseg></trk>
+</gpx>"""
+
+OSM = b"""<osm version="0.6">
+  <node id="1" lat="48.85" lon="2.35"><tag k="amenity" v="cafe"/></node>
+  <node id="2" lat="48.85" lon="2.36"/>
+  <node id="3" lat="48.86" lon="2.36"/>
+  <way id="10"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="1"/><tag k="building" v="yes"/></way>
+  <way id="11"><nd ref="2"/><nd ref="3"/><tag k="highway" v="path"/></way>
+  <way id="12"><nd ref="1"/><nd ref="3"/></way>
+  <relation id="20"><member type="way" ref="10"/><tag k="type" v="multipolygon"/></relation>
+</osm>"""
+
+
+def convert(fmt, content):
+    return list(importers.FORMATS[fmt](BytesIO(content)))
+
+
+class ConvertersTest(TestCase):
+
+    def test_csv(self):
+        features = convert('csv', CSV)
+        self.assertEqual(len(features), 2)
+        self.assertEqual(features[0]['geometry']['coordinates'], [2.35, 48.85])
+        self.assertEqual(features[0]['properties'], {u'name': u'Café', u'kind': u'bar'})
+
+    def test_csv_without_position_columns(self):
+        self.assertRaises(ValueError, convert, 'csv', b"name,city\na,b\n")
+
+    def test_kml(self):
+        features = convert('kml', KML)
+        self.assertEqual([f['geometry']['type'] for f in features], ['Point', 'Polygon'])
+        self.assertEqual(features[0]['properties'], {'name': 'Point', 'kind': 'bar'})
+        self.assertEqual(features[1]['geometry']['coordinates'][0][2], [1, 1])
+
+    def test_gpx(self):
+        features = convert('gpx', GPX)
+        self.assertEqual([f['geometry']['type'] for f in features], ['Point', 'LineString'])
+        self.assertEqual(features[1]['geometry']['coordinates'], [[2.35, 48.85], [2.36, 48.86]])
+        self.assertEqual(features[1]['properties']['name'], 'Walk')
+
+    def test_osm(self):
+        features = convert('osm', OSM)
+        self.assertEqual([f['properties']['@id'] for f in features],
+                         ['node/1', 'way/10', 'way/11'])
+        self.assertEqual([f['geometry']['type'] for f in features],
+                         ['Point', 'Polygon', 'LineString'])
+
+    def test_write_geojson(self):
+        out = BytesIO()
+        counts = list(importers.write_geojson(convert('gpx', GPX), out, u"Walk"))
+        self.assertEqual(counts[-1], 2)
+        data = simplejson.loads(out.getvalue())
+        self.assertEqual(data['_storage']['name'], u"Walk")
+        self.assertEqual(len(data['features']), 2)
+
+    def test_xml_with_dtd_should_be_rejected(self):
+        bomb = (b'<?xml version="1.0"?>\n<!DOCTYPE kml [<!ENTITY a "aaaaaaaaaa">'
+                b'<!ENTITY b "&a;&a;&a;&a;&a;&a;&a;&a;&a;&a;">]>\n'
+                b'<kml><Placemark><name>&b;</name></Placemark></kml>')
+        self.assertRaises(ValueError, convert, 'kml', bomb)
+
+    def test_guess_format(self):
+        self.assertEqual(importers.guess_format("track.GPX"), 'gpx')
+        self.assertEqual(importers.guess_format("data.geojson"), None)
+
+
+@override_settings(LEAFLET_STORAGE_IMPORT_WORKERS=0)
+class ImportViewsTest(BaseTest):
+
+    def setUp(self):
+        super(ImportViewsTest, self).setUp()
+        self.url = reverse('datalayer_import', kwargs={'map_id': self.map.pk})
+        self.client.login(username=self.user.username, password="123123")
+
+    def test_import_should_create_datalayer(self):
+        response = self.client.post(self.url, {
+            'data': SimpleUploadedFile("paris.kml", KML),
+            'name': "Paris",
+        })
+        self.assertEqual(response.status_code, 200)
+        status_url = simplejson.loads(response.content)['url']
+        status = simplejson.loads(self.client.get(status_url).content)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['features'], 2)
+        datalayer = DataLayer.objects.get(pk=status['datalayer']['id'])
+        self.assertEqual(datalayer.map, self.map)
+        self.assertEqual(datalayer.name, "Paris")
+        self.assertEqual(datalayer.features_count, 2)
+        self.assertTrue(datalayer.version)
+
+    def test_invalid_file_should_report_error(self):
+        response = self.client.post(self.url, {
+            'data': SimpleUploadedFile("broken.gpx", b"<gpx><wpt"),
+        })
+        status_url = simplejson.loads(response.content)['url']
+        status = simplejson.loads(self.client.get(status_url).content)
+        self.assertEqual(status['status'], 'error')
+        self.assertFalse(DataLayer.objects.filter(name="broken").exists())
+
+    def test_unknown_format(self):
+        response = self.client.post(self.url, {'data': SimpleUploadedFile("a.shp", b"")})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_job(self):
+        url = reverse('datalayer_import_status', kwargs={'job_id': "0" * 32})
+        self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,129 @@
+import random
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from leaflet_storage.instrumentation import MemorySink, MemoryProfile
+from leaflet_storage.loadtest import write_feature_collection
+from leaflet_storage.models import DataLayer
+from leaflet_storage.views import STREAMING_BLOCK_SIZE
+from .base import BaseTest
+
+
+@override_settings(
+    MIDDLEWARE_CLASSES=tuple(settings.MIDDLEWARE_CLASSES) + (
+        'leaflet_storage.instrumentation.InstrumentationMiddleware',
+    ),
+    LEAFLET_STORAGE_METRICS_SINK='leaflet_storage.instrumentation.MemorySink'
+)
+class InstrumentationTest(BaseTest):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        del MemorySink.records[:]
+
+    def test_map_view_should_have_server_timing(self):
+        url = reverse('map', args=(self.map.slug, self.map.pk))
+        response = self.client.get(url)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('json;dur=', response['Server-Timing'])
+        self.assertEqual(len(MemorySink.records), 1)
+        record = MemorySink.records[0]
+        self.assertEqual(record['view'], 'MapView')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['db_queries'], 0)
+        self.assertEqual(record['bytes'], len(response.content))
+
+    def test_datalayer_view_should_count_gzip_cache(self):
+        url = reverse('datalayer_view', args=(self.datalayer.pk, ))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        content = b''.join(response.streaming_content)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        b''.join(response.streaming_content)
+        self.assertEqual(len(MemorySink.records), 2)
+        self.assertEqual(MemorySink.records[0]['counters'], {'gzip_cache_miss': 1})
+        self.assertEqual(MemorySink.records[1]['counters'], {'gzip_cache_hit': 1})
+        self.assertEqual(MemorySink.records[0]['bytes'], len(content))
+
+    def test_non_leaflet_storage_views_should_not_be_instrumented(self):
+        response = self.client.get(reverse('login'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(MemorySink.records, [])
+
+
+@override_settings(
+    MIDDLEWARE_CLASSES=tuple(settings.MIDDLEWARE_CLASSES) + (
+        'leaflet_storage.instrumentation.InstrumentationMiddleware',
+    ),
+    LEAFLET_STORAGE_METRICS_SINK='leaflet_storage.instrumentation.MemorySink',
+    LEAFLET_STORAGE_MEMORY_PROFILING=True
+)
+class MemoryProfilingTest(BaseTest):
+    SIZE = 5 * 1024 * 1024
+
+    def setUp(self):
+        super(MemoryProfilingTest, self).setUp()
+        del MemorySink.records[:]
+        self.geojson = tempfile.NamedTemporaryFile(suffix='.geojson')
+        write_feature_collection(self.geojson, random.Random(1), self.SIZE, "big")
+        self.geojson.flush()
+        self.geojson.seek(0)
+
+    def tearDown(self):
+        self.geojson.close()
+        super(MemoryProfilingTest, self).tearDown()
+
+    def create_datalayer(self):
+        # Saved from the file, so the test itself never holds the content
+        # in memory.
+        datalayer = DataLayer(map=self.map, name="big")
+        datalayer.geojson = File(self.geojson, name="big.geojson")
+        datalayer.save()
+        del MemorySink.records[:]
+        return datalayer
+
+    def assertMemoryBounded(self):
+        self.assertEqual(len(MemorySink.records), 1)
+        peak = MemorySink.records[0]['memory_peak_kb']
+        self.assertIsNotNone(peak)
+        # Without tracemalloc (Python 2), the growth of the process peak
+        # RSS is ~0 once an earlier test went higher: nothing to bound, the
+        # streaming checks are the real ones.
+        if MemoryProfile.exact:
+            self.assertLess(peak * 1024, self.SIZE / 4)
+
+    def assertStreamedByBlocks(self, response):
+        sizes = [len(chunk) for chunk in response.streaming_content]
+        self.assertLessEqual(max(sizes), STREAMING_BLOCK_SIZE)
+        return sum(sizes)
+
+    def test_datalayer_view_should_not_load_the_file_in_memory(self):
+        datalayer = self.create_datalayer()
+        url = reverse('datalayer_view', args=(datalayer.pk, ))
+        response = self.client.get(url)
+        self.assertGreater(self.assertStreamedByBlocks(response), self.SIZE)
+        self.assertEqual(response['ETag'], '"%s"' % datalayer.version)
+        self.assertMemoryBounded()
+
+    def test_datalayer_view_gzip_should_not_load_the_file_in_memory(self):
+        datalayer = self.create_datalayer()
+        url = reverse('datalayer_view', args=(datalayer.pk, ))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertStreamedByBlocks(response)
+        self.assertEqual(response['ETag'], '"%s-gzip"' % datalayer.version)
+        self.assertMemoryBounded()
+
+    def test_datalayer_create_should_not_load_the_file_in_memory(self):
+        url = reverse('datalayer_create', args=(self.map.pk, ))
+        self.client.login(username=self.user.username, password="123123")
+        response = self.client.post(url, {
+            'name': 'big layer',
+            'display_on_load': True,
+            'geojson': self.geojson
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertMemoryBounded()
@@ -0,0 +1,58 @@
+import random
+from StringIO import StringIO
+
+from django.test import TestCase
+
+from leaflet_storage import loadtest, serialization
+from leaflet_storage.models import Map, DataLayer
+from .base import TileLayerFactory
+
+OPTIONS = {
+    'maps': 3,
+    'datalayers': 2,
+    'min_size': 1024,
+    'max_size': 4096,
+    'workers': 1,
+    'seed': 42,
+}
+
+
+class LoadTest(TestCase):
+
+    def test_write_feature_collection(self):
+        f = StringIO()
+        count = loadtest.write_feature_collection(f, random.Random(1), 2048, "name")
+        content = f.getvalue()
+        self.assertGreaterEqual(len(content), 2048)
+        geojson = serialization.loads(content)
+        self.assertEqual(geojson['type'], 'FeatureCollection')
+        self.assertEqual(len(geojson['features']), count)
+        self.assertEqual(geojson['_storage']['name'], 'name')
+
+    def test_write_feature_collection_is_deterministic(self):
+        first, second = StringIO(), StringIO()
+        loadtest.write_feature_collection(first, random.Random(1), 2048, "name")
+        loadtest.write_feature_collection(second, random.Random(1), 2048, "name")
+        self.assertEqual(first.getvalue(), second.getvalue())
+
+    def test_seed(self):
+        users = loadtest.get_users(2)
+        pks = loadtest.seed(OPTIONS, users)
+        self.assertEqual(len(pks), 3)
+        self.assertEqual(Map.objects.count(), 3)
+        for datalayer in DataLayer.objects.all():
+            self.assertTrue(datalayer.version)
+            self.assertGreaterEqual(datalayer.geojson.size, 1024)
+
+    def test_replay(self):
+        TileLayerFactory()
+        loadtest.seed(OPTIONS, [])
+        Map.objects.update(share_status=Map.PUBLIC)
+        requests = loadtest.build_requests(
+            loadtest.parse_mix(loadtest.DEFAULT_MIX), 20, 1, loadtest.get_targets()
+        )
+        results = loadtest.replay(requests, loadtest.ClientRunner())
+        self.assertEqual(results['requests'], 20)
+        for name, stats in results['stats'].items():
+            self.assertEqual(stats['errors'], 0)
+            self.assertLessEqual(stats['p50'], stats['p99'])
@@ -0,0 +1,187 @@
+"""
+Check that the number of SQL queries of each leaflet_storage URL does not
+depend on the number of datalayers, editors or pictograms.
+login, logout and login_popup_end do not deal with maps, so are not checked.
+"""
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from leaflet_storage.models import Map
+from .base import (BaseTest, MapFactory, UserFactory, DataLayerFactory,
+                   PictogramFactory)
+
+ROLES = ('anonymous', 'owner', 'editor')
+SIZES = (
+    # (datalayers, editors)
+    (1, 1),
+    (20, 1),
+    (1, 20),
+)
+GEOJSON = '{"type":"FeatureCollection","features":[{"type":"Feature","geometry":{"type":"Point","coordinates":[0.63720703125,51.15178610143037]},"properties":{"_storage_options":{},"name":"marker he"}}],"_storage":{"displayOnLoad":true,"name":"new name"}}'
+
+
+def upload():
+    # A new file each time, so the content is saved and its stats computed.
+    return SimpleUploadedFile("layer.geojson", GEOJSON)
+
+
+def consume(response):
+    if response.streaming:
+        b"".join(response.streaming_content)
+    return response
+
+
+MAP_DATA = {
+    'name': 'new name',
+    'center': '{"type":"Point","coordinates":[13.447265624999998,48.94415123418794]}',
+    'settings': '{"type":"Feature","geometry":{"type":"Point","coordinates":[5.0592041015625,52.05924589011585]},"properties":{"name":"new name","zoom":8}}'
+}
+
+
+@override_settings(LEAFLET_STORAGE_ALLOW_ANONYMOUS=False)
+class QueriesCountTest(BaseTest):
+
+    def setUp(self):
+        super(QueriesCountTest, self).setUp()
+        self.editor = UserFactory(username="Editor", password="123123")
+        self.built = 0
+
+    def login(self, role):
+        self.client.logout()
+        if role == 'owner':
+            self.client.login(username=self.user.username, password="123123")
+        elif role == 'editor':
+            self.client.login(username=self.editor.username, password="123123")
+
+    def builder(self, role):
+        # Anonymous can only see public maps, others should go through
+        # editors checks.
+        share_status = Map.PUBLIC if role == 'anonymous' else Map.PRIVATE
+
+        def build(datalayers, editors):
+            self.built += 1
+            map_inst = MapFactory(
+                owner=self.user,
+                licence=self.licence,
+                slug="map-%s" % self.built,
+                edit_status=Map.EDITORS,
+                share_status=share_status
+            )
+            map_inst.editors.add(self.editor)
+            for i in range(editors - 1):
+                map_inst.editors.add(UserFactory(username="editor-%s-%s" % (self.built, i)))
+            for i in range(datalayers):
+                datalayer = DataLayerFactory(map=map_inst, name="layer %s" % i)
+            return map_inst, datalayer
+        return build
+
+    def check(self, request, sizes=SIZES):
+        """
+        request is called with a map and one of its datalayers.
+        """
+        for role in ROLES:
+            self.login(role)
+            self.assertQueriesDoNotGrow(
+                self.builder(role),
+                lambda fixture: request(*fixture),
+                sizes
+            )
+
+    def test_map(self):
+        self.check(lambda m, d: self.client.get(reverse('map', args=(m.slug, m.pk))))
+
+    def test_map_geojson(self):
+        self.check(lambda m, d: self.client.get(reverse('map_geojson', args=(m.pk, ))))
+
+    def test_map_new(self):
+        self.check(lambda m, d: self.client.get(reverse('map_new')))
+
+    def test_map_old_url(self):
+        self.check(lambda m, d: self.client.get(reverse(
+            'map_old_url',
+            kwargs={'username': m.owner.username, 'slug': m.slug}
+        )))
+
+    def test_map_short_url(self):
+        self.check(lambda m, d: self.client.get(reverse('map_short_url', args=(m.pk, ))))
+
+    def test_map_anonymous_edit_url(self):
+        self.check(lambda m, d: self.client.get(m.get_anonymous_edit_url()))
+
+    def test_datalayer_view(self):
+        self.check(lambda m, d: self.client.get(reverse('datalayer_view', args=(d.pk, ))))
+
+    def test_datalayer_versioned_view(self):
+        self.check(lambda m, d: self.client.get(d.get_absolute_url()))
+
+    def test_map_update(self):
+        self.check(lambda m, d: self.client.post(
+            reverse('map_update', args=(m.pk, )),
+            MAP_DATA
+        ))
+
+    def test_map_update_permissions_form(self):
+        self.check(lambda m, d: self.client.get(reverse('map_update_permissions', args=(m.pk, ))))
+
+    def test_map_update_permissions(self):
+        self.check(lambda m, d: self.client.post(
+            reverse('map_update_permissions', args=(m.pk, )),
+            {
+                'edit_status': Map.EDITORS,
+                'share_status': Map.PRIVATE,
+                'editors': [self.editor.pk]
+            }
+        ))
+
+    def test_map_delete(self):
+        self.check(lambda m, d: self.client.post(reverse('map_delete', args=(m.pk, ))))
+
+    def test_map_clone(self):
+        # Each cloned datalayer needs its own file and row, so only check
+        # editors.
+        self.check(
+            lambda m, d: self.client.post(reverse('map_clone', args=(m.pk, ))),
+            sizes=((1, 1), (1, 20))
+        )
+
+    def test_datalayer_create(self):
+        self.check(lambda m, d: self.client.post(
+            reverse('datalayer_create', args=(m.pk, )),
+            {'name': 'new layer', 'display_on_load': True, 'geojson': upload()}
+        ))
+
+    def test_datalayer_update(self):
+        self.check(lambda m, d: self.client.post(
+            reverse('datalayer_update', args=(m.pk, d.pk)),
+            {'name': 'new name', 'display_on_load': True, 'geojson': upload()}
+        ))
+
+    def test_datalayer_delete(self):
+        self.check(lambda m, d: self.client.post(reverse('datalayer_delete', args=(m.pk, d.pk))))
+
+    def test_map_list_json(self):
+        self.check(lambda m, d: self.client.get(reverse('map_list_json')))
+
+    def test_map_near_json(self):
+        self.check(lambda m, d: self.client.get(reverse('map_near_json'),
+                                                {'lat': 48.9, 'lng': 13.4, 'radius': 100}))
+
+    def test_search_json(self):
+        self.check(lambda m, d: self.client.get(reverse('search_json'), {'q': 'test'}))
+
+    def test_map_export(self):
+        self.check(lambda m, d: consume(self.client.get(
+            reverse('map_export', kwargs={'pk': m.pk, 'format': 'geojson'}))))
+
+    def test_pictogram_list(self):
+
+        def build(count):
+            for i in range(count):
+                PictogramFactory(name="picto %s" % i)
+
+        self.assertQueriesDoNotGrow(
+            build,
+            lambda fixture: self.client.get(reverse('pictogram_list_json')),
+            sizes=((1, ), (20, ))
+        )
@@ -0,0 +1,86 @@
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from leaflet_storage import search
+from leaflet_storage.models import Map, IndexedFeature
+from .base import BaseTest, MapFactory, DataLayerFactory
+
+GEOJSON = """{"type": "FeatureCollection", "features": [
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [2, 51]},
+     "properties": {"name": "Boulangerie", "description": "Croissants and bread", "floor": 2}},
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [2, 52]},
+     "properties": {}},
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [3, 51]},
+     "properties": {"name": "Library", "description": "Books, not bread"}}
+]}"""
+
+
+class GetContentTest(BaseTest):
+
+    def test_should_only_keep_strings_and_numbers(self):
+        content = search.get_content({"name": "Here", "floor": 2, "open": True,
+                                      "options": {"color": "red"}})
+        self.assertEqual(sorted(content.split()), ["2", "Here"])
+
+
+@override_settings(LEAFLET_STORAGE_FEATURE_INDEX=True, LEAFLET_STORAGE_INDEX_WORKERS=0)
+class SearchTest(BaseTest):
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.other = MapFactory(owner=self.user, licence=self.licence,
+                                name="Bakeries of Brussels", description="Where to buy bread")
+        self.layer = DataLayerFactory(map=self.other, geojson__data=GEOJSON)
+        self.url = reverse('search_json')
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def test_save_should_index_features_with_properties(self):
+        features = IndexedFeature.objects.filter(datalayer=self.layer).order_by('position')
+        self.assertEqual([(f.position, f.name) for f in features],
+                         [(0, "Boulangerie"), (2, "Library")])
+
+    def test_should_find_maps_by_name_and_description(self):
+        self.assertEqual([m['id'] for m in self.get(q="bakeries")['maps']], [self.other.pk])
+        self.assertEqual([m['id'] for m in self.get(q="bread")['maps']], [self.other.pk])
+        self.assertEqual(self.get(q="danube")['maps'], [])
+
+    def test_should_find_features_with_their_layer(self):
+        features = self.get(q="bread")['features']
+        self.assertEqual(sorted(f['index'] for f in features), [0, 2])
+        self.assertEqual(features[0]['datalayer'], self.layer.pk)
+        self.assertEqual(features[0]['map'], self.other.pk)
+        self.assertEqual([f['name'] for f in self.get(q="croissants")['features']],
+                         ["Boulangerie"])
+
+    def test_should_not_return_private_maps(self):
+        Map.objects.filter(pk=self.other.pk).update(share_status=Map.PRIVATE)
+        result = self.get(q="bread")
+        self.assertEqual(result['maps'], [])
+        self.assertEqual(result['features'], [])
+
+    def test_new_content_should_replace_index(self):
+        content = GEOJSON.replace("bread", "cheese")
+        self.layer.geojson.save("other.geojson", ContentFile(content), save=False)
+        self.layer.save()
+        self.assertEqual(self.get(q="bread")['features'], [])
+        self.assertEqual(len(self.get(q="cheese")['features']), 2)
+
+    def test_delete_should_remove_index(self):
+        self.layer.delete()
+        self.assertFalse(IndexedFeature.objects.exists())
+
+    def test_q_is_mandatory(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_storagesearchindex_should_index_existing_datalayers(self):
+        IndexedFeature.objects.all().delete()
+        call_command('storagesearchindex', workers=1)
+        self.assertEqual(IndexedFeature.objects.filter(datalayer=self.layer).count(), 2)
+        self.assertEqual(IndexedFeature.objects.filter(datalayer=self.datalayer).count(), 1)
@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from leaflet_storage import serialization
+
+
+class SerializationTests(TestCase):
+
+    data = {
+        "name": u"enrhûmé",
+        "url": "/datalayer/{pk}/",
+        "zoom": 7,
+        "datalayers": [{"id": 1, "displayOnLoad": True}]
+    }
+
+    def test_all_installed_backends_should_roundtrip(self):
+        for name in serialization.ADAPTERS:
+            if serialization.load_backend(name) is None:
+                continue
+            with override_settings(LEAFLET_STORAGE_JSON_BACKEND=name):
+                self.assertEqual(
+                    serialization.loads(serialization.dumps(self.data)),
+                    self.data
+                )
+
+    def test_should_not_escape_slashes(self):
+        for name in serialization.ADAPTERS:
+            if serialization.load_backend(name) is None:
+                continue
+            with override_settings(LEAFLET_STORAGE_JSON_BACKEND=name):
+                self.assertIn("/datalayer/{pk}/", serialization.dumps(self.data))
+
+    def test_all_installed_backends_should_produce_same_output(self):
+        outputs = set()
+        for name in serialization.ADAPTERS:
+            if serialization.load_backend(name) is None:
+                continue
+            with override_settings(LEAFLET_STORAGE_JSON_BACKEND=name):
+                # One key per dict, so the keys order can't differ.
+                value = serialization.dumps([{"name": u"enrhûmé / Ямал"},
+                                             {"id": 1.5}, True, None, 2.123456789012345])
+            self.assertTrue(isinstance(value, unicode))
+            outputs.add(value)
+        self.assertEqual(outputs, set([u'[{"name":"enrhûmé / Ямал"},{"id":1.5},true,null,2.123456789012345]']))
+
+    @override_settings(LEAFLET_STORAGE_JSON_BACKEND="json")
+    def test_indent(self):
+        self.assertIn("\n", serialization.dumps(self.data, indent=2))
+        self.assertNotIn("\n", serialization.dumps(self.data))
+
+    @override_settings(LEAFLET_STORAGE_JSON_BACKEND="unknown")
+    def test_unknown_backend_should_raise(self):
+        self.assertRaises(ImproperlyConfigured, serialization.dumps, self.data)
+
+    def test_default_backend_should_keep_floats(self):
+        with override_settings(LEAFLET_STORAGE_JSON_BACKEND=None):
+            value = 48.85661400000001
+            self.assertEqual(serialization.loads(serialization.dumps(value)), value)
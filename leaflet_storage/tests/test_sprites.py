@@ -0,0 +1,126 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from PIL import Image
+
+from leaflet_storage import sprites
+from leaflet_storage.models import Pictogram
+from .base import PictogramFactory
+
+
+def png(size, color):
+    content = BytesIO()
+    Image.new('RGBA', size, color).save(content, 'PNG')
+    return ContentFile(content.getvalue())
+
+
+class PackTest(TestCase):
+
+    def test_should_not_overlap(self):
+        sizes = [(10, 20), (30, 10), (20, 20), (15, 5)]
+        positions, (width, height) = sprites.pack(sizes, 40)
+        boxes = [(x, y, x + w, y + h) for (x, y), (w, h) in zip(positions, sizes)]
+        for i, a in enumerate(boxes):
+            self.assertLessEqual(a[2], width)
+            self.assertLessEqual(a[3], height)
+            for b in boxes[i + 1:]:
+                self.assertTrue(a[2] <= b[0] or b[2] <= a[0] or
+                                a[3] <= b[1] or b[3] <= a[1])
+
+    def test_should_respect_max_width(self):
+        positions, (width, height) = sprites.pack([(10, 10)] * 10, 35)
+        self.assertLessEqual(width, 35)
+
+
+class SpritesTest(TestCase):
+
+    def setUp(self):
+        self.pictograms = []
+        for i, color in enumerate(('red', 'green', 'blue')):
+            name = default_storage.save("pictogram/sprite-test-%s.png" % i,
+                                        png((24, 24 + i), color))
+            self.pictograms.append(PictogramFactory(name="picto %s" % i, pictogram=name))
+
+    def tearDown(self):
+        for pictogram in self.pictograms:
+            default_storage.delete(pictogram.pictogram.name)
+        if default_storage.exists(sprites.SPRITES_DIR):
+            for name in default_storage.listdir(sprites.SPRITES_DIR)[1]:
+                default_storage.delete(os.path.join(sprites.SPRITES_DIR, name))
+
+    def test_build_should_store_coordinates(self):
+        names = sprites.build_all()
+        self.assertEqual(len(names), 1)
+        sheet = Image.open(default_storage.open(
+            os.path.join(sprites.SPRITES_DIR, "%s.png" % names[0])))
+        for pictogram in self.pictograms:
+            sprite = Pictogram.objects.get(pk=pictogram.pk).sprite
+            self.assertEqual(sprite['sheet'], names[0])
+            self.assertEqual(sprite['width'], 24)
+            self.assertEqual(
+                sheet.getpixel((sprite['x'], sprite['y'])),
+                Image.open(pictogram.pictogram.path).convert('RGBA').getpixel((0, 0))
+            )
+
+    def test_json_should_expose_sprite(self):
+        sprites.build_all()
+        json = Pictogram.objects.get(pk=self.pictograms[0].pk).json
+        self.assertIn('sprite', json)
+        for key in ('src', 'atlas', 'x', 'y', 'width', 'height'):
+            self.assertIn(key, json['sprite'])
+        response = self.client.get(json['sprite']['src'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get(json['sprite']['atlas'])
+        atlas = simplejson.loads(b''.join(response.streaming_content))
+        self.assertEqual(atlas[str(self.pictograms[0].pk)]['x'], json['sprite']['x'])
+
+    def test_unreadable_pictogram_should_be_skipped(self):
+        broken = PictogramFactory(name="broken")
+        sprites.build_all()
+        self.assertEqual(Pictogram.objects.get(pk=broken.pk).sprite, {})
+        self.assertNotIn('sprite', Pictogram.objects.get(pk=broken.pk).json)
+
+    def test_sheet_name_should_change_with_content(self):
+        first = sprites.build_all()[0]
+        self.assertEqual(sprites.build_all()[0], first)
+        self.pictograms[0].delete()
+        second = sprites.build_all()[0]
+        self.assertNotEqual(first, second)
+        # Still referenced by cached pages, for a while.
+        self.assertTrue(default_storage.exists(
+            os.path.join(sprites.SPRITES_DIR, "%s.png" % first)))
+        self.assertEqual(sprites.build_all(grace=0)[0], second)
+        self.assertFalse(default_storage.exists(
+            os.path.join(sprites.SPRITES_DIR, "%s.png" % first)))
+        self.assertTrue(default_storage.exists(
+            os.path.join(sprites.SPRITES_DIR, "%s.png" % second)))
+
+    def test_big_pictograms_should_be_packed_as_icons(self):
+        name = default_storage.save("pictogram/sprite-test-big.png", png((800, 400), 'red'))
+        pictogram = PictogramFactory(name="big", pictogram=name)
+        self.pictograms.append(pictogram)
+        with self.settings(LEAFLET_STORAGE_SPRITE_ICON_SIZE=32):
+            sprites.build_all()
+        sprite = Pictogram.objects.get(pk=pictogram.pk).sprite
+        self.assertEqual((sprite['width'], sprite['height']), (32, 16))
+        self.assertEqual(Pictogram.objects.get(pk=self.pictograms[0].pk).sprite['width'], 24)
+
+    @override_settings(LEAFLET_STORAGE_SPRITES=True, LEAFLET_STORAGE_SPRITE_WORKERS=0)
+    def test_save_should_rebuild_sheet(self):
+        name = default_storage.save("pictogram/sprite-test-new.png", png((16, 16), 'red'))
+        pictogram = PictogramFactory(name="new", pictogram=name)
+        self.pictograms.append(pictogram)
+        self.assertEqual(Pictogram.objects.get(pk=pictogram.pk).sprite['width'], 16)
+
+    def test_unknown_sheet_should_404(self):
+        url = reverse('pictogram_sprite', kwargs={'name': '0-abcdef', 'ext': 'png'})
+        self.assertEqual(self.client.get(url).status_code, 404)
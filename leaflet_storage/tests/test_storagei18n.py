@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from leaflet_storage.management.commands import storagei18n
+
+LOCALE = u"""{
+    "Add a layer": "Ajouter un calque",
+    "Édit": "Éditer"
+}"""
+
+
+class StorageI18nTest(TestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.settings = override_settings(STATIC_ROOT=self.static_root)
+        self.settings.enable()
+        os.makedirs(storagei18n.get_output_dir())
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.static_root)
+
+    def read(self, name):
+        with io.open(os.path.join(storagei18n.get_output_dir(), name), 'rb') as f:
+            return f.read()
+
+    def test_render_should_write_all_outputs(self):
+        storagei18n.render('fr', LOCALE)
+        content = self.read('fr.js').decode('utf-8')
+        self.assertIn(u'"Édit": "Éditer"', content)
+        self.assertIn(u'L.setLocale("fr");', content)
+        minified = self.read('fr.min.js').decode('utf-8')
+        self.assertNotIn(u'\n', minified)
+        self.assertLess(len(minified), len(content))
+        locale = minified[len(u'var locale = '):minified.index(u';')]
+        self.assertIn(u'"Édit":"Éditer"', locale)
+        self.assertEqual(simplejson.loads(locale), simplejson.loads(LOCALE))
+        for name in ('fr.js', 'fr.min.js'):
+            with gzip.open(os.path.join(storagei18n.get_output_dir(), name + '.gz')) as f:
+                self.assertEqual(f.read(), self.read(name))
+
+    def test_is_rendered(self):
+        command = storagei18n.Command()
+        self.assertFalse(command.is_rendered('fr'))
+        storagei18n.render('fr', LOCALE)
+        self.assertTrue(command.is_rendered('fr'))
+
+    def test_digest_should_cover_template(self):
+        template = storagei18n.get_template_source()
+        self.assertIn(u'L.setLocale', template)
+        self.assertNotEqual(storagei18n.get_digest(LOCALE, template),
+                            storagei18n.get_digest(LOCALE, template + u"\n"))
@@ -0,0 +1,57 @@
+from django.core.cache import cache
+from django.template import Template, Context
+from django.test import TestCase
+
+from leaflet_storage.models import Map
+from leaflet_storage.templatetags.leaflet_storage_tags import notag
+from .base import BaseTest, MapFactory, DataLayerFactory
+
+
+class MapFragmentTest(BaseTest):
+
+    template = Template(
+        "{% load leaflet_storage_tags %}"
+        "{% for map in maps %}{% map_fragment map %}{% endfor %}"
+    )
+
+    def setUp(self):
+        super(MapFragmentTest, self).setUp()
+        cache.clear()
+
+    def create_maps(self, count):
+        for i in range(count):
+            map_inst = MapFactory(owner=self.user, licence=self.licence)
+            DataLayerFactory(map=map_inst)
+            DataLayerFactory(map=map_inst)
+
+    def render(self):
+        return self.template.render(Context({'maps': Map.objects.for_fragments()}))
+
+    def test_should_render_map_and_datalayers(self):
+        output = self.render()
+        self.assertIn('map_%s' % self.map.pk, output)
+        self.assertIn(self.datalayer.get_absolute_url(), output)
+
+    def test_query_count_should_not_depend_on_maps_count(self):
+        # maps, datalayers, tilelayers
+        with self.assertNumQueries(3):
+            self.render()
+        self.create_maps(10)
+        with self.assertNumQueries(3):
+            self.render()
+        # Now from cache
+        with self.assertNumQueries(3):
+            self.render()
+
+    def test_cache_should_be_invalidated_on_datalayer_change(self):
+        self.render()
+        self.datalayer.name = "a brand new name"
+        self.datalayer.save()
+        self.assertIn("a brand new name", self.render())
+
+
+class NotagTest(TestCase):
+
+    def test_should_escape_tags_and_line_separators(self):
+        self.assertEqual(notag(u'{"a":"</script>\u2028\u2029"}'),
+                         u'{"a":"&lt;/script>\\u2028\\u2029"}')
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import simplejson
+
+from leaflet_storage import termindex
+from leaflet_storage.models import Map
+from .base import BaseTest, DataLayerFactory
+
+GEOJSON = u"""{"type": "FeatureCollection", "features": [
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [2, 51]},
+     "properties": {"name": "Boulangerie de l'été", "floor": 2}},
+    {"type": "Feature", "geometry": {"type": "LineString", "coordinates": [[1, 50], [3, 52]]},
+     "properties": {"name": "Bakery street"}},
+    {"type": "Feature", "geometry": null, "properties": {"name": "Ete"}}
+]}""".encode('utf-8')
+
+
+class TermIndexTest(BaseTest):
+
+    def setUp(self):
+        super(TermIndexTest, self).setUp()
+        self.layer = DataLayerFactory(map=self.map, geojson__data=GEOJSON)
+
+    def tearDown(self):
+        path = termindex.get_index_path(self.layer)
+        if os.path.exists(path):
+            os.remove(path)
+        super(TermIndexTest, self).tearDown()
+
+    def search(self, q):
+        return [f['properties']['name'] for f in termindex.search(self.layer, q)]
+
+    def test_tokenize(self):
+        self.assertEqual(termindex.tokenize(u"L'Été, 2 fois"), [u"l", u"ete", u"2", u"fois"])
+
+    def test_should_match_words_prefixes(self):
+        self.assertEqual(self.search(u"ba"), [u"Bakery street"])
+        self.assertEqual(self.search(u"b"), [u"Boulangerie de l'été", u"Bakery street"])
+        self.assertEqual(self.search(u"ÉTÉ"), [u"Boulangerie de l'été", u"Ete"])
+        self.assertEqual(self.search(u"2"), [u"Boulangerie de l'été"])
+
+    def test_should_match_all_words(self):
+        self.assertEqual(self.search(u"boul ete"), [u"Boulangerie de l'été"])
+        self.assertEqual(self.search(u"bakery ete"), [])
+
+    def test_should_return_bbox(self):
+        features = termindex.search(self.layer, u"b")
+        self.assertEqual(features[0]['bbox'], [2, 51, 2, 51])
+        self.assertEqual(features[1]['bbox'], [1, 50, 3, 52])
+        self.assertNotIn('bbox', termindex.search(self.layer, u"ete")[1])
+
+    def test_should_rebuild_outdated_index(self):
+        self.search(u"b")
+        self.layer.version = "0" * 32
+        with termindex.open_index(self.layer) as index:
+            self.assertEqual(index.version, "0" * 32)
+
+    @override_settings(LEAFLET_STORAGE_TERM_INDEX=True, LEAFLET_STORAGE_INDEX_WORKERS=0)
+    def test_save_should_build_index(self):
+        layer = DataLayerFactory(map=self.map, geojson__data=GEOJSON)
+        path = termindex.get_index_path(layer)
+        self.assertTrue(os.path.exists(path))
+        with termindex.TermIndex(path) as index:
+            self.assertEqual(index.version, layer.version)
+            self.assertEqual(index.features_count, 3)
+        os.remove(path)
+
+    def test_view(self):
+        url = reverse('datalayer_search', kwargs={'pk': self.layer.pk})
+        response = self.client.get(url, {'q': 'bakery'})
+        self.assertEqual(response.status_code, 200)
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['type'], "FeatureCollection")
+        self.assertEqual(len(data['features']), 1)
+        self.assertEqual(data['features'][0]['bbox'], [1, 50, 3, 52])
+        self.assertFalse(data['truncated'])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_view_should_check_permissions(self):
+        self.map.share_status = Map.PRIVATE
+        self.map.save()
+        url = reverse('datalayer_search', kwargs={'pk': self.layer.pk})
+        self.assertEqual(self.client.get(url, {'q': 'bakery'}).status_code, 403)
+
+    def test_view_without_content_should_not_be_found(self):
+        empty = DataLayerFactory(map=self.map, geojson=None)
+        url = reverse('datalayer_search', kwargs={'pk': empty.pk})
+        self.assertEqual(self.client.get(url, {'q': 'bakery'}).status_code, 404)
+        os.remove(self.layer.geojson.path)
+        url = reverse('datalayer_search', kwargs={'pk': self.layer.pk})
+        self.assertEqual(self.client.get(url, {'q': 'bakery'}).status_code, 404)
@@ -0,0 +1,103 @@
+from io import BytesIO
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from PIL import Image
+
+from leaflet_storage import thumbnails
+from leaflet_storage.models import Pictogram
+from .base import PictogramFactory
+from .test_sprites import png
+
+
+@override_settings(LEAFLET_STORAGE_PICTOGRAM_SIZES=(24, 48))
+class ThumbnailsTest(TestCase):
+
+    def setUp(self):
+        self.name = default_storage.save("pictogram/thumbnail-test.png", png((800, 400), 'red'))
+        self.pictogram = PictogramFactory(pictogram=self.name)
+
+    def tearDown(self):
+        variants = Pictogram.objects.get(pk=self.pictogram.pk).variants
+        for formats in variants.get('sizes', {}).values():
+            for name in formats.values():
+                default_storage.delete(name)
+        default_storage.delete(self.name)
+
+    def test_variants_should_have_fixed_size(self):
+        variants = thumbnails.build_variants(self.pictogram)
+        self.assertEqual(variants['source'], self.pictogram.pictogram.name)
+        self.assertEqual(sorted(variants['sizes'].keys()), ['24', '48'])
+        for size, formats in variants['sizes'].items():
+            self.assertEqual(sorted(formats.keys()), sorted(thumbnails.get_formats()))
+            for ext, name in formats.items():
+                self.assertTrue(name.startswith(thumbnails.VARIANTS_DIR))
+                self.assertTrue(name.endswith("-%s.%s" % (size, ext)))
+                image = Image.open(BytesIO(default_storage.open(name).read()))
+                self.assertEqual(image.size, (int(size), int(size)))
+
+    def test_variants_should_be_smaller_than_original(self):
+        variants = thumbnails.build_variants(self.pictogram)
+        name = variants['sizes']['24']['png']
+        self.assertLess(default_storage.size(name), default_storage.size(self.pictogram.pictogram.name))
+
+    def test_json_should_point_to_variant(self):
+        thumbnails.build_variants(self.pictogram)
+        json = Pictogram.objects.get(pk=self.pictogram.pk).json
+        self.assertTrue(json['src'].endswith('-24.png'))
+        self.assertEqual(json['original'], self.pictogram.pictogram.url)
+        self.assertIn('48', json['variants'])
+
+    def test_json_should_ignore_outdated_variants(self):
+        thumbnails.build_variants(self.pictogram)
+        pictogram = Pictogram.objects.get(pk=self.pictogram.pk)
+        pictogram.pictogram = "pictogram/other.png"
+        self.assertEqual(pictogram.json['src'], pictogram.pictogram.url)
+        self.assertNotIn('variants', pictogram.json)
+
+    def test_variants_should_not_overwrite_other_pictograms(self):
+        # Was the name of a variant when they were stored with the uploads.
+        name = default_storage.save("pictogram/thumbnail-test-24.png", png((24, 24), 'blue'))
+        try:
+            thumbnails.build_variants(self.pictogram)
+            self.assertEqual(Image.open(default_storage.open(name)).getpixel((0, 0))[:3],
+                             (0, 0, 255))
+        finally:
+            default_storage.delete(name)
+
+    def test_new_image_should_replace_variants(self):
+        old = thumbnails.build_variants(self.pictogram)['sizes']['24']['png']
+        name = default_storage.save("pictogram/thumbnail-new.png", png((100, 100), 'blue'))
+        try:
+            self.pictogram.pictogram = name
+            new = thumbnails.build_variants(self.pictogram)['sizes']['24']['png']
+            self.assertNotEqual(new, old)
+            self.assertTrue(default_storage.exists(new))
+            self.assertFalse(default_storage.exists(old))
+        finally:
+            default_storage.delete(name)
+
+    def test_unreadable_pictogram_should_have_no_variants(self):
+        broken = PictogramFactory(name="broken")
+        self.assertEqual(thumbnails.build_variants(broken), {})
+        self.assertNotIn('variants', Pictogram.objects.get(pk=broken.pk).json)
+
+    @override_settings(LEAFLET_STORAGE_PICTOGRAM_VARIANTS=True,
+                       LEAFLET_STORAGE_PICTOGRAM_WORKERS=0)
+    def test_upload_should_generate_variants(self):
+        name = default_storage.save("pictogram/thumbnail-upload.png", png((100, 100), 'blue'))
+        pictogram = PictogramFactory(pictogram=name)
+        variants = Pictogram.objects.get(pk=pictogram.pk).variants
+        self.assertEqual(variants['source'], name)
+        for formats in variants['sizes'].values():
+            for variant in formats.values():
+                default_storage.delete(variant)
+        default_storage.delete(name)
+
+    def test_command_should_backfill(self):
+        call_command('storagepictogramvariants', workers=1)
+        variants = Pictogram.objects.get(pk=self.pictogram.pk).variants
+        self.assertEqual(variants['source'], self.pictogram.pictogram.name)
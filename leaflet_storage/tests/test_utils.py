@@ -1,8 +1,19 @@
 # -*- coding:utf-8 -*-
 
-from django.test import TestCase
+import gzip
+import os
+import shutil
+import tempfile
+from io import BytesIO
 
-from leaflet_storage.utils import smart_decode
+from django.core.signals import got_request_exception
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson
+
+from leaflet_storage.utils import (smart_decode, atomic_write, gzip_content,
+                                   iter_geojson_features, get_geojson_stats,
+                                   on_commit)
 
 
 class SmartDecodeTests(TestCase):
@@ -13,3 +24,108 @@ class SmartDecodeTests(TestCase):
 
     def test_should_convert_utf8(self):
         self.assertEqual(smart_decode('é'), u"é")
+
+
+class AtomicWriteTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_should_write_and_replace(self):
+        path = os.path.join(self.dir, "test.js")
+        atomic_write(path, b"first")
+        atomic_write(path, b"second")
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b"second")
+        self.assertEqual(os.listdir(self.dir), ["test.js"])
+
+
+class GzipContentTests(TestCase):
+
+    def test_should_be_reproducible(self):
+        content = b"var locale = {};" * 100
+        self.assertEqual(gzip_content(content), gzip_content(content))
+        f = gzip.GzipFile(fileobj=BytesIO(gzip_content(content)))
+        self.assertEqual(f.read(), content)
+
+
+class GeoJSONStatsTests(TestCase):
+    GEOJSON = (u'{"type": "FeatureCollection", "_storage": {"name": "\xe9t\xe9", "zoom": 12}, '
+               u'"features": [{"type": "Feature", "properties": {"name": "\xe9"}, '
+               u'"geometry": {"type": "Point", "coordinates": [1.5, -2]}}, '
+               u'{"type": "Feature", "properties": {}, "geometry": {"type": "GeometryCollection", '
+               u'"geometries": [{"type": "LineString", "coordinates": [[-3, 4], [0, 0]]}]}}, '
+               u'{"type": "Feature", "properties": {}, "geometry": null}], "version": 123}').encode('utf-8')
+
+    def chunks(self, size):
+        return [self.GEOJSON[i:i + size] for i in range(0, len(self.GEOJSON), size)]
+
+    def test_should_stream_features_whatever_the_chunks(self):
+        for size in (1, 3, 64, 4096):
+            features = list(iter_geojson_features(self.chunks(size)))
+            self.assertEqual(len(features), 3)
+            self.assertEqual(features[0]['properties']['name'], u'\xe9')
+
+    def test_offsets_should_delimit_features(self):
+        for size in (1, 7, 4096):
+            for feature, start, end in iter_geojson_features(self.chunks(size), offsets=True):
+                self.assertEqual(simplejson.loads(self.GEOJSON[start:end].decode('utf-8')), feature)
+
+    def test_stats(self):
+        self.assertEqual(get_geojson_stats(self.chunks(5)), ((-3, -2, 1.5, 4), 3))
+
+    def test_stats_without_features(self):
+        self.assertEqual(get_geojson_stats([b'{"features": []}']), (None, 0))
+        self.assertEqual(get_geojson_stats([b'{}']), (None, 0))
+
+    def test_invalid_json_should_raise(self):
+        for content in (b'', b'[]', b'{"features": [{"type": "Feature"},'):
+            self.assertRaises(ValueError, list, iter_geojson_features([content]))
+
+
+class OnCommitTests(TransactionTestCase):
+
+    def test_should_run_when_outermost_block_commits(self):
+        calls = []
+        with transaction.atomic():
+            on_commit(calls.append, 1)
+            with transaction.atomic():
+                on_commit(calls.append, 2)
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [1, 2])
+
+    def test_should_run_right_away_in_autocommit(self):
+        calls = []
+        on_commit(calls.append, 1)
+        self.assertEqual(calls, [1])
+
+    def test_should_forget_rolled_back_callbacks(self):
+        calls = []
+        with transaction.atomic():
+            on_commit(calls.append, 1)
+            try:
+                with transaction.atomic():
+                    on_commit(calls.append, 2)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(calls, [1])
+        try:
+            with transaction.atomic():
+                on_commit(calls.append, 3)
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            pass
+        self.assertEqual(calls, [1])
+
+    def test_should_forget_callbacks_of_failed_requests(self):
+        calls = []
+        with transaction.atomic():
+            on_commit(calls.append, 1)
+            got_request_exception.send(sender=None, request=None)
+        self.assertEqual(calls, [])
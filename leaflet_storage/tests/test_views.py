@@ -2,12 +2,16 @@
 from django.utils import simplejson
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
-from django.test.utils import override_settings
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.db import connection
 from django.core.signing import get_cookie_signer
+from django.core.cache import cache
+from django.contrib.gis.geos import Point
 
 from leaflet_storage.models import Map, DataLayer
 
-from .base import (MapFactory, UserFactory, BaseTest)
+from .base import (MapFactory, UserFactory, PictogramFactory, TileLayerFactory,
+                   BaseTest)
 
 
 @override_settings(LEAFLET_STORAGE_ALLOW_ANONYMOUS=False)
@@ -189,6 +193,24 @@ class MapViews(BaseTest):
         response = self.client.get(url)
         self.assertEquals(response.status_code, 403)
 
+    def test_map_view_queries_should_not_depend_on_editors_count(self):
+        url = reverse('map', args=(self.map.slug, self.map.pk))
+        self.map.share_status = self.map.PRIVATE
+        self.map.edit_status = self.map.EDITORS
+        editor = UserFactory(username="Bob", password="123123")
+        self.map.editors.add(editor)
+        self.map.save()
+        self.client.login(username=editor.username, password="123123")
+        with CaptureQueriesContext(connection) as one_editor:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        for i in range(20):
+            self.map.editors.add(UserFactory(username="editor%s" % i))
+        with CaptureQueriesContext(connection) as many_editors:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertEqual(len(one_editor), len(many_editors))
+
 
 @override_settings(LEAFLET_STORAGE_ALLOW_ANONYMOUS=True)
 class AnonymousMapViews(BaseTest):
@@ -450,3 +472,221 @@ class DataLayerViews(BaseTest):
         self.assertIsNotNone(response['Cache-Control'])
         self.assertIn('Content-Encoding', response)
         self.assertEquals(response['Content-Encoding'], 'gzip')
+
+    def test_get_versioned(self):
+        url = reverse(
+            'datalayer_versioned_view',
+            args=(self.datalayer.pk, self.datalayer.version)
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age', response['Cache-Control'])
+        json = simplejson.loads(response.content)
+        self.assertEquals(json['type'], 'FeatureCollection')
+
+    def test_versioned_should_vary_on_accept_encoding(self):
+        url = reverse(
+            'datalayer_versioned_view',
+            args=(self.datalayer.pk, self.datalayer.version)
+        )
+        for encoding in ('gzip', ''):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_get_outdated_version_should_redirect(self):
+        url = reverse(
+            'datalayer_versioned_view',
+            args=(self.datalayer.pk, 'outdated')
+        )
+        response = self.client.get(url)
+        self.assertRedirects(response, self.datalayer.get_absolute_url())
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_map_view_should_emit_versioned_urls(self):
+        url = reverse('map', args=(self.map.slug, self.map.pk))
+        response = self.client.get(url)
+        self.assertContains(response, self.datalayer.get_absolute_url())
+
+
+class PictogramViews(BaseTest):
+
+    def setUp(self):
+        super(PictogramViews, self).setUp()
+        cache.clear()
+        for name in ("Bakery", "Bar", "Castle"):
+            PictogramFactory(name=name)
+        self.url = reverse('pictogram_list_json')
+
+    def test_list_should_return_all_pictograms(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        json = simplejson.loads(response.content)
+        self.assertEqual(
+            [p['name'] for p in json['pictogram_list']],
+            ["Bakery", "Bar", "Castle"]
+        )
+        self.assertNotIn('page', json)
+
+    @override_settings(LEAFLET_STORAGE_PICTOGRAMS_PER_PAGE=2)
+    def test_list_should_be_paginated_when_page_is_given(self):
+        response = self.client.get(self.url, {'page': 2})
+        json = simplejson.loads(response.content)
+        self.assertEqual([p['name'] for p in json['pictogram_list']], ["Castle"])
+        self.assertEqual(json['page'], 2)
+        self.assertEqual(json['num_pages'], 2)
+        self.assertEqual(json['count'], 3)
+
+    def test_list_should_return_404_for_invalid_page(self):
+        response = self.client.get(self.url, {'page': 99})
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_should_filter_by_name(self):
+        response = self.client.get(self.url, {'q': 'ba'})
+        json = simplejson.loads(response.content)
+        self.assertEqual(
+            [p['name'] for p in json['pictogram_list']],
+            ["Bakery", "Bar"]
+        )
+
+    def test_list_should_be_cached(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(len(simplejson.loads(response.content)['pictogram_list']), 3)
+
+    def test_list_cache_should_be_invalidated_on_save_and_delete(self):
+        self.client.get(self.url)
+        pictogram = PictogramFactory(name="Dune")
+        response = self.client.get(self.url)
+        self.assertEqual(len(simplejson.loads(response.content)['pictogram_list']), 4)
+        pictogram.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(len(simplejson.loads(response.content)['pictogram_list']), 3)
+
+    def test_list_should_answer_304_when_etag_matches(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        PictogramFactory(name="Dune")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class MapListViews(BaseTest):
+
+    def setUp(self):
+        super(MapListViews, self).setUp()
+        self.maps = [self.map]
+        for i in range(4):
+            self.maps.append(MapFactory(owner=self.user, licence=self.licence,
+                                        name="map %s" % i, slug="map-%s" % i))
+        # Most recent first.
+        self.maps.reverse()
+        self.url = reverse('map_list_json')
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)
+
+    def test_should_list_public_maps_most_recent_first(self):
+        MapFactory(owner=self.user, licence=self.licence, share_status=Map.PRIVATE)
+        json = self.get()
+        self.assertEqual([m['id'] for m in json['maps']], [m.pk for m in self.maps])
+        self.assertIsNone(json['next'])
+        self.assertEqual(json['maps'][0]['url'], self.maps[0].get_absolute_url())
+        self.assertEqual(json['maps'][0]['owner'], self.user.username)
+
+    def test_should_paginate_with_cursor(self):
+        json = self.get(limit=2)
+        ids = [m['id'] for m in json['maps']]
+        while json['next']:
+            json = self.get(limit=2, cursor=json['next'])
+            ids.extend(m['id'] for m in json['maps'])
+        self.assertEqual(ids, [m.pk for m in self.maps])
+
+    def test_cursor_should_handle_same_modified_at(self):
+        Map.objects.update(modified_at=self.map.modified_at)
+        json = self.get(limit=3)
+        ids = [m['id'] for m in json['maps']]
+        json = self.get(limit=3, cursor=json['next'])
+        ids.extend(m['id'] for m in json['maps'])
+        self.assertEqual(ids, sorted([m.pk for m in self.maps], reverse=True))
+
+    def test_should_filter_by_owner(self):
+        other = UserFactory(username="other")
+        other_map = MapFactory(owner=other, licence=self.licence)
+        json = self.get(owner="other")
+        self.assertEqual([m['id'] for m in json['maps']], [other_map.pk])
+
+    def test_should_filter_by_tilelayer(self):
+        tilelayer = TileLayerFactory(name="other")
+        Map.objects.filter(pk=self.map.pk).update(tilelayer=tilelayer)
+        json = self.get(tilelayer=tilelayer.pk)
+        self.assertEqual([m['id'] for m in json['maps']], [self.map.pk])
+
+    def test_invalid_cursor_should_be_rejected(self):
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_listing_should_not_load_settings(self):
+        map_inst = Map.public.listing()[0]
+        self.assertNotIn('settings', map_inst.__dict__)
+        self.assertIn('name', map_inst.__dict__)
+
+
+class MapNearViews(BaseTest):
+
+    def setUp(self):
+        super(MapNearViews, self).setUp()
+        # self.map is at (2, 51).
+        self.close = MapFactory(owner=self.user, licence=self.licence,
+                                center=Point(2.1, 51.1))
+        self.far = MapFactory(owner=self.user, licence=self.licence,
+                              center=Point(30, -10))
+        self.url = reverse('map_near_json')
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return simplejson.loads(response.content)['maps']
+
+    def test_should_return_maps_within_radius_closest_first(self):
+        maps = self.get(lat=51, lng=2, radius=50)
+        self.assertEqual([m['id'] for m in maps], [self.map.pk, self.close.pk])
+        self.assertLess(maps[0]['distance'], maps[1]['distance'])
+        self.assertLess(maps[1]['distance'], 50)
+
+    def test_should_not_return_private_maps(self):
+        Map.objects.filter(pk=self.close.pk).update(share_status=Map.PRIVATE)
+        maps = self.get(lat=51, lng=2, radius=50)
+        self.assertEqual([m['id'] for m in maps], [self.map.pk])
+
+    def test_should_use_extent_with_bbox(self):
+        # self.map has a datalayer in Austria, far from its center.
+        maps = self.get(bbox="13,48,14,49")
+        self.assertEqual([m['id'] for m in maps], [self.map.pk])
+        maps = self.get(bbox="29,-11,31,-9")
+        self.assertEqual([m['id'] for m in maps], [self.far.pk])
+
+    def test_should_need_a_point_or_a_bbox(self):
+        response = self.client.get(self.url, {'radius': 10})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.url, {'bbox': '1,2,3'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_should_reject_out_of_range_parameters(self):
+        for params in ({'lat': 91, 'lng': 2}, {'lat': 51, 'lng': -181},
+                       {'lat': 'nan', 'lng': 2}, {'lat': 51, 'lng': 2, 'radius': 0},
+                       {'lat': 51, 'lng': 2, 'radius': -5},
+                       {'lat': 51, 'lng': 2, 'radius': 100000},
+                       {'bbox': '14,48,13,49'}, {'bbox': '13,-95,14,49'},
+                       {'bbox': '13,48,inf,49'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
@@ -0,0 +1,190 @@
+"""
+Fixed-size, optimised variants of the pictograms images: a quantised PNG
+and, when Pillow supports it, a WebP, for each size of
+LEAFLET_STORAGE_PICTOGRAM_SIZES. They are stored in a directory of their
+own, which uploads never go to, named after the original image, eg.
+"pictogram/variants/12/<digest>-24.png", and listed in Pictogram.variants.
+
+With LEAFLET_STORAGE_PICTOGRAM_VARIANTS, they are generated on upload, in
+the background, by a pool of LEAFLET_STORAGE_PICTOGRAM_WORKERS threads
+(Pillow releases the GIL while resizing and encoding), so saving a
+pictogram does not wait for them; with 0 workers, they are generated
+before the save returns. Use the storagepictogramvariants command to
+generate them for existing pictograms.
+"""
+import hashlib
+import logging
+import os
+from io import BytesIO
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, connections
+
+from PIL import Image
+
+from .models import Pictogram
+from .sprites import open_image
+from .utils import on_commit
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = "pictogram/variants"
+
+_pool = None
+
+
+def get_sizes():
+    return getattr(settings, 'LEAFLET_STORAGE_PICTOGRAM_SIZES', (24, 48))
+
+
+def get_formats():
+    Image.init()
+    if 'WEBP' in Image.SAVE:
+        return ('png', 'webp')
+    return ('png', )
+
+
+def get_pool():
+    global _pool
+    workers = getattr(settings, 'LEAFLET_STORAGE_PICTOGRAM_WORKERS', 4)
+    if not workers:
+        return None
+    if _pool is None:
+        _pool = ThreadPool(workers)
+    return _pool
+
+
+def get_variants_dir(pictogram):
+    return os.path.join(VARIANTS_DIR, str(pictogram.pk))
+
+
+def get_variant_name(pictogram, size, ext):
+    # A new image gets new names, so cached variants are never stale.
+    digest = hashlib.md5(pictogram.pictogram.name.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(get_variants_dir(pictogram), "%s-%s.%s" % (digest, size, ext))
+
+
+def render(image, size, ext):
+    """
+    Return `image` fit in a transparent `size` x `size` square, encoded
+    as `ext`.
+    """
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.ANTIALIAS)
+    canvas = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    canvas.paste(thumbnail, ((size - thumbnail.size[0]) // 2,
+                             (size - thumbnail.size[1]) // 2))
+    content = BytesIO()
+    if ext == 'png':
+        try:
+            # Fast octree is the only method keeping the alpha channel.
+            canvas = canvas.quantize(256, method=2)
+        except ValueError:
+            pass
+        canvas.save(content, 'PNG', optimize=True)
+    else:
+        canvas.save(content, 'WEBP', quality=90, method=6)
+    return content.getvalue()
+
+
+def save_variant(args):
+    image, variant, size, ext = args
+    content = render(image, size, ext)
+    # Do not let the storage rename it; only variants live there.
+    default_storage.delete(variant)
+    return size, ext, default_storage.save(variant, ContentFile(content))
+
+
+def remove_old_variants(pictogram, keep):
+    """
+    Remove the variants of the previous images of `pictogram`.
+    """
+    directory = get_variants_dir(pictogram)
+    if not default_storage.exists(directory):
+        return
+    for name in default_storage.listdir(directory)[1]:
+        path = os.path.join(directory, name)
+        if path not in keep:
+            default_storage.delete(path)
+
+
+def make_variants(pictogram, pool=None):
+    """
+    Generate the variants of `pictogram`, in `pool` if given. Return the
+    value of its `variants` field, empty when its image is unreadable.
+    """
+    image = open_image(pictogram)
+    if image is None:
+        return {}
+    tasks = [(image, get_variant_name(pictogram, size, ext), size, ext)
+             for size in get_sizes() for ext in get_formats()]
+    results = pool.map(save_variant, tasks) if pool else map(save_variant, tasks)
+    sizes = {}
+    for size, ext, variant in results:
+        sizes.setdefault(str(size), {})[ext] = variant
+    remove_old_variants(pictogram, [variant for size, ext, variant in results])
+    return {"source": pictogram.pictogram.name, "sizes": sizes}
+
+
+def build_variants(pictogram, pool=None):
+    variants = make_variants(pictogram, pool)
+    Pictogram.objects.filter(pk=pictogram.pk).update(variants=variants)
+    pictogram.variants = variants
+    # Set with update(), which does not send signals.
+    Pictogram.bump_list_version()
+    return variants
+
+
+def _build(pk):
+    try:
+        _backfill(pk)
+    except Exception:
+        logger.exception("Unable to build the variants of pictogram %s", pk)
+    finally:
+        # Threads do not share the connection of the request.
+        connection.close()
+
+
+def schedule(pictogram):
+    """
+    Generate the variants of `pictogram` in the background, once it is
+    committed, or right away without workers.
+    """
+    pool = get_pool()
+    if pool is None:
+        build_variants(pictogram)
+    else:
+        on_commit(pool.apply_async, _build, (pictogram.pk, ))
+
+
+def _backfill(pk):
+    try:
+        pictogram = Pictogram.objects.get(pk=pk)
+    except Pictogram.DoesNotExist:
+        return False
+    return bool(build_variants(pictogram))
+
+
+def backfill(pks, workers=4):
+    """
+    Generate the variants of the pictograms `pks`, in `workers` processes.
+    Return the number of pictograms with variants.
+    """
+    if workers <= 1:
+        return sum(map(_backfill, pks))
+    # Each process must open its own connection.
+    for connection in connections.all():
+        connection.close()
+    pool = Pool(workers)
+    try:
+        count = sum(pool.map(_backfill, pks))
+    finally:
+        pool.close()
+        pool.join()
+    # The workers may not share our cache.
+    Pictogram.bump_list_version()
+    return count
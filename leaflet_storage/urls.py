@@ -13,14 +13,27 @@ urlpatterns = patterns('',
     url(r'^login/popup/end/$', views.LoginPopupEnd.as_view(), name='login_popup_end'),
     url(r'^logout/$', views.logout, name='logout'),
     url(r'^map/(?P<pk>\d+)/geojson/$', views.MapViewGeoJSON.as_view(), name='map_geojson'),
+    url(r'^map/(?P<pk>\d+)/export/(?P<format>geojson|ndgeojson|csv|kml|gpx)/$', views.MapExport.as_view(), name='map_export'),
     url(r'^map/(?P<username>[-_\w]+)/(?P<slug>[-_\w]+)/$', views.MapOldUrl.as_view(), name='map_old_url'),
     url(r'^map/anonymous-edit/(?P<signature>.+)$', views.MapAnonymousEditUrl.as_view(), name='map_anonymous_edit_url'),
     url(r'^m/(?P<pk>\d+)/$', views.MapShortUrl.as_view(), name='map_short_url'),
+    url(r'^maps/json/$', views.MapListJSON.as_view(), name='map_list_json'),
+    url(r'^maps/near/json/$', views.MapNearJSON.as_view(), name='map_near_json'),
+    url(r'^search/json/$', views.SearchJSON.as_view(), name='search_json'),
     url(r'^pictogram/json/$', views.PictogramJSONList.as_view(), name='pictogram_list_json'),
+    url(r'^pictogram/sprite/(?P<name>\d+-[a-f0-9]+)\.(?P<ext>png|json)$', views.PictogramSpriteView.as_view(), name='pictogram_sprite'),
+    url(r'^datalayer/(?P<pk>[\d]+)/search/$', views.DataLayerSearch.as_view(), name='datalayer_search'),
+    url(r'^datalayer/(?P<pk>[\d]+)/clusters/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.json$', views.DataLayerClusters.as_view(), name='datalayer_clusters'),
+    url(r'^datalayer/(?P<pk>[\d]+)/heatmap/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(?P<ext>png|bin)$', views.DataLayerHeatmap.as_view(), name='datalayer_heatmap'),
+    url(r'^datalayer/(?P<pk>[\d]+)/export/(?P<format>geojson|ndgeojson|csv|kml|gpx)/$', views.DataLayerExport.as_view(), name='datalayer_export'),
+    url(r'^datalayer/(?P<pk>[\d]+)/(?P<version>[\w]+)/$', views.DataLayerVersionView.as_view(), name='datalayer_versioned_view'),
 )
 urlpatterns += decorated_patterns('', [cache_control(must_revalidate=True), ],
     url(r'^datalayer/(?P<pk>[\d]+)/$', views.DataLayerView.as_view(), name='datalayer_view'),
 )
+urlpatterns += decorated_patterns('', [never_cache, ],
+    url(r'^datalayer/import/(?P<job_id>[a-f0-9]{32})/$', views.DataLayerImportStatus.as_view(), name='datalayer_import_status'),
+)
 urlpatterns += decorated_patterns('', [ensure_csrf_cookie, ],
     url(r'^map/(?P<slug>[-_\w]+)_(?P<pk>\d+)$', views.MapView.as_view(), name='map'),
     url(r'^map/new/$', views.MapNew.as_view(), name='map_new'),
@@ -34,6 +47,8 @@ urlpatterns += decorated_patterns('', [map_permissions_check, never_cache, ],
     url(r'^map/(?P<map_id>[\d]+)/update/delete/$', views.MapDelete.as_view(), name='map_delete'),
     url(r'^map/(?P<map_id>[\d]+)/update/clone/$', views.MapClone.as_view(), name='map_clone'),
     url(r'^map/(?P<map_id>[\d]+)/datalayer/create/$', views.DataLayerCreate.as_view(), name='datalayer_create'),
+    url(r'^map/(?P<map_id>[\d]+)/datalayer/import/$', views.DataLayerImport.as_view(), name='datalayer_import'),
     url(r'^map/(?P<map_id>[\d]+)/datalayer/update/(?P<pk>\d+)/$', views.DataLayerUpdate.as_view(), name='datalayer_update'),
+    url(r'^map/(?P<map_id>[\d]+)/datalayer/append/(?P<pk>\d+)/$', views.DataLayerAppend.as_view(), name='datalayer_append'),
     url(r'^map/(?P<map_id>[\d]+)/datalayer/delete/(?P<pk>\d+)/$', views.DataLayerDelete.as_view(), name='datalayer_delete'),
 )
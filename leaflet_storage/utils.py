@@ -1,8 +1,26 @@
+import codecs
 import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from functools import wraps
+from io import BytesIO
 
+from django.core.signals import got_request_exception
 from django.core.urlresolvers import get_resolver
 from django.core.urlresolvers import RegexURLPattern, RegexURLResolver
 from django.conf.urls import patterns
+from django.db import connection, transaction, DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+
+from . import serialization
+
+# Where the pictograms sprite sheets are stored, see leaflet_storage.sprites.
+SPRITES_DIR = "pictogram/sprites"
 
 
 def get_uri_template(urlname, args=None, prefix=""):
@@ -132,4 +150,317 @@ def smart_decode(s):
 def gzip_file(from_path, to_path):
     with open(from_path, 'rb') as f_in:
         with gzip.open(to_path, 'wb') as f_out:
-            f_out.writelines(f_in)
+            # By blocks: a geojson file can be made of one huge line.
+            shutil.copyfileobj(f_in, f_out)
+
+
+def get_file_digest(f):
+    """Return the md5 hexdigest of a django File content."""
+    md5 = hashlib.md5()
+    for chunk in f.chunks():
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _iter_positions(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, long, float)):
+        yield coordinates
+    else:
+        for item in coordinates:
+            for position in _iter_positions(item):
+                yield position
+
+
+def _iter_geometries(geometry):
+    if not geometry:
+        return
+    if geometry.get('type') == 'GeometryCollection':
+        for item in geometry.get('geometries', []):
+            for sub in _iter_geometries(item):
+                yield sub
+    else:
+        yield geometry
+
+
+class _JSONReader(object):
+    """
+    Decode a JSON document value by value from an iterable of byte chunks,
+    only keeping in memory the part not decoded yet.
+    """
+    decoder = json.JSONDecoder()
+    # JSON whitespace only: a record separator is not one.
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, chunks, offsets=False):
+        self.chunks = iter(chunks)
+        self.unicode = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = u''
+        self.pos = 0
+        # Byte offset in the input of buffer[mark], when asked for.
+        self.offsets = offsets
+        self.offset = 0
+        self.mark = 0
+
+    def tell(self):
+        """
+        Return the byte offset in the input of the current position.
+        """
+        self.offset += len(self.buffer[self.mark:self.pos].encode('utf-8'))
+        self.mark = self.pos
+        return self.offset
+
+    def fill(self):
+        """
+        Read at least as much as what remains in the buffer, so decoding a
+        big value costs linear time. Return False at the end of the input.
+        """
+        if self.offsets:
+            self.tell()
+        remaining = self.buffer[self.pos:]
+        added = []
+        length = 0
+        for chunk in self.chunks:
+            added.append(self.unicode.decode(chunk))
+            length += len(added[-1])
+            if length >= max(len(remaining), 1):
+                break
+        self.buffer = remaining + u''.join(added)
+        self.pos = self.mark = 0
+        return bool(added)
+
+    def peek(self):
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expecting %s at %s" % (char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                end = None
+            # A number ending the buffer may continue in the next chunk.
+            if end is not None and end < len(self.buffer):
+                break
+            if not self.fill():
+                if end is None:
+                    raise ValueError("Invalid JSON")
+                break
+        self.pos = end
+        return value
+
+
+def iter_geojson_features(chunks, offsets=False, members=None):
+    """
+    Yield the features of a GeoJSON FeatureCollection, or of a RFC 8142
+    GeoJSON text sequence, given as byte chunks, one at a time, without
+    loading the whole document. With `offsets`, yield (feature, start,
+    end), where start and end are the byte offsets of the feature in the
+    input. With a `members` dict, the other members of the collection
+    are stored in it.
+    """
+    reader = _JSONReader(chunks, offsets)
+    if reader.peek() == RS:
+        for item in _iter_sequence_features(reader, offsets, members):
+            yield item
+        return
+    reader.expect('{')
+    while reader.peek() not in (u'}', u''):
+        key = reader.value()
+        reader.expect(':')
+        if key == 'features':
+            reader.expect('[')
+            if reader.peek() == u']':
+                reader.pos += 1
+            else:
+                while True:
+                    if offsets:
+                        reader.peek()
+                        start = reader.tell()
+                        feature = reader.value()
+                        yield feature, start, reader.tell()
+                    else:
+                        yield reader.value()
+                    char = reader.peek()
+                    reader.expect(char)
+                    if char == u']':
+                        break
+                    if char != u',':
+                        raise ValueError("Expecting , or ] at %s" % reader.pos)
+        else:
+            value = reader.value()
+            if members is not None:
+                members[key] = value
+        if reader.peek() == u',':
+            reader.pos += 1
+    reader.expect('}')
+
+
+RS = u'\x1e'
+
+
+def _iter_sequence_features(reader, offsets, members):
+    # Each text is a Feature, or a FeatureCollection only holding the
+    # collection members (see leaflet_storage.geojsonseq).
+    while reader.peek() == RS:
+        reader.pos += 1
+        if offsets:
+            reader.peek()
+            start = reader.tell()
+        value = reader.value()
+        if value.get('type') == 'FeatureCollection':
+            if members is not None:
+                members.update((key, item) for key, item in value.items() if key != 'features')
+        elif offsets:
+            yield value, start, reader.tell()
+        else:
+            yield value
+    if reader.peek() != u'':
+        raise ValueError("Expecting a record separator at %s" % reader.pos)
+
+
+def read_features(path, spans):
+    """
+    Yield the features at the (offset, length) byte `spans` of the GeoJSON
+    file `path`, without reading the rest of it.
+    """
+    with open(path, 'rb') as f:
+        for offset, length in spans:
+            f.seek(offset)
+            yield serialization.loads(f.read(length).decode('utf-8'))
+
+
+def iter_content(datalayer, block_size=64 * 1024):
+    """
+    Yield the content of `datalayer` by blocks: the first `size` bytes of
+    its file, when known, as a failed append may have left more after
+    them (see leaflet_storage.geojsonseq).
+    """
+    remaining = datalayer.size or None
+    with open(datalayer.geojson.path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            block = f.read(block_size if remaining is None else min(block_size, remaining))
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+
+def get_geojson_stats(chunks):
+    """
+    Return the (xmin, ymin, xmax, ymax) bbox, or None if it has no
+    coordinates, and the features count of a GeoJSON FeatureCollection
+    given as byte chunks.
+    """
+    xmin = ymin = float('inf')
+    xmax = ymax = float('-inf')
+    count = 0
+    for feature in iter_geojson_features(chunks):
+        count += 1
+        for geometry in _iter_geometries(feature.get('geometry')):
+            for position in _iter_positions(geometry.get('coordinates') or []):
+                xmin = min(xmin, position[0])
+                ymin = min(ymin, position[1])
+                xmax = max(xmax, position[0])
+                ymax = max(ymax, position[1])
+    if xmin > xmax:
+        return None, count
+    return (xmin, ymin, xmax, ymax), count
+
+
+def gzip_content(content):
+    """
+    Return `content` gzipped, always the same way for the same content.
+    """
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(content)
+    return out.getvalue()
+
+
+def atomic_write(path, content):
+    """
+    Write `content` (bytes) to `path`, without any reader ever seeing a
+    partially written file.
+    """
+    dirname = os.path.dirname(path)
+    f = tempfile.NamedTemporaryFile(dir=dirname, prefix=".tmp", delete=False)
+    try:
+        with f:
+            f.write(content)
+        os.chmod(f.name, 0o644)
+        os.rename(f.name, path)
+    except:
+        os.remove(f.name)
+        raise
+
+
+_local = threading.local()
+
+
+def on_commit(func, *args):
+    """
+    Call `func(*args)` once what the current transaction wrote is visible
+    to other connections: right away in autocommit, else when the
+    outermost atomic block commits. Forgotten if the block, or the
+    savepoint it was queued in, is rolled back (Django 1.6 has no
+    transaction hooks). For background jobs, which must read the committed
+    rows.
+    """
+    if not connection.in_atomic_block:
+        func(*args)
+        return
+    if not hasattr(_local, 'pending'):
+        _local.pending = []
+    _local.pending.append((len(connection.savepoint_ids), func, args))
+
+
+@receiver(got_request_exception)
+def discard_pending(**kwargs):
+    """Forget what on_commit deferred in this thread."""
+    _local.pending = []
+
+
+def _atomic_exit(exit):
+    @wraps(exit)
+    def wrapper(self, exc_type, exc_value, traceback):
+        conn = transaction.get_connection(self.using)
+        if conn.alias != DEFAULT_DB_ALIAS:
+            return exit(self, exc_type, exc_value, traceback)
+        failed = (exc_type is not None or conn.needs_rollback
+                  or conn.closed_in_transaction)
+        try:
+            exit(self, exc_type, exc_value, traceback)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            depth = len(conn.savepoint_ids) if conn.in_atomic_block else 0
+            pending = getattr(_local, 'pending', [])
+            if failed:
+                # Drop what was queued in the block just rolled back.
+                pending = [p for p in pending if p[0] <= depth]
+            else:
+                # Now part of the enclosing block.
+                pending = [(min(d, depth), f, a) for d, f, a in pending]
+            if conn.in_atomic_block:
+                _local.pending = pending
+            else:
+                _local.pending = []
+                if not failed:
+                    for d, func, args in pending:
+                        func(*args)
+    wrapper.runs_on_commit = True
+    return wrapper
+
+
+if not hasattr(transaction.Atomic.__exit__, 'runs_on_commit'):
+    transaction.Atomic.__exit__ = _atomic_exit(transaction.Atomic.__exit__)
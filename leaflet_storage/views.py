@@ -2,6 +2,8 @@
 
 import os
 import hashlib
+from datetime import datetime, timedelta
+from wsgiref.util import FileWrapper
 
 from django.conf import settings
 from django.contrib import messages
@@ -10,23 +12,33 @@ from django.contrib.auth.models import User
 from django.core.signing import Signer, BadSignature
 from django.core.urlresolvers import reverse_lazy, reverse
 from django.http import (HttpResponse, HttpResponseForbidden,
-                         HttpResponseRedirect, CompatibleStreamingHttpResponse)
+                         HttpResponseRedirect, HttpResponseNotModified,
+                         HttpResponseBadRequest, CompatibleStreamingHttpResponse,
+                         Http404)
 from django.shortcuts import get_object_or_404
 from django.template import RequestContext
 from django.template.loader import render_to_string
-from django.utils import simplejson
 from django.utils.translation import ugettext as _
+from django.utils import timezone
 from django.views.generic import View
 from django.views.generic import DetailView
 from django.views.generic.detail import BaseDetailView
 from django.views.generic.list import ListView
 from django.views.generic.base import TemplateView, RedirectView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
-from django.utils.http import http_date
+from django.utils.http import http_date, parse_etags
+from django.utils.encoding import force_bytes
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.middleware.gzip import re_accepts_gzip
 
 from .models import Map, DataLayer, TileLayer, Pictogram, Licence
-from .utils import get_uri_template, gzip_file
+from . import (serialization, instrumentation, search, termindex, clusters,
+               heatmaps, importers, exporters, geojsonseq)
+from .utils import get_uri_template, gzip_file, iter_geojson_features, SPRITES_DIR
 from .forms import (DataLayerForm, UpdateMapPermissionsForm, MapSettingsForm,
                     AnonymousMapPermissionsForm, DEFAULT_LATITUDE,
                     DEFAULT_LONGITUDE, FlatErrorList)
@@ -58,14 +70,14 @@ def render_to_json(templates, response_kwargs, context, request):
         response_kwargs,
         RequestContext(request, context)
     )
-    _json = simplejson.dumps({
+    _json = serialization.dumps({
         "html": html
     })
     return HttpResponse(_json)
 
 
 def simple_json_response(**kwargs):
-    return HttpResponse(simplejson.dumps(kwargs))
+    return HttpResponse(serialization.dumps(kwargs))
 
 
 # ############## #
@@ -119,7 +131,10 @@ class MapDetailMixin(object):
         if not "properties" in map_settings:
             map_settings['properties'] = {}
         map_settings['properties'].update(properties)
-        context['map_settings'] = simplejson.dumps(map_settings, indent=settings.DEBUG)
+        context['map_settings'] = serialization.dumps(
+            map_settings,
+            indent=2 if settings.DEBUG else None
+        )
         return context
 
     def get_tilelayers(self):
@@ -148,6 +163,10 @@ class MapDetailMixin(object):
 
 class MapView(MapDetailMixin, DetailView):
 
+    def get_queryset(self):
+        # Owner is needed for the permissions and for the author properties
+        return super(MapView, self).get_queryset().select_related('owner')
+
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         if not self.object.can_view(request):
@@ -199,6 +218,131 @@ class MapViewGeoJSON(MapView):
         return HttpResponse(context['map_settings'])
 
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_cursor(map_inst):
+    """
+    Keyset of a map in listings: its modified_at, in microseconds, and pk.
+    """
+    modified_at = map_inst.modified_at
+    if timezone.is_aware(modified_at):
+        modified_at = timezone.make_naive(modified_at, timezone.utc)
+    delta = modified_at - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return "%s-%s" % (microseconds, map_inst.pk)
+
+
+def decode_cursor(cursor):
+    microseconds, pk = cursor.split('-')
+    modified_at = EPOCH + timedelta(microseconds=int(microseconds))
+    if settings.USE_TZ:
+        modified_at = timezone.make_aware(modified_at, timezone.utc)
+    return modified_at, int(pk)
+
+
+class MapListJSON(View):
+    """
+    Public maps, most recently modified first, optionally only those of
+    one "owner" (username) or "tilelayer" (id). Paginated with "cursor",
+    given as "next" in the previous page, not with offsets.
+    """
+
+    def get(self, request, *args, **kwargs):
+        max_limit = getattr(settings, 'LEAFLET_STORAGE_MAP_LIST_LIMIT', 100)
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 20)), max_limit))
+            before = request.GET.get('cursor')
+            before = decode_cursor(before) if before else None
+            tilelayer = request.GET.get('tilelayer')
+            tilelayer = int(tilelayer) if tilelayer else None
+        except ValueError:
+            return HttpResponseBadRequest('Invalid parameters')
+        # Fetch one more, to know if there is a next page.
+        maps = list(Map.public.listing(
+            owner=request.GET.get('owner') or None,
+            tilelayer=tilelayer,
+            before=before
+        )[:limit + 1])
+        next_cursor = encode_cursor(maps[limit - 1]) if len(maps) > limit else None
+        return simple_json_response(
+            maps=[m.summary for m in maps[:limit]],
+            next=next_cursor
+        )
+
+
+class MapNearJSON(View):
+    """
+    Public maps near a point ("lat" and "lng"): within "radius" km, or whose
+    extent intersects "bbox" (west,south,east,north), the closest first.
+    Without point, the bbox center is used.
+    """
+
+    def get(self, request, *args, **kwargs):
+        max_limit = getattr(settings, 'LEAFLET_STORAGE_MAP_LIST_LIMIT', 100)
+        max_radius = getattr(settings, 'LEAFLET_STORAGE_MAP_NEAR_MAX_RADIUS', 500)
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 20)), max_limit))
+            bbox = request.GET.get('bbox')
+            if bbox:
+                west, south, east, north = [float(i) for i in bbox.split(',')]
+                if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+                    raise ValueError('Invalid bbox')
+                bbox = Polygon.from_bbox((west, south, east, north))
+                bbox.srid = 4326
+            if 'lat' in request.GET and 'lng' in request.GET:
+                lat, lng = float(request.GET['lat']), float(request.GET['lng'])
+                if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                    raise ValueError('Invalid point')
+                point = Point(lng, lat, srid=4326)
+            elif bbox:
+                point = bbox.centroid
+            else:
+                raise ValueError('A point or a bbox is needed')
+            radius = None
+            if not bbox or 'radius' in request.GET:
+                radius = float(request.GET.get('radius', 50))
+                if not 0 < radius <= max_radius:
+                    raise ValueError('Invalid radius')
+        except ValueError:
+            return HttpResponseBadRequest('Invalid parameters')
+        maps = Map.public.near(
+            point,
+            radius=D(km=radius) if radius is not None else None,
+            bbox=bbox or None
+        )[:limit]
+        return simple_json_response(
+            maps=[dict(m.summary, distance=m.distance.km) for m in maps]
+        )
+
+
+class SearchJSON(View):
+    """
+    Public maps whose name or description match "q", and public maps
+    features whose properties match it, the most relevant first.
+    """
+
+    def get(self, request, *args, **kwargs):
+        max_limit = getattr(settings, 'LEAFLET_STORAGE_MAP_LIST_LIMIT', 100)
+        q = request.GET.get('q', '').strip()
+        try:
+            limit = max(1, min(int(request.GET.get('limit', 20)), max_limit))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid parameters')
+        if not q:
+            return HttpResponseBadRequest('Missing q parameter')
+        features = [{
+            "map": feature['datalayer__map'],
+            "datalayer": feature['datalayer'],
+            "index": feature['position'],
+            "name": feature['name'],
+        } for feature in search.search_features(q)[:limit]]
+        return simple_json_response(
+            maps=[m.summary for m in search.search_maps(q)[:limit]],
+            features=features
+        )
+
+
 class MapNew(MapDetailMixin, TemplateView):
     template_name = "leaflet_storage/map_detail.html"
 
@@ -234,7 +378,16 @@ class MapCreate(FormLessEditMixin, CreateView):
         return response
 
 
-class MapUpdate(FormLessEditMixin, UpdateView):
+class MapInstanceMixin(object):
+    """
+    Reuse the map instance already fetched by map_permissions_check.
+    """
+
+    def get_object(self, queryset=None):
+        return self.kwargs['map_inst']
+
+
+class MapUpdate(MapInstanceMixin, FormLessEditMixin, UpdateView):
     model = Map
     form_class = MapSettingsForm
     pk_url_kwarg = 'map_id'
@@ -249,13 +402,13 @@ class MapUpdate(FormLessEditMixin, UpdateView):
         )
 
 
-class UpdateMapPermissions(UpdateView):
+class UpdateMapPermissions(MapInstanceMixin, UpdateView):
     template_name = "leaflet_storage/map_update_permissions.html"
     model = Map
     pk_url_kwarg = 'map_id'
 
     def get_form_class(self):
-        if self.object.owner:
+        if self.object.owner_id:
             return UpdateMapPermissionsForm
         else:
             return AnonymousMapPermissionsForm
@@ -263,7 +416,7 @@ class UpdateMapPermissions(UpdateView):
     def get_form(self, form_class):
         form = super(UpdateMapPermissions, self).get_form(form_class)
         user = self.request.user
-        if self.object.owner and not user == self.object.owner:
+        if self.object.owner_id and not user.pk == self.object.owner_id:
             del form.fields['edit_status']
             del form.fields['share_status']
         return form
@@ -276,7 +429,7 @@ class UpdateMapPermissions(UpdateView):
         return render_to_json(self.get_template_names(), response_kwargs, context, self.request)
 
 
-class MapDelete(DeleteView):
+class MapDelete(MapInstanceMixin, DeleteView):
     model = Map
     pk_url_kwarg = "map_id"
 
@@ -367,10 +520,15 @@ class MapAnonymousEditUrl(RedirectView):
 #    DataLayer   #
 # ############## #
 
+STREAMING_BLOCK_SIZE = 64 * 1024
+
+
 class DataLayerView(BaseDetailView):
     model = DataLayer
 
     def render_to_response(self, context, **response_kwargs):
+        if geojsonseq.is_sequence(self.object):
+            return self.render_sequence()
         path = self.object.geojson.path
         statobj = os.stat(path)
         response = None
@@ -387,7 +545,10 @@ class DataLayerView(BaseDetailView):
                 if statobj.st_mtime > gzip_statobj.st_mtime:
                     up_to_date = False
             if not up_to_date:
+                instrumentation.incr('gzip_cache_miss')
                 gzip_file(path, gzip_path)
+            else:
+                instrumentation.incr('gzip_cache_hit')
             path = gzip_path
 
         if getattr(settings, 'LEAFLET_STORAGE_ACCEL_REDIRECT', False):
@@ -398,18 +559,208 @@ class DataLayerView(BaseDetailView):
             response['X-Sendfile'] = path
         else:
             # TODO IMS
+            # Stream by blocks, never load the whole file in memory.
             response = CompatibleStreamingHttpResponse(
-                open(path, 'rb'),
+                FileWrapper(open(path, 'rb'), STREAMING_BLOCK_SIZE),
                 content_type='application/json'
             )
             response["Last-Modified"] = http_date(statobj.st_mtime)
-            response['ETag'] = '"%s"' % hashlib.md5(response.content).hexdigest()
-            response['Content-Length'] = str(len(response.content))
+            # version is the digest of the content, fallback to file stats
+            # for datalayers saved before.
+            etag = self.object.version or "%x-%x" % (int(statobj.st_mtime), statobj.st_size)
             if path.endswith(ext):
+                etag = "%s-gzip" % etag
                 response['Content-Encoding'] = 'gzip'
+            response['ETag'] = '"%s"' % etag
+            response['Content-Length'] = str(os.path.getsize(path))
+        if getattr(settings, 'LEAFLET_STORAGE_GZIP', True):
+            # Same URL, gzipped or not: caches must keep both.
+            patch_vary_headers(response, ('Accept-Encoding', ))
+        return response
+
+    def render_sequence(self):
+        """
+        Stream a DataLayer stored as a GeoJSON sequence, as a
+        FeatureCollection, or as is with "format=geojsonseq". Only the
+        features from "start", "limit" at most, when given.
+        """
+        try:
+            start = int(self.request.GET.get('start', 0))
+            limit = self.request.GET.get('limit')
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            return HttpResponseBadRequest('Invalid start or limit')
+        if start < 0 or (limit is not None and limit < 0):
+            return HttpResponseBadRequest('Invalid start or limit')
+        etag = self.object.version
+        if self.request.GET.get('format') == 'geojsonseq':
+            response = CompatibleStreamingHttpResponse(
+                geojsonseq.iter_sequence(self.object, start, limit),
+                content_type=geojsonseq.CONTENT_TYPE
+            )
+            etag = "%s-seq" % etag
+        else:
+            response = CompatibleStreamingHttpResponse(
+                geojsonseq.iter_collection(self.object, start, limit),
+                content_type='application/json'
+            )
+        if start or limit is not None:
+            etag = "%s-%s-%s" % (etag, start, limit)
+        response['ETag'] = '"%s"' % etag
+        return response
+
+
+class DataLayerVersionView(DataLayerView):
+    """
+    Serve a given version of a DataLayer, which content will never change
+    for this URL, so let any cache keep it for long.
+    """
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.kwargs['version'] != self.object.version:
+            # Outdated version: send to the current one, but never cache
+            # this answer, the layer will change again.
+            response = HttpResponseRedirect(self.object.get_absolute_url())
+            patch_cache_control(response, no_cache=True, must_revalidate=True)
+            return response
+        response = super(DataLayerVersionView, self).render_to_response(context, **response_kwargs)
+        max_age = getattr(settings, 'LEAFLET_STORAGE_DATALAYER_MAX_AGE', 60 * 60 * 24 * 365)
+        patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+        return response
+
+
+class DataLayerContentMixin(object):
+    """
+    Views computed from the content of a DataLayer: only for those who can
+    view its map, and not found when it has no content (yet).
+    """
+    model = DataLayer
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if not self.object.map.can_view(request):
+            return HttpResponseForbidden('Forbidden')
+        if not self.object.geojson:
+            raise Http404('No content for this layer')
+        try:
+            return self.render_to_response(self.get_context_data(object=self.object))
+        except (IOError, OSError):
+            raise Http404('No content for this layer')
+
+
+class DataLayerSearch(DataLayerContentMixin, BaseDetailView):
+    """
+    Features of a DataLayer whose properties have words starting with
+    those of "q", with their bbox, found with the layer term index.
+    """
+
+    def render_to_response(self, context, **response_kwargs):
+        q = self.request.GET.get('q', '').strip()
+        if not q:
+            return HttpResponseBadRequest('Missing q parameter')
+        limit = getattr(settings, 'LEAFLET_STORAGE_TERM_INDEX_LIMIT', 100)
+        try:
+            features = termindex.search(self.object, q, limit=limit + 1)
+        except (ValueError, TypeError, AttributeError, IndexError):
+            return HttpResponseBadRequest('Unable to search this layer')
+        return simple_json_response(
+            type="FeatureCollection",
+            features=features[:limit],
+            truncated=len(features) > limit
+        )
+
+
+class DataLayerClusters(DataLayerContentMixin, BaseDetailView):
+    """
+    Clusters of the points of a DataLayer in the tile z/x/y, and its points
+    alone in their cluster, as GeoJSON.
+    """
+
+    def render_to_response(self, context, **response_kwargs):
+        zoom, x, y = [int(self.kwargs[name]) for name in ('z', 'x', 'y')]
+        if zoom > 24 or x >= 2 ** zoom or y >= 2 ** zoom:
+            raise Http404('Invalid tile')
+        try:
+            features = clusters.get_tile(self.object, zoom, x, y)
+        except (ValueError, TypeError, AttributeError, IndexError):
+            return HttpResponseBadRequest('Unable to cluster this layer')
+        return simple_json_response(type="FeatureCollection", features=features)
+
+
+class DataLayerHeatmap(DataLayerContentMixin, BaseDetailView):
+    """
+    Density grid of the points of a DataLayer in the tile z/x/y, as a
+    grayscale PNG, or as raw little endian uint32 counts (row by row, from
+    the north west) with the "bin" extension.
+    """
+
+    def render_to_response(self, context, **response_kwargs):
+        zoom, x, y = [int(self.kwargs[name]) for name in ('z', 'x', 'y')]
+        if zoom > 24 or x >= 2 ** zoom or y >= 2 ** zoom:
+            raise Http404('Invalid tile')
+        try:
+            grid, max_count = heatmaps.get_grid(self.object, zoom, x, y)
+        except (ValueError, TypeError, AttributeError, IndexError):
+            return HttpResponseBadRequest('Unable to compute this layer heatmap')
+        if grid is None:
+            raise Http404('Zoom too high')
+        if self.kwargs['ext'] == 'png':
+            response = HttpResponse(heatmaps.to_png(grid, max_count), content_type='image/png')
+        else:
+            response = HttpResponse(heatmaps.to_bin(grid), content_type='application/octet-stream')
+            response['X-Heatmap-Resolution'] = str(grid.shape[0])
+        response['X-Heatmap-Max'] = str(max_count)
         return response
 
 
+def export_response(chunks, content_type, filename):
+    response = CompatibleStreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+class DataLayerExport(BaseDetailView):
+    """
+    Content of a DataLayer converted to another format, streamed feature
+    by feature.
+    """
+    model = DataLayer
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if not self.object.map.can_view(request):
+            return HttpResponseForbidden('Forbidden')
+        # Checked before streaming, which cannot fail with an error status.
+        if not exporters.is_readable(self.object):
+            return HttpResponseBadRequest('Unable to export this layer')
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+    def render_to_response(self, context, **response_kwargs):
+        fmt = self.kwargs['format']
+        return export_response(exporters.export([self.object], fmt),
+                               exporters.FORMATS[fmt][1],
+                               exporters.get_filename(self.object.name, fmt))
+
+
+class MapExport(View):
+    """
+    Features of all the DataLayers of a Map in one file, or, with "zip",
+    in a zip archive of one file per DataLayer.
+    """
+
+    def get(self, request, *args, **kwargs):
+        map_inst = get_object_or_404(Map, pk=kwargs['pk'])
+        if not map_inst.can_view(request):
+            return HttpResponseForbidden('Forbidden')
+        fmt = kwargs['format']
+        datalayers = map_inst.datalayer_set.all()
+        if request.GET.get('zip'):
+            return export_response(exporters.to_zip(datalayers, fmt), 'application/zip',
+                                   "%s.zip" % exporters.get_filename(map_inst.name, fmt))
+        return export_response(exporters.export(datalayers, fmt), exporters.FORMATS[fmt][1],
+                               exporters.get_filename(map_inst.name, fmt))
+
+
 class DataLayerCreate(FormLessEditMixin, CreateView):
     model = DataLayer
     form_class = DataLayerForm
@@ -431,6 +782,62 @@ class DataLayerUpdate(FormLessEditMixin, UpdateView):
         return simple_json_response(**self.object.metadata)
 
 
+class DataLayerAppend(View):
+    """
+    Append the features of the posted FeatureCollection (or GeoJSON
+    sequence) to a DataLayer stored as a GeoJSON sequence.
+    """
+    http_method_names = [u'post', ]
+
+    def post(self, request, *args, **kwargs):
+        datalayer = get_object_or_404(DataLayer, pk=kwargs['pk'], map=kwargs['map_inst'])
+        if not geojsonseq.is_sequence(datalayer):
+            return HttpResponseBadRequest('Not a GeoJSON sequence')
+        try:
+            features = list(iter_geojson_features([request.body]))
+        except (ValueError, TypeError, AttributeError, IndexError):
+            return HttpResponseBadRequest('Invalid GeoJSON')
+        datalayer = geojsonseq.append(datalayer, features)
+        return simple_json_response(**datalayer.metadata)
+
+
+class DataLayerImport(View):
+    """
+    Create a DataLayer from a CSV, KML, GPX or OSM "data" file, converted
+    in the background. "format" defaults to the file extension. Return
+    the URL where to follow the conversion.
+    """
+    http_method_names = [u'post', ]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('data')
+        if not upload:
+            return HttpResponseBadRequest('Missing data file')
+        fmt = request.POST.get('format') or importers.guess_format(upload.name)
+        if fmt not in importers.FORMATS:
+            return HttpResponseBadRequest('Unknown format')
+        name = (request.POST.get('name') or os.path.splitext(upload.name)[0])[:200]
+        job_id = importers.start(upload, fmt, self.kwargs['map_inst'], name)
+        return simple_json_response(
+            id=job_id,
+            url=reverse('datalayer_import_status', kwargs={'job_id': job_id})
+        )
+
+
+class DataLayerImportStatus(View):
+    """
+    Status of an import: "pending", "running" (with the "read" bytes out
+    of "total", and the converted "features"), "done" (with the created
+    "datalayer" metadata) or "error".
+    """
+
+    def get(self, request, *args, **kwargs):
+        job = importers.get_job(self.kwargs['job_id'])
+        if job is None:
+            raise Http404('Unknown import')
+        return simple_json_response(**job)
+
+
 class DataLayerDelete(DeleteView):
     model = DataLayer
 
@@ -447,11 +854,83 @@ class DataLayerDelete(DeleteView):
 # ############## #
 
 class PictogramJSONList(ListView):
+    """
+    All pictograms, or one page of them when "page" is given, optionally
+    filtered by name with "q". The JSON is cached until a pictogram is
+    saved or deleted, and served with an ETag.
+    """
     model = Pictogram
 
-    def render_to_response(self, context, **response_kwargs):
-        content = [p.json for p in Pictogram.objects.all()]
-        return simple_json_response(pictogram_list=content)
+    def get_queryset(self):
+        qs = super(PictogramJSONList, self).get_queryset()
+        q = self.request.GET.get('q')
+        if q:
+            qs = qs.filter(name__icontains=q)
+        return qs
+
+    def get_paginate_by(self, queryset):
+        # Without page, send the whole list, as the icon picker expects.
+        if self.page_kwarg in self.request.GET:
+            return getattr(settings, 'LEAFLET_STORAGE_PICTOGRAMS_PER_PAGE', 100)
+
+    def get_cache_key(self):
+        params = u"%s|%s" % (self.request.GET.get('q', ''),
+                             self.request.GET.get(self.page_kwarg, ''))
+        return "leaflet_storage:pictogram_list:%s:%s" % (
+            Pictogram.get_list_version(),
+            hashlib.md5(force_bytes(params)).hexdigest()
+        )
+
+    def get_content(self):
+        self.object_list = self.get_queryset()
+        context = self.get_context_data()
+        data = {'pictogram_list': [p.json for p in context['object_list']]}
+        page = context['page_obj']
+        if page:
+            data['page'] = page.number
+            data['num_pages'] = page.paginator.num_pages
+            data['count'] = page.paginator.count
+        return serialization.dumps(data)
+
+    def get(self, request, *args, **kwargs):
+        key = self.get_cache_key()
+        cached = cache.get(key)
+        if cached is None:
+            content = self.get_content()
+            cached = (content, hashlib.md5(force_bytes(content)).hexdigest())
+            timeout = getattr(settings, 'LEAFLET_STORAGE_PICTOGRAM_LIST_CACHE_TIMEOUT', 60 * 60 * 24)
+            cache.set(key, cached, timeout)
+        content, etag = cached
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content)
+        response['ETag'] = '"%s"' % etag
+        return response
+
+
+class PictogramSpriteView(View):
+    """
+    Serve a pictogram sprite sheet or its atlas. Their names change with
+    their content, so let any cache keep them for long.
+    """
+    CONTENT_TYPES = {
+        'png': 'image/png',
+        'json': 'application/json',
+    }
+
+    def get(self, request, name, ext):
+        path = os.path.join(SPRITES_DIR, "%s.%s" % (name, ext))
+        if not default_storage.exists(path):
+            raise Http404
+        response = CompatibleStreamingHttpResponse(
+            FileWrapper(default_storage.open(path), STREAMING_BLOCK_SIZE),
+            content_type=self.CONTENT_TYPES[ext]
+        )
+        response['Content-Length'] = str(default_storage.size(path))
+        max_age = getattr(settings, 'LEAFLET_STORAGE_SPRITE_MAX_AGE', 60 * 60 * 24 * 365)
+        patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+        return response
 
 
 # ############## #